@@ -0,0 +1,224 @@
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from db import get_database
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+alert_logger = logging.getLogger("camera_service.alert_dispatcher")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+_STOP = object()  # Sentinel used to wake up and stop the sender thread
+
+
+class AlertDispatcher:
+    """
+    Asynchronous, deduplicated sender for the alerts API.
+
+    enqueue() never blocks on the network and is safe to call from every camera
+    thread: it drops alerts for the same (camera, vehicle_id, alert type) seen
+    less than `cooldown` seconds ago and puts the rest on a bounded queue.
+    A background thread posts them through a pooled requests.Session, retrying
+    with exponential backoff. Alerts that still fail (or are pending at shutdown)
+    are stored in the pending_alerts table and resent every `retry_interval`
+    seconds, so they survive restarts.
+    """
+
+    def __init__(self, url, db_path, cooldown=60, queue_size=1000, max_attempts=5,
+                 backoff_base=1.0, backoff_max=60.0, retry_interval=60.0, timeout=5):
+        self.url = url
+        self.db_path = db_path
+        self.cooldown = cooldown
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self._last_sent = {}  # (camera_id, vehicle_id, alert_type) -> monotonic time of the last enqueue
+        self._last_sent_lock = threading.Lock()  # enqueue() is called from every camera thread
+        self._stopping = threading.Event()
+        self.sent = 0
+        self.failed = 0
+        self.suppressed = 0
+        self.dropped = 0
+
+    def start(self):
+        """Starts the sender thread (no-op if it is already running)."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self._stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="alert_dispatcher", daemon=True)
+        self.thread.start()
+
+    def enqueue(self, vehicle_id, x_pos, y_pos, alert_type="Sentido contrario", camera_id=None):
+        """Queues an alert unless the same one was queued less than `cooldown` seconds ago."""
+        now = time.monotonic()
+        key = (camera_id, str(vehicle_id), alert_type)  # Tracklet ids repeat across cameras
+        with self._last_sent_lock:
+            last = self._last_sent.get(key)
+            if last is not None and now - last < self.cooldown:
+                self.suppressed += 1
+                return False
+            if len(self._last_sent) > 1000:
+                # Forget vehicles whose cooldown is over so the dict stays small
+                self._last_sent = {k: t for k, t in self._last_sent.items() if now - t < self.cooldown}
+            self._last_sent[key] = now
+
+        alert = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "vehicle_id": str(vehicle_id),
+            "x_position": x_pos,
+            "y_position": y_pos,
+            "alert": alert_type,
+            "camera_id": camera_id,  # Which camera fired it, as the vehicle ids repeat across cameras
+        }
+        try:
+            self.queue.put_nowait(alert)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            with log_lock:
+                alert_logger.warning(f"⚠️ Alert queue full, alert dropped: {alert}")
+            return False
+
+    def stats(self):
+        """Returns the queue depth and the sent/failed/suppressed/dropped counters."""
+        return {
+            "queue_depth": self.queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "suppressed": self.suppressed,
+            "dropped": self.dropped,
+        }
+
+    def close(self, timeout=15.0):
+        """Tries to send what is queued once more, persists the rest and stops the thread."""
+        if self.thread is None:
+            return
+        self._stopping.set()
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        self.thread = None
+        with log_lock:
+            alert_logger.info(f"✅ Alert dispatcher stopped: {self.stats()}")
+
+    def _post(self, session, alert):
+        """Posts an alert once. Returns True if the API accepted it."""
+        try:
+            response = session.post(self.url, json=alert, timeout=self.timeout)
+            if response.status_code == 200:
+                with log_lock:
+                    alert_logger.info("✅ Alerta enviada correctamente")
+                return True
+            with log_lock:
+                alert_logger.warning(f"⚠️ Fallo en el envío de alerta, status: {response.status_code}")
+        except requests.exceptions.RequestException:
+            with log_lock:
+                alert_logger.error("❌ No se pudo enviar la alerta")
+        return False
+
+    def _send(self, session, alert):
+        """Posts an alert retrying with exponential backoff (a single attempt while stopping)."""
+        for attempt in range(self.max_attempts):
+            if self._post(session, alert):
+                self.sent += 1
+                return True
+            if self._stopping.is_set():
+                break
+            delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+            if self._stopping.wait(delay):
+                break
+        self.failed += 1
+        return False
+
+    def _persist(self, conn, alert):
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO pending_alerts (timestamp, vehicle_id, x_position, y_position, alert, camera_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        alert["timestamp"], alert["vehicle_id"], alert["x_position"], alert["y_position"],
+                        alert["alert"], alert["camera_id"],
+                    ),
+                )
+            with log_lock:
+                alert_logger.warning(f"⚠️ Alert stored to be resent later: {alert}")
+        except sqlite3.Error as e:
+            with log_lock:
+                alert_logger.error(f"❌ Error storing pending alert: {e}")
+
+    def _resend_pending(self, conn, session):
+        """Resends the alerts stored by previous failures (oldest first), stopping at the first failure."""
+        try:
+            rows = conn.execute(
+                "SELECT id, timestamp, vehicle_id, x_position, y_position, alert, camera_id FROM pending_alerts "
+                "ORDER BY id LIMIT 100"
+            ).fetchall()
+        except sqlite3.Error as e:
+            with log_lock:
+                alert_logger.error(f"❌ Error reading pending alerts: {e}")
+            return
+        for row_id, timestamp, vehicle_id, x_pos, y_pos, alert_type, camera_id in rows:
+            alert = {
+                "timestamp": timestamp,
+                "vehicle_id": vehicle_id,
+                "x_position": x_pos,
+                "y_position": y_pos,
+                "alert": alert_type,
+                "camera_id": camera_id,
+            }
+            if not self._post(session, alert):
+                return
+            self.sent += 1
+            with conn:
+                conn.execute("DELETE FROM pending_alerts WHERE id = ?", (row_id,))
+
+    def _run(self):
+        database = get_database(self.db_path)
+        conn = database.writer()
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        next_resend = 0.0
+        try:
+            while True:
+                if time.monotonic() >= next_resend and not self._stopping.is_set():
+                    self._resend_pending(conn, session)
+                    next_resend = time.monotonic() + self.retry_interval
+                try:
+                    alert = self.queue.get(timeout=max(0.0, next_resend - time.monotonic()))
+                except queue.Empty:
+                    continue
+                if alert is _STOP:
+                    break
+                if not self._send(session, alert):
+                    self._persist(conn, alert)
+
+            # Stopping: whatever could not be sent goes to pending_alerts
+            while True:
+                try:
+                    alert = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if alert is not _STOP and not self._send(session, alert):
+                    self._persist(conn, alert)
+        except Exception as e:
+            with log_lock:
+                alert_logger.error(f"❌ Alert dispatcher stopped unexpectedly: {e}")
+        finally:
+            session.close()
+            database.close()
@@ -1,6 +1,5 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import time
 import cv2
 import numpy as np
@@ -11,6 +10,12 @@ from datetime import datetime, timedelta
 import threading
 import yaml
 from config_loader import load_config
+from frame_channel import FrameReader
+from db import get_database
+from migrations import epoch_ms, format_epoch_ms
+from partitions import read_latest
+from rollups import count_vehicles, read_totals
+from db_maintenance import page_stats, read_report
 import subprocess
 
 # Load Config
@@ -21,11 +26,17 @@ DB_PATH = config["data"]["db_path"]
 LOG_DIR = config["logging"]["log_dir"]
 API_URL = config["application"]["api_last_upload_url"]
 STATUS_FILE = config["data"]["status_file"]
+MAINTENANCE_REPORT = config["data"]["db_maintenance_report"]
+PREVIEW_FRAME_PATH = config["data"]["preview_frame_path"]
 SUM_LAB_LOGO = config["data"]["sumlab_logo"]
 EU_FOOTER = config["data"]["eu_footer"]
 MONITORED_LOGS = config["logging"]["monitored_logs"]
 PREVIEW_REFRESH_RATE = 0.5  # Refresh rate for camera preview in seconds
 
+# Create or upgrade the database schema before the first query (see migrations) and switch it to WAL
+database = get_database(DB_PATH)
+database.prepare()
+
 # codigo para reiniciar el servicio
 SESSION_NAME = "hilos"
 COMANDO_RELANZAR = "cd /home/pi/oak-sumlab/app && python3 start_theads.py"
@@ -40,36 +51,35 @@ def lanzar_screen(nombre, comando):
 
 def get_detection_history(show_image):
     """Retrieves detection history from the database."""
-    conn = sqlite3.connect(DB_PATH)
+    columns = ["timestamp", "vehicle_id", "x_position", "y_position", "direction"]
     if show_image:
-        df = pd.read_sql_query("SELECT * FROM detections ORDER BY timestamp DESC LIMIT 50", conn)
-    else:
-        df = pd.read_sql_query("SELECT timestamp, vehicle_id, x_position, y_position, direction FROM detections ORDER BY timestamp DESC LIMIT 50", conn)
-    conn.close()
+        columns.append("image_key")
+    # Only the newest partitions are read, not the UNION ALL of all of them
+    df = pd.DataFrame(read_latest(database.reader(), columns, 50), columns=columns)
+    df["timestamp"] = df["timestamp"].map(format_epoch_ms)  # Stored as epoch ms
     return df
 
 def update_config(send_image, preview_refresh_rate):
     """Updates the send_image and preview refresh rate in the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE config SET send_image = ?, refresh_rate = ? WHERE id = 1", (send_image,preview_refresh_rate))
-    conn.commit()
-    conn.close()
+    conn = database.writer()
+    with conn:
+        conn.execute("UPDATE config SET send_image = ?, refresh_rate = ? WHERE id = 1", (send_image,preview_refresh_rate))
 
 
     
-def get_last_preview_image():
-    """Retrieves the last preview image from the preview_images table."""
+preview_reader = FrameReader(PREVIEW_FRAME_PATH)
+
+def get_last_preview_image(last_seq=None):
+    """Retrieves the newest preview frame from the shared latest-frame channel.
+
+    Returns (frame number, JPEG bytes), or None if there is no frame newer than last_seq.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT image FROM preview_images LIMIT 1")
-        result = cursor.fetchone()
-        conn.close()
+        result = preview_reader.read(last_seq)
     except Exception as e:
         st.error(f"Error retrieving last preview image: {e}")
         return None
-    return result[0] if result and result[0] else None
+    return (result[0], result[2]) if result else None
 
 
 
@@ -85,15 +95,15 @@ def get_last_upload_time():
         return "N/A"
 
 def get_vehicle_count_last_hour():
-    """Gets the number of vehicles detected in the last hour."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    """Gets the number of vehicles detected in the last hour (from the per-minute rollups)."""
     one_hour_ago = datetime.now() - timedelta(hours=1)
-    cursor.execute("SELECT COUNT(DISTINCT vehicle_id) FROM detections WHERE timestamp >= ?",
-                   (one_hour_ago.strftime("%Y-%m-%d %H:%M:%S"),))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return count_vehicles(database.reader(), epoch_ms(one_hour_ago))
+
+def get_traffic_last_hour():
+    """Vehicles, wrong-way vehicles and mean position by direction and class in the last hour."""
+    now = datetime.now()
+    rows = read_totals(database.reader(), epoch_ms(now - timedelta(hours=1)), epoch_ms(now) + 60 * 1000)
+    return pd.DataFrame(rows, columns=["direction", "class", "vehicles", "wrong_way", "mean_x", "mean_y"]).round(1)
 
 def read_log_file(log_file_name):
     """Reads a log file and returns its content (last 100 lines, reversed)."""
@@ -135,6 +145,17 @@ def get_db_size():
     except FileNotFoundError:
         return "N/A"
 
+def get_db_maintenance_stats():
+    """Free pages now (from the database header) and the last report of the maintenance job."""
+    try:
+        stats = page_stats(database.reader())
+    except Exception:
+        return None
+    report = read_report(MAINTENANCE_REPORT)
+    stats["fragmentation"] = report.get("fragmentation")
+    stats["last_maintenance"] = report.get("last_run")
+    return stats
+
 
 # --- Main App ---
 st.set_page_config(layout="wide")  # Use the whole window
@@ -253,6 +274,7 @@ if st.session_state.page == "Main View":
         frame_placeholder = st.empty()
 
     # Main loop (only for data retrieval and display)
+    last_preview_seq = None  # Frame number of the preview on screen
     while True:
         if st.session_state.table_refresh:
             df = get_detection_history(st.session_state.table_refresh)
@@ -262,13 +284,15 @@ if st.session_state.page == "Main View":
 
             tabla_placeholder.dataframe(df)
         if st.session_state.show_image:
-            image_data = get_last_preview_image()
-            if image_data:
+            preview = get_last_preview_image(last_preview_seq)
+            if preview:  # Only decode and redraw when the camera published a new frame
+                last_preview_seq, image_data = preview
                 nparr = np.frombuffer(image_data, np.uint8)
                 frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                 frame_placeholder.image(frame, channels="BGR", use_container_width=True)
         
         elif not st.session_state.show_image:
+            last_preview_seq = None
             frame_placeholder.empty()
         time.sleep(st.session_state.preview_refresh_rate)  # Adjust refresh rate as needed (e.g., every 0.5 seconds)
 
@@ -299,6 +323,10 @@ elif st.session_state.page == "Monitoring":
             st.markdown(f"<span style='color:green'>🟢 delete_old_images: Running</span>", unsafe_allow_html=True)
         else:
             st.markdown(f"<span style='color:red'>🔴 delete_old_images: Stopped</span>", unsafe_allow_html=True)
+        if get_thread_status("database_maintenance"):
+            st.markdown(f"<span style='color:green'>🟢 database_maintenance: Running</span>", unsafe_allow_html=True)
+        else:
+            st.markdown(f"<span style='color:red'>🔴 database_maintenance: Stopped</span>", unsafe_allow_html=True)
         if get_thread_status("fastapi_server"):
             st.markdown(f"<span style='color:green'>🟢 fastapi_server: Running</span>", unsafe_allow_html=True)
         else:
@@ -313,9 +341,19 @@ elif st.session_state.page == "Monitoring":
 
         vehicle_count = get_vehicle_count_last_hour()
         st.markdown(f"Vehicles in Last Hour: {vehicle_count}")
+        st.dataframe(get_traffic_last_hour())
         
         db_size = get_db_size()  # Call the function to get the database size
         st.markdown(f"Local DB Size: {db_size}")  # Display the database size
+        maintenance_stats = get_db_maintenance_stats()
+        if maintenance_stats is not None:
+            fragmentation = maintenance_stats["fragmentation"]
+            st.markdown(
+                f"Free Pages: {maintenance_stats['free_pages']} of {maintenance_stats['page_count']} "
+                f"({maintenance_stats['free_mb']:.2f} MB, {maintenance_stats['free_ratio']:.1%})"
+            )
+            st.markdown(f"Fragmentation: {'N/A' if fragmentation is None else f'{fragmentation:.1%}'}")
+            st.markdown(f"Last Maintenance: {maintenance_stats['last_maintenance'] or 'N/A'}")
 
     # --- Right Column ---
     with col_right:
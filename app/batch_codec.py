@@ -0,0 +1,156 @@
+"""
+Compact binary encoding of the detection batches posted to /subir-detecciones.
+
+The same columns as the local archive (detection_archive.COLUMNS), in one
+payload:
+
+    magic (8 bytes) | header length (u32) | header (JSON) | column data
+
+    id, timestamp   int64 differences to the previous row (epoch ms)
+    positions ...   float32, NULL is NaN
+    vehicle_id ...  int16/int32 codes into dictionaries kept in the header
+
+The whole payload is compressed with zstd (when the zstandard package is
+installed) or gzip, named in Content-Encoding, and sent with Content-Type
+CONTENT_TYPE. The server answers 415 to a format it cannot read and the
+uploader falls back to the next one, down to the JSON list of objects.
+
+Timestamps travel as epoch ms and the server formats them as the text the
+master database keeps, in the uploader's local time: the header carries its
+UTC offsets, one [from epoch ms, offset ms] pair per offset in the batch (more
+than one when it spans a daylight saving change). utc_offset_ms is the offset
+of the first row, for servers that only read that one.
+"""
+import gzip
+import json
+import struct
+import time
+
+import numpy as np
+
+from detection_archive import COLUMNS, encode_column, decode_column
+
+try:
+    import zstandard
+except ImportError:  # Optional: gzip is always available
+    zstandard = None
+
+CONTENT_TYPE = "application/x-detection-batch"
+MAGIC = b"DETBAT01"
+HEADER_LENGTH = struct.Struct("<I")
+
+# Preferred first; the uploader falls back along this list (None = JSON)
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+# Positions, speeds and headings are stored with at most this many decimals
+FLOAT_DECIMALS = 3
+
+
+def _compress(payload, encoding):
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    if encoding == "gzip":
+        return gzip.compress(payload, compresslevel=6)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def _decompress(body, encoding):
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(body)
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if not encoding or encoding == "identity":
+        return body
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def supports(encoding):
+    """True if this side can read and write the given Content-Encoding."""
+    return encoding in ENCODINGS or encoding in (None, "", "identity")
+
+
+def _utc_offsets(timestamps):
+    """[[from_ms, offset_ms], ...] of the local UTC offset over the given epoch ms timestamps."""
+    offsets = []
+    # Offsets change on whole minutes, so one localtime() call per minute is enough
+    for minute in np.unique(np.asarray(timestamps, dtype=np.int64) // 60000).tolist():
+        offset = time.localtime(minute * 60).tm_gmtoff * 1000
+        if not offsets or offsets[-1][1] != offset:
+            offsets.append([minute * 60000, offset])
+    return offsets
+
+
+def encode_rows(rows, encoding):
+    """Rows (tuples in detection_archive.COLUMN_NAMES order) -> compressed payload."""
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    dictionaries = {name: {} for name, kind in COLUMNS if kind == "dictionary"}
+    descriptions = []
+    buffers = []
+    for index, (name, kind) in enumerate(COLUMNS):
+        array = encode_column(kind, columns[index], dictionaries.get(name))
+        if kind == "dictionary" and len(dictionaries[name]) < 2 ** 15:
+            array = array.astype(np.int16)
+        descriptions.append([name, kind, array.dtype.str, array.nbytes])
+        buffers.append(array.tobytes())
+    utc_offsets = _utc_offsets(columns[1] if rows else [time.time() * 1000])
+    header = json.dumps({
+        "rows": len(rows),
+        "utc_offset_ms": utc_offsets[0][1],
+        "utc_offsets": utc_offsets,
+        "columns": descriptions,
+        "dictionaries": {name: list(values) for name, values in dictionaries.items()},
+    }).encode()
+    return _compress(MAGIC + HEADER_LENGTH.pack(len(header)) + header + b"".join(buffers), encoding)
+
+
+def decode_columns(body, encoding):
+    """Compressed payload -> (header, {column: array})."""
+    payload = _decompress(body, encoding)
+    if payload[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a detection batch")
+    (length,) = HEADER_LENGTH.unpack_from(payload, len(MAGIC))
+    offset = len(MAGIC) + HEADER_LENGTH.size
+    header = json.loads(payload[offset:offset + length])
+    offset += length
+    columns = {}
+    for name, kind, dtype, nbytes in header["columns"]:
+        array = np.frombuffer(payload, dtype=dtype, count=nbytes // np.dtype(dtype).itemsize, offset=offset)
+        if len(array) != header["rows"]:
+            raise ValueError(f"Column {name} has {len(array)} values for {header['rows']} rows")
+        columns[name] = decode_column(kind, array, header["dictionaries"].get(name))
+        offset += nbytes
+    return header, columns
+
+
+def _floats(array):
+    """float32 column -> Python floats rounded to FLOAT_DECIMALS, NaN as None."""
+    values = np.round(array.astype(np.float64), FLOAT_DECIMALS)
+    return [None if v != v else v for v in values.tolist()]
+
+
+def decode_rows(body, encoding):
+    """
+    Compressed payload -> rows (timestamp text, vehicle_id, x_position,
+    y_position, direction, camera_id, speed, heading) as stored in
+    master_detections.
+    """
+    header, columns = decode_columns(body, encoding)
+    timestamps = columns["timestamp"]
+    if not len(timestamps):
+        return []  # np.char cannot work on an empty array
+    utc_offsets = np.array(header.get("utc_offsets") or [[0, header["utc_offset_ms"]]], dtype=np.int64)
+    # Offset in force at each row (rows before the first change point take the first offset)
+    offsets = utc_offsets[np.maximum(np.searchsorted(utc_offsets[:, 0], timestamps, side="right") - 1, 0), 1]
+    # Local time of the uploader, formatted like migrations.format_epoch_ms
+    local = (timestamps + offsets).astype("datetime64[ms]").astype("datetime64[s]")
+    timestamps = np.char.replace(local.astype(str), "T", " ").tolist()
+    return list(zip(
+        timestamps,
+        columns["vehicle_id"].tolist(),
+        _floats(columns["x_position"]),
+        _floats(columns["y_position"]),
+        columns["direction"].tolist(),
+        columns["camera_id"].tolist(),
+        _floats(columns["speed"]),
+        _floats(columns["heading"]),
+    ))
@@ -0,0 +1,64 @@
+import os
+
+DEFAULT_CAMERA_ID = "cam0"
+
+# Keys a camera entry can override, with the section of config.yaml that gives the default
+CAMERA_DEFAULTS = {
+    "oak_camera": [
+        "preview_size_x", "preview_size_y", "fps", "number_of_detection_classes", "pacing", "pacing_sleep",
+    ],
+    "tracklet_log": ["record", "record_frames", "record_path", "replay_path", "replay_speed"],
+    "data": ["preview_frame_path"],
+    "velocity": ["homography"],
+    "tracker_snapshot": ["snapshot_path"],
+}
+
+
+def _per_camera_path(path, camera_id):
+    """../data/preview_frame.mmap -> ../data/preview_frame_<camera_id>.mmap"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{camera_id}{ext}"
+
+
+def load_camera_settings(config):
+    """
+    Returns the settings of every camera stream as a list of dicts.
+
+    Each entry of the `cameras` section overrides the oak_camera, tracklet_log,
+    data.preview_frame_path, velocity.homography, tracker_snapshot.snapshot_path,
+    zones and counting_lines defaults for one stream, and may set `device`
+    (MxID or IP of the OAK, empty for the first one found). Without a
+    `cameras` section there is a single stream, DEFAULT_CAMERA_ID, with the
+    global settings, so single-camera setups behave as before.
+
+    Streams after the first one get their own preview, record and snapshot
+    files (suffixed with the camera id) unless their entry sets them, and
+    never inherit the global replay_path.
+    """
+    entries = config.get("cameras") or [{"id": DEFAULT_CAMERA_ID}]
+    defaults = {
+        "device": None,
+        "zones": config.get("zones") or [],
+        "counting_lines": config.get("counting_lines") or [],
+    }
+    for section, keys in CAMERA_DEFAULTS.items():
+        for key in keys:
+            defaults[key] = config[section][key]
+
+    cameras = []
+    seen = set()
+    for index, entry in enumerate(entries):
+        camera_id = str(entry.get("id", f"cam{index}"))
+        if camera_id in seen:
+            raise ValueError(f"Duplicated camera id {camera_id} in the cameras section")
+        seen.add(camera_id)
+        settings = dict(defaults)
+        if index > 0:
+            settings["preview_frame_path"] = _per_camera_path(defaults["preview_frame_path"], camera_id)
+            settings["record_path"] = _per_camera_path(defaults["record_path"], camera_id)
+            settings["snapshot_path"] = _per_camera_path(defaults["snapshot_path"], camera_id)
+            settings["replay_path"] = None
+        settings.update(entry)
+        settings["id"] = camera_id
+        cameras.append(settings)
+    return cameras
@@ -2,18 +2,31 @@ import depthai as dai
 import cv2
 import numpy as np
 import time
-import sqlite3
-import requests
-from datetime import datetime
 import vehicles_tracker
-from collections import deque
 import os
 import base64
 import traceback
 import logging
 import threading
+import atexit
+import contextlib
 import yaml
 from config_loader import load_config  # Import the function
+from camera_config import load_camera_settings
+from detection_writer import DetectionWriter
+from alert_dispatcher import AlertDispatcher
+from runtime_config import RuntimeConfig
+from frame_channel import FrameWriter
+from image_store import ImageStore, ImageWriter
+from db import get_database
+from migrations import epoch_ms
+from frame_pacer import FramePacer
+from stage_metrics import StageMetrics, camera_metrics, stream_metrics
+from tracklet_log import ReplayDevice, ReplayFinished, TrackletRecorder
+from tracker_snapshot import TrackerSnapshot
+from trajectory_store import TrajectorySummarizer
+from zones import ZoneCounter, ZoneMap
+from rollups import MinuteRollups
 
 # Load Config
 config = load_config()
@@ -22,6 +35,7 @@ config = load_config()
 LOG_DIR = config["logging"]["log_dir"]
 DB_PATH = config["data"]["db_path"]
 STATUS_FILE = config["data"]["status_file"]
+IMAGE_STORE_PATH = config["data"]["image_store_path"]
 BLOB_PATH = config["model"]["yolov8n_blob_path"]
 CONFIDENCE_THRESHOLD = config["model"]["confidence_threshold"]
 NUM_CLASSES = config["model"]["num_classes"]
@@ -29,10 +43,32 @@ COORDINATE_SIZE = config["model"]["coordinate_size"]
 IOU_THRESHOLD = config["model"]["iou_threshold"]
 MAX_RETRIES = config["application"]["max_retries"]
 API_ALERT_URL = config["application"]["api_alert_url"]
-OAK_PREVIEW_SIZE_x = config["oak_camera"]["preview_size_x"]
-OAK_PREVIEW_SIZE_y = config["oak_camera"]["preview_size_y"]
-OAK_FPS = config["oak_camera"]["fps"]
-NUMBER_OF_DETECTION_CLASSES = config["oak_camera"]["number_of_detection_classes"]
+CONFIG_POLL_INTERVAL = config["application"]["config_poll_interval"]
+WRITER_BATCH_SIZE = config["detection_writer"]["batch_size"]
+WRITER_FLUSH_INTERVAL = config["detection_writer"]["flush_interval"]
+WRITER_QUEUE_SIZE = config["detection_writer"]["queue_size"]
+IMAGE_QUEUE_SIZE = config["detection_writer"]["image_queue_size"]
+ALERT_COOLDOWN = config["alerts"]["cooldown"]
+ALERT_QUEUE_SIZE = config["alerts"]["queue_size"]
+ALERT_MAX_ATTEMPTS = config["alerts"]["max_attempts"]
+ALERT_BACKOFF_BASE = config["alerts"]["backoff_base"]
+ALERT_BACKOFF_MAX = config["alerts"]["backoff_max"]
+ALERT_RETRY_INTERVAL = config["alerts"]["retry_interval"]
+ALERT_TIMEOUT = config["alerts"]["timeout"]
+METRICS_ENABLED = config["metrics"]["enabled"]
+STORAGE_MODE = config["storage"]["mode"]
+STORAGE_MIN_POINT_MOVEMENT = config["storage"]["min_point_movement"]
+STORAGE_TRAJECTORY_DEADBAND = config["storage"]["trajectory_deadband"]
+ZONE_COUNTS_FLUSH_INTERVAL = config["zone_counts"]["flush_interval"]
+ROLLUPS_FLUSH_INTERVAL = config["rollups"]["flush_interval"]
+WRONG_WAY_MIN_COUNT = config["vehicle_tracker"]["wrong_way_min_count"]
+SNAPSHOT_ENABLED = config["tracker_snapshot"]["enabled"]
+SNAPSHOT_INTERVAL = config["tracker_snapshot"]["interval"]
+SNAPSHOT_MAX_AGE = config["tracker_snapshot"]["max_age"]
+SNAPSHOT_MAX_DISTANCE = config["tracker_snapshot"]["max_distance"]
+SNAPSHOT_RESTORE_WINDOW = config["tracker_snapshot"]["restore_window_frames"]
+# One entry per OAK camera (oak_camera, tracklet_log and preview settings merged with the cameras section)
+CAMERA_SETTINGS = load_camera_settings(config)
 
 # Ensure the log directory exists
 if not os.path.exists(LOG_DIR):
@@ -52,12 +88,124 @@ file_handler.setFormatter(
 # Add the file handler to the camera_service logger
 camera_logger.addHandler(file_handler)
 
-# Initialize VehicleTracker
-vt = vehicles_tracker.VehicleTracker()
-
 # Create a lock for logging
 log_lock = threading.Lock()
 
+# Write-behind stage for detections, started in main()
+detection_writer = DetectionWriter(
+    DB_PATH,
+    batch_size=WRITER_BATCH_SIZE,
+    flush_interval=WRITER_FLUSH_INTERVAL,
+    queue_size=WRITER_QUEUE_SIZE,
+)
+
+# Background sender for alerts, started in main()
+alert_dispatcher = AlertDispatcher(
+    API_ALERT_URL,
+    DB_PATH,
+    cooldown=ALERT_COOLDOWN,
+    queue_size=ALERT_QUEUE_SIZE,
+    max_attempts=ALERT_MAX_ATTEMPTS,
+    backoff_base=ALERT_BACKOFF_BASE,
+    backoff_max=ALERT_BACKOFF_MAX,
+    retry_interval=ALERT_RETRY_INTERVAL,
+    timeout=ALERT_TIMEOUT,
+)
+
+# Detection images, stored as files referenced by detections.image_key, written in the background
+image_writer = ImageWriter(ImageStore(IMAGE_STORE_PATH), queue_size=IMAGE_QUEUE_SIZE)
+
+# Per-stage latency histograms, exposed by fastapi_server on /camera-metrics
+camera_metrics.enabled = METRICS_ENABLED
+camera_metrics.register_gauge("detection_writer", detection_writer.stats)
+camera_metrics.register_gauge("alert_dispatcher", alert_dispatcher.stats)
+camera_metrics.register_gauge("image_writer", image_writer.stats)
+
+
+class CameraStream:
+    """
+    Everything that belongs to one camera: its settings, tracker state,
+    trajectories, preview channel, dashboard settings and metrics.
+
+    Each stream runs in its own worker (see camera_worker); the detection
+    writer, the image store and the alert dispatcher are shared, so all the
+    streams are written to the database in the same batches.
+    """
+
+    def __init__(self, settings, metrics):
+        self.settings = settings
+        self.camera_id = settings["id"]
+        self.preview_size_x = settings["preview_size_x"]
+        self.preview_size_y = settings["preview_size_y"]
+        self.fps = settings["fps"]
+        self.labels = settings["number_of_detection_classes"]
+        self.metrics = metrics
+        self.tracker = vehicles_tracker.VehicleTracker(homography=settings["homography"])
+        # One compact record per track (trajectories table) and thinning of the per-frame rows
+        self.trajectories = TrajectorySummarizer(
+            detection_writer,
+            self.tracker,
+            mode=STORAGE_MODE,
+            min_point_movement=STORAGE_MIN_POINT_MOVEMENT,
+            deadband=STORAGE_TRAJECTORY_DEADBAND,
+            camera_id=self.camera_id,
+        )
+        # Per-minute counters by direction and class (detection_rollups table)
+        self.rollups = MinuteRollups(
+            detection_writer, self.tracker, vehicles_tracker.DIRECTION_NAMES, camera_id=self.camera_id,
+            wrong_way_min_count=WRONG_WAY_MIN_COUNT, flush_interval=ROLLUPS_FLUSH_INTERVAL,
+        )
+        # Zones and counting lines of this camera (None if it has none)
+        zone_map = ZoneMap(settings["zones"], settings["counting_lines"], self.preview_size_x, self.preview_size_y)
+        self.zones = None
+        if zone_map:
+            self.zones = ZoneCounter(
+                zone_map, detection_writer, self.tracker, camera_id=self.camera_id,
+                flush_interval=ZONE_COUNTS_FLUSH_INTERVAL,
+            )
+        # Periodic snapshots of the tracker, restored when the pipeline is opened again (not for replays)
+        self.snapshot = None
+        if SNAPSHOT_ENABLED and not settings["replay_path"]:
+            self.snapshot = TrackerSnapshot(
+                settings["snapshot_path"], self.tracker, interval=SNAPSHOT_INTERVAL, max_age=SNAPSHOT_MAX_AGE,
+                max_distance=SNAPSHOT_MAX_DISTANCE, window_frames=SNAPSHOT_RESTORE_WINDOW,
+            )
+        # Latest-frame channel shared with the Streamlit app and the FastAPI server
+        self.preview_channel = FrameWriter(settings["preview_frame_path"])
+        # Dashboard settings (send_image, refresh_rate) kept in memory for the camera loop
+        self.runtime_config = RuntimeConfig(DB_PATH, poll_interval=CONFIG_POLL_INTERVAL)
+        self.metrics.register_gauge("vehicle_tracker", self.tracker.stats)
+        self.metrics.register_gauge("trajectories", self.trajectories.stats)
+        self.metrics.register_gauge("rollups", self.rollups.stats)
+        if self.zones is not None:
+            self.metrics.register_gauge("zone_counts", self.zones.stats)
+        if self.snapshot is not None:
+            self.metrics.register_gauge("tracker_snapshot", self.snapshot.stats)
+
+    def close(self):
+        """Stores the tracks still open, the last zone counts and a last tracker snapshot."""
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.trajectories.close()
+        self.rollups.close()
+        if self.zones is not None:
+            self.zones.close()
+
+
+def create_streams():
+    """Creates a CameraStream per configured camera."""
+    streams = []
+    for settings in CAMERA_SETTINGS:
+        if len(CAMERA_SETTINGS) == 1:
+            metrics = camera_metrics  # Single camera: everything on /camera-metrics as before
+        else:
+            metrics = stream_metrics.setdefault(settings["id"], StageMetrics(enabled=METRICS_ENABLED))
+        streams.append(CameraStream(settings, metrics))
+    return streams
+
+
+camera_streams = create_streams()
+
 
 def update_status(thread_name, status, lock):  # Receive the lock as a parameter
     """Updates the status in the status.yaml file."""
@@ -72,171 +220,60 @@ def update_status(thread_name, status, lock):  # Receive the lock as a parameter
             yaml.dump(data, f)
 
 
-# Initialize the database (if it doesn't exist)
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-if  os.path.exists(DB_PATH):
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS detections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            vehicle_id TEXT,
-            x_position REAL,
-            y_position REAL,
-            direction TEXT,
-            image BLOB
-        )
-    """
-    )
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS config (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            send_image BOOLEAN,
-            refresh_rate REAL
-        )
-    """
-    )
-    cursor.execute("INSERT INTO config (send_image, refresh_rate) VALUES (?,?)", (False,0.5))
-    conn.commit()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS preview_images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image BLOB
-        )
-    """
-    )
-    cursor.execute("INSERT INTO preview_images (image) VALUES (?)", (None,))
-    conn.commit()
- 
-conn.close()
+# Create or upgrade the database schema (see migrations) and switch it to WAL
+database = get_database(DB_PATH)
+database.prepare()
+camera_metrics.register_gauge("database", database.stats)
 
 
-def save_detection(vehicle_id, x_pos, y_pos, direction, image_data=None):
-    """Saves a vehicle detection to the database."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute(
-            "INSERT INTO detections (timestamp, vehicle_id, x_position, y_position, direction, image) VALUES (?, ?, ?, ?, ?, ?)",
-            (timestamp, vehicle_id, x_pos, y_pos, direction, image_data),
-        )
-        conn.commit()
+def save_detection(vehicle_id, x_pos, y_pos, direction, image_data=None, camera_id=None, speed=None, heading=None):
+    """Queues a vehicle detection for the background database writer (the image for the image writer)."""
+    timestamp = epoch_ms()
+    image_key = None
+    if image_data is not None:
+        image_key = image_writer.put(image_data)
+    if detection_writer.put((timestamp, vehicle_id, x_pos, y_pos, direction, image_key, camera_id, speed, heading)):
         with log_lock:
-            camera_logger.debug(f"✅ Detection saved: {vehicle_id} at ({x_pos}, {y_pos}) in direction {direction}")
-    except sqlite3.Error as e:
-        with log_lock:
-            camera_logger.error(f"❌ Error saving detection: {e}")
-    finally:
-        conn.close()
-
-def save_image(image_data=None):
-    """Saves an image to the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-   
-    try: 
-        cursor.execute("DELETE FROM preview_images")   
-        cursor.execute(
-            f"INSERT into preview_images (image) VALUES (?)", (image_data,)
-        )
-        
-        conn.commit()
-       
-    except sqlite3.Error as e:  
+            camera_logger.debug(f"✅ Detection queued: {vehicle_id} at ({x_pos}, {y_pos}) in direction {direction}")
+
+def save_image(stream, image_data=None):
+    """Publishes the preview image in the latest-frame channel of the stream."""
+    try:
+        stream.preview_channel.publish(image_data)
+    except ValueError as e:
         with log_lock:
             camera_logger.error(f"❌ Error saving image: {e}")
-    finally:
-        conn.close()
-    
 
-def send_alert(vehicle_id, x_pos, y_pos, alert_type="Sentido contrario"):
+
+def send_alert(vehicle_id, x_pos, y_pos, alert_type="Sentido contrario", camera_id=None):
     """
-    Sends an alert with vehicle information to a specified API endpoint.
+    Queues an alert with vehicle information for the alerts API endpoint.
     Args:
         vehicle_id (str): The ID of the vehicle.
         x_pos (float): The x-coordinate position of the vehicle.
         y_pos (float): The y-coordinate position of the vehicle.
         alert_type (str): the type of the alert
+        camera_id (str): the camera that saw the vehicle (tracklet ids repeat across cameras)
     Returns:
         None
-    Raises:
-        requests.exceptions.RequestException: If there is an issue with the HTTP request.
-    The function sends a POST request to the API endpoint with the vehicle information
-    and a timestamp. If the request is successful, it prints a success message. If the
-    request fails, it prints a failure message and indicates that the alert will be
-    retried in the next detection.
+    The alert is only enqueued: the AlertDispatcher thread posts it, drops repeats
+    of the same alert for the same vehicle within the cooldown, retries with
+    backoff and stores undelivered alerts to resend them later.
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data = {
-        "timestamp": timestamp,
-        "vehicle_id": vehicle_id,
-        "x_position": x_pos,
-        "y_position": y_pos,
-        "alert": alert_type,
-    }
+    alert_dispatcher.enqueue(vehicle_id, x_pos, y_pos, alert_type, camera_id=camera_id)
 
-    try:
-        response = requests.post(API_ALERT_URL, json=data, timeout=5)
-        if response.status_code == 200:
-            with log_lock:
-                camera_logger.info("✅ Alerta enviada correctamente")
-        else:
-            with log_lock:
-                camera_logger.warning(
-                    f"⚠️ Fallo en el envío de alerta, status: {response.status_code}"
-                )
-    except requests.exceptions.RequestException:
-        with log_lock:
-            camera_logger.error(
-                "❌ No se pudo enviar la alerta, se reintentará en la siguiente detección."
-            )
-
-
-def get_config():
-    """Gets the configuration (send_image status) from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT send_image FROM config WHERE id = 1")
-        result = cursor.fetchone()
-        return result[0] if result else False
-    except sqlite3.Error as e:
-        with log_lock:
-            camera_logger.error(f"❌ Error getting config: {e}")
-        return False  # Default to False in case of error
-    finally:
-        conn.close()
-
-def get_refresh_rate():
-    """Gets the refresh rate (in seconds) from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    try:    
-        cursor.execute("SELECT refresh_rate FROM config WHERE id = 1")
-        result = cursor.fetchone()
-        return result[0] if result else 0.5
-    except sqlite3.Error as e:
-        with log_lock:
-            camera_logger.error(f"❌ Error getting refresh rate: {e}")
-        return 0.5  # Default to 0.5 in case of error
-    finally:
-        conn.close()    
 
-def initialize_camera():
+def initialize_camera(stream):
     """
-    Initializes the OAK-1 camera and returns the pipeline.
+    Initializes the pipeline of an OAK-1 camera and returns it.
     """
     try:
         
         pipeline = dai.Pipeline()
         cam_rgb = pipeline.create(dai.node.ColorCamera)
-        cam_rgb.setPreviewSize(OAK_PREVIEW_SIZE_x, OAK_PREVIEW_SIZE_y)
+        cam_rgb.setPreviewSize(stream.preview_size_x, stream.preview_size_y)
         cam_rgb.setInterleaved(False)
-        cam_rgb.setFps(OAK_FPS)
+        cam_rgb.setFps(stream.fps)
 
         nn = pipeline.create(dai.node.YoloDetectionNetwork)
         nn.setBlobPath(BLOB_PATH)
@@ -248,7 +285,7 @@ def initialize_camera():
         nn.setIouThreshold(IOU_THRESHOLD)
 
         tracker = pipeline.create(dai.node.ObjectTracker)
-        tracker.setDetectionLabelsToTrack(NUMBER_OF_DETECTION_CLASSES)
+        tracker.setDetectionLabelsToTrack(stream.labels)
         tracker.setTrackerType(dai.TrackerType.ZERO_TERM_COLOR_HISTOGRAM)
         tracker.setTrackerIdAssignmentPolicy(
             dai.TrackerIdAssignmentPolicy.UNIQUE_ID
@@ -269,199 +306,290 @@ def initialize_camera():
         cam_rgb.preview.link(xout_rgb.input)
 
         with log_lock:
-            camera_logger.info("✅ Camera initialized successfully.")
+            camera_logger.info(f"✅ Camera {stream.camera_id} initialized successfully.")
         return pipeline
     except Exception as e:
         with log_lock:
-            camera_logger.error(f"❌ Error initializing camera: {e}")
+            camera_logger.error(f"❌ Error initializing camera {stream.camera_id}: {e}")
         return None
 
 
-def run_camera(pipeline):
+def open_device(stream, pipeline):
+    """
+    Opens the OAK device of the stream, or a replay of a recorded tracklet log if
+    its replay_path is set (a simulated camera).
+    """
+    settings = stream.settings
+    if settings["replay_path"]:
+        with log_lock:
+            camera_logger.info(
+                f"🔄 Camera {stream.camera_id}: replaying tracklet log {settings['replay_path']} "
+                f"(speed {settings['replay_speed']})"
+            )
+        return ReplayDevice(settings["replay_path"], speed=settings["replay_speed"])
+    if settings["device"]:
+        return dai.Device(pipeline, dai.DeviceInfo(str(settings["device"])))
+    return dai.Device(pipeline)
+
+
+def open_recorder(stream):
+    """
+    Opens the tracklet recorder of the stream if recording is enabled (a null context otherwise).
+    """
+    settings = stream.settings
+    if settings["record"]:
+        return TrackletRecorder(
+            settings["record_path"], stream.preview_size_x, stream.preview_size_y,
+            record_frames=settings["record_frames"],
+        )
+    return contextlib.nullcontext()
+
+
+def run_camera(stream, pipeline):
     """
-    Runs the camera detection process.
+    Runs the camera detection process of a stream.
     """
-    with dai.Device(pipeline) as device:
+    metrics = stream.metrics
+    runtime_config = stream.runtime_config
+    vt = stream.tracker
+    trajectories = stream.trajectories
+    with open_device(stream, pipeline) as device, open_recorder(stream) as recorder:
         device.setIrFloodLightIntensity(0.5)
         device.setIrLaserDotProjectorIntensity(0.5) 
         q_nn = device.getOutputQueue(name="detections", maxSize=4, blocking=False)
         q_video = device.getOutputQueue(name="video", maxSize=4, blocking=False)
 
+        pacer = FramePacer(
+            stream.fps, mode=stream.settings["pacing"], fixed_sleep=stream.settings["pacing_sleep"], metrics=metrics
+        )
+        metrics.register_gauge("frame_pacer", pacer.stats)
+
+        # New pipeline, new tracklet ids: give the tracks of the last snapshot to the tracklets that reappear
+        if stream.snapshot is not None:
+            stream.snapshot.restore()
+
+        frame_count = 0
+        last_seq = None  # Sequence number of the last tracklets message
+        last_video_seq = None
         while True:
-            frame_count=0
             try:
+                t = time.perf_counter()
                 in_nn = q_nn.get()
+                t = frame_start = metrics.lap("nn_wait", t)
+
+                # Gaps in the device sequence numbers are messages dropped by the non-blocking queue
+                seq = in_nn.getSequenceNum()
+                if last_seq is not None and seq > last_seq + 1:
+                    metrics.increment("frames_dropped", seq - last_seq - 1)
+                last_seq = seq
+
                 tracklets = in_nn.tracklets
-                mov = vt.calculate_tracklet_movement(tracklets)
+                # One pass over the dai objects, everything else is computed on arrays
+                batch = vehicles_tracker.TrackletBatch(
+                    tracklets, stream.preview_size_x, stream.preview_size_y, stream.labels
+                )
+                vt.update_batch(batch, in_nn.getTimestampDevice().total_seconds())
+                if stream.snapshot is not None:
+                    stream.snapshot.maybe_save()
+                t = metrics.lap("tracker", t)
 
-                send_image = get_config()
+                runtime_config.refresh()  # Only touches SQLite every CONFIG_POLL_INTERVAL seconds
+                # While the loop is behind the device, skip the preview to catch up
+                send_image = runtime_config.send_image and not pacer.behind
 
+                frame = None
+                in_video = None
                 if send_image:
                     in_video = q_video.get()
                     frame = in_video.getCvFrame()
-                    refresh_rate = get_refresh_rate()
-
-
-                for detection in tracklets:
-                    if detection.label in (0, 2, 5, 7):
-                        roi = detection.roi.denormalize(
-                            OAK_PREVIEW_SIZE_x, OAK_PREVIEW_SIZE_y
-                        )  # the size of the image
-                        x1 = int(roi.topLeft().x)
-                        y1 = int(roi.topLeft().y)
-                        x2 = int(roi.bottomRight().x)
-                        y2 = int(roi.bottomRight().y)
-                        label = detection.label
-                        x_center = (x1 + x2) // 2
-                        y_center = (y1 + y2) // 2
-                        vehicle_id = detection.id if hasattr(detection, "id") else None
-
-                        if vehicle_id is not None:
-                            direction_history = mov.get(
-                                vehicle_id, None
-                            )  # Get the history or a new deque if not found
-
-                            last_position = "unknown"
-                            if isinstance(direction_history, deque):
-                                direction_history_list = list(direction_history)
-
-                                if len(direction_history) > 0:
-                                    last_position = direction_history_list[-1]
-
-                                    ascending_count = direction_history_list.count(
-                                        "ascending"
-                                    )
-
-                                    if ascending_count >= 5:
-                                        if send_image:
-                                            cv2.putText(
-                                                frame,
-                                                "-> -> ->",
-                                                (x1, y1 - 20),
-                                                cv2.FONT_HERSHEY_SIMPLEX,
-                                                0.6,
-                                                (0, 255, 0),
-                                                2,
-                                            )
-                                        send_alert(vehicle_id, x_center, y1)
-                                    elif (
-                                        direction_history_list[-1] == "ascending"
-                                    ):  # Check only the last direction
-                                        if send_image:
-                                            cv2.putText(
-                                                frame,
-                                                "->",
-                                                (x1, y1 - 20),
-                                                cv2.FONT_HERSHEY_SIMPLEX,
-                                                0.6,
-                                                (0, 255, 0),
-                                                2,
-                                            )
-                                    elif direction_history_list[-1] == "descending":
-                                        if send_image:
-                                            cv2.putText(
-                                                frame,
-                                                "<-",
-                                                (x1, y1 - 20),
-                                                cv2.FONT_HERSHEY_SIMPLEX,
-                                                0.6,
-                                                (0, 255, 0),
-                                                2,
-                                            )
+                    refresh_rate = runtime_config.refresh_rate
+                elif recorder is not None and stream.settings["record_frames"]:
+                    in_video = q_video.tryGet()
+                    if in_video is not None:
+                        frame = in_video.getCvFrame()
+                if in_video is not None:
+                    video_seq = in_video.getSequenceNum()
+                    if last_video_seq is not None and video_seq > last_video_seq + 1:
+                        metrics.increment("video_frames_dropped", video_seq - last_video_seq - 1)
+                    last_video_seq = video_seq
+                    t = metrics.lap("video_wait", t)
+
+                if recorder is not None:
+                    recorder.write(in_nn, frame)
+                    t = metrics.lap("recorder", t)
+
+                rows = np.flatnonzero(batch.selected)
+                if stream.zones is not None:
+                    for vehicle_id, zone_name, x_pos, y_pos in stream.zones.update(batch, rows):
+                        send_alert(vehicle_id, x_pos, y_pos, f"Zona prohibida: {zone_name}", camera_id=stream.camera_id)
+                    t = metrics.lap("zones", t)
+                vehicle_ids = batch.ids[rows].tolist()
+                boxes = batch.pixel_boxes[rows].tolist()
+                centers = batch.pixel_centroids[rows].tolist()
+                directions = batch.direction[rows].tolist()
+                has_history = batch.has_history[rows].tolist()
+                speeds = np.round(batch.speed[rows], 2).tolist()
+                headings = np.round(batch.heading[rows], 1).tolist()
+                wrong_way = (batch.ascending_count[rows] >= WRONG_WAY_MIN_COUNT).tolist()
+
+                last_positions = []
+                for i, vehicle_id in enumerate(vehicle_ids):
+                    x1, y1, x2, y2 = boxes[i]
+                    x_center = centers[i][0]
+
+                    last_position = "unknown"
+                    if has_history[i]:
+                        last_position = vehicles_tracker.DIRECTION_NAMES[directions[i]]
+                        if wrong_way[i]:
                             if send_image:
-                                cv2.rectangle(
-                                    frame, (x1, y1), (x2, y2), (0, 255, 0), 2
-                                )
-                                cv2.putText(
-                                    frame,
-                                    f" {detection.label} id: {vehicle_id}  conf= {detection.srcImgDetection.confidence:0.2f}",
-                                    (x1, y1 - 10),
-                                    cv2.FONT_HERSHEY_SIMPLEX,
-                                    0.5,
-                                    (0, 255, 0),
-                                    2,
-                                )
-                            image_data = None
-                            if send_image:
-                                if frame_count % int(OAK_FPS * refresh_rate) == 0:
-                                    image_data = cv2.imencode(".jpg", frame)[1].tobytes()
-                                    save_image(image_data)
-                                    frame_count=0
-                                else:
-                                    frame_count+=1
-
-                            save_detection(
-                                vehicle_id, x_center, y_center, last_position, image_data
-                            )
-                    else:
-                        if send_image:
-                            if frame_count % int(OAK_FPS * refresh_rate) == 0:
-                                image_data = cv2.imencode(".jpg", frame)[1].tobytes()
-                                save_image(image_data)
-                                frame_count=0
-                            else:
-                                frame_count+=1
-                if not tracklets:
+                                cv2.putText(frame, "-> -> ->", (x1, y1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                            send_alert(vehicle_id, x_center, y1, camera_id=stream.camera_id)
+                        elif send_image and directions[i] == vehicles_tracker.ASCENDING:  # Check only the last direction
+                            cv2.putText(frame, "->", (x1, y1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                        elif send_image and directions[i] == vehicles_tracker.DESCENDING:
+                            cv2.putText(frame, "<-", (x1, y1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                    last_positions.append(last_position)
+
                     if send_image:
-                        if frame_count % int(OAK_FPS * refresh_rate) == 0:
-                            image_data = cv2.imencode(".jpg", frame)[1].tobytes()
-                            save_image(image_data)
-                            frame_count=0
-                        else:
-                            frame_count+=1
-
-                time.sleep(0.03)
+                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                        cv2.putText(
+                            frame,
+                            f" {batch.labels[rows[i]]} id: {vehicle_id}  conf= {batch.confidence[rows[i]]:0.2f}"
+                            + (f"  v= {speeds[i]:0.0f}" if has_history[i] else ""),
+                            (x1, y1 - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX,
+                            0.5,
+                            (0, 255, 0),
+                            2,
+                        )
+
+                if send_image and stream.zones is not None:
+                    stream.zones.zone_map.draw(frame)
+                t = metrics.lap("overlay", t)  # Includes queueing the alerts
+
+                # Encode the preview once per frame, every refresh_rate seconds
+                image_data = None
+                if send_image:
+                    if frame_count % max(1, int(stream.fps * refresh_rate)) == 0:
+                        image_data = cv2.imencode(".jpg", frame)[1].tobytes()
+                        save_image(stream, image_data)
+                        frame_count = 0
+                        t = metrics.lap("encode", t)
+                    frame_count += 1
+
+                now_ms = epoch_ms()
+                trajectories.observe(batch, rows, now_ms)
+                stream.rollups.update(batch, rows, now_ms)
+                for i, vehicle_id in enumerate(vehicle_ids):
+                    if trajectories.should_store_point(vehicle_id, centers[i][0], centers[i][1]):
+                        save_detection(
+                            vehicle_id, centers[i][0], centers[i][1], last_positions[i], image_data, stream.camera_id,
+                            speeds[i] if has_history[i] else None, headings[i] if has_history[i] else None,
+                        )
+                        image_data = None  # The frame is stored with the first detection only
+                t = metrics.lap("store", t)
+
+                metrics.lap("frame_total", frame_start)
+                metrics.increment("frames_processed")
+                metrics.increment("tracklets_processed", len(batch))
+
+                pacer.frame_done(in_nn, time.perf_counter() - frame_start, q_nn.has())
+            except ReplayFinished as e:
+                with log_lock:
+                    camera_logger.info(f"✅ Camera {stream.camera_id}: {e}")
+                break
             except Exception as e:
                 with log_lock:
-                    camera_logger.error(f"❌ Error in camera operation: {e}")
+                    camera_logger.error(f"❌ Error in camera {stream.camera_id} operation: {e}")
                 traceback.print_exc()
 
 
-def main(lock=None):  # Receive the lock as a parameter
+def camera_worker(stream):
     """
-    Main function to handle camera operation with error recovery.
+    Runs one camera with error recovery. Returns True if the stream ended normally
+    (end of a replay) and False if the camera failed max_retries times.
     """
-    update_status("camera_service", 1, lock)  # Pass the lock to update_status
     max_retries = MAX_RETRIES
     retries = 0
     pipeline = None  # Initialize pipeline to None
 
+    if stream.settings["replay_path"]:
+        # Offline mode: the replay device does not need a pipeline nor retries
+        run_camera(stream, None)
+        return True
+
     while retries < max_retries:
         try:
             if pipeline is None:
                 pipeline = (
-                    initialize_camera()
+                    initialize_camera(stream)
                 )  # Initialize the camera only if it's not initialized
             if pipeline is not None:
-                run_camera(pipeline)
+                run_camera(stream, pipeline)
             else:
                 with log_lock:
                     camera_logger.error(
-                        "❌ Pipeline is none, the camera will not run."
+                        f"❌ Pipeline of camera {stream.camera_id} is none, the camera will not run."
                     )
                 break  # if pipeline is none, exit
         except Exception as e:
             with log_lock:
-                camera_logger.error(f"❌ Error in camera operation: {e}")
+                camera_logger.error(f"❌ Error in camera {stream.camera_id} operation: {e}")
             traceback.print_exc()
             retries += 1
             with log_lock:
-                camera_logger.info(f"🔄 Retrying... (attempt {retries}/{max_retries})")
+                camera_logger.info(f"🔄 Retrying camera {stream.camera_id}... (attempt {retries}/{max_retries})")
             pipeline = None  # set pipeline to none to force reinitialization
             time.sleep(5)  # Wait for 5 seconds before retrying
 
     # If it reaches here, it means max retries have been reached
-    update_status("camera_service", 0, lock)  # Pass the lock to update_status
     with log_lock:
         camera_logger.error(
-            f"❌❌❌ Max retries reached ({max_retries}). Sending emergency alert."
+            f"❌❌❌ Max retries reached ({max_retries}) for camera {stream.camera_id}. Sending emergency alert."
         )
     send_alert(
         vehicle_id="SYSTEM",
         x_pos=0,
         y_pos=0,
-        alert_type=f"CAMERA FAILED after {max_retries} retries.",
+        alert_type=f"CAMERA {stream.camera_id} FAILED after {max_retries} retries.",
+        camera_id=stream.camera_id,
     )
+    return False
+
+
+def main(lock=None):  # Receive the lock as a parameter
+    """
+    Main function: runs every configured camera in its own worker thread.
+    """
+    update_status("camera_service", 1, lock)  # Pass the lock to update_status
+    detection_writer.start()
+    alert_dispatcher.start()
+    image_writer.start()
+    atexit.register(detection_writer.close)  # Flush pending detections on interpreter exit
+    atexit.register(image_writer.close)
+    atexit.register(alert_dispatcher.close)
+    for stream in camera_streams:
+        atexit.register(stream.close)  # Runs before the writer is closed (atexit is LIFO)
+
+    if len(camera_streams) == 1:
+        camera_worker(camera_streams[0])
+    else:
+        workers = [
+            threading.Thread(target=camera_worker, args=(stream,), name=f"camera_{stream.camera_id}", daemon=True)
+            for stream in camera_streams
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    # Every camera finished (replays) or gave up (max retries)
+    update_status("camera_service", 0, lock)  # Pass the lock to update_status
+    for stream in camera_streams:
+        stream.close()  # Store the tracks still open and the last zone counts
+    detection_writer.close()  # Flush pending detections before leaving
+    image_writer.close()  # Write the pending detection images before leaving
+    alert_dispatcher.close()  # Send (or store) the emergency alerts before leaving
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+"""
+Shared access to the local SQLite database.
+
+Every module gets its connections from the Database of the file
+(get_database(path)) instead of opening one per operation:
+
+    conn = get_database(DB_PATH).writer()   # Read-write, for INSERT/UPDATE/DELETE
+    conn = get_database(DB_PATH).reader()   # Read-only, for SELECTs
+
+Connections are persistent and per thread (sqlite3 connections must not be
+shared between threads), so each prepared statement is compiled once and
+kept in the connection's statement cache. When a thread ends (Streamlit runs
+every rerun in a new one) its connections are closed with it. The first connection to a file
+applies the pending migrations and switches it to WAL journaling: readers
+see the last committed data and never block the camera's detection writer,
+and the writer never waits for them. Every connection waits up to
+busy_timeout seconds for a lock held by another writer instead of failing
+at once with "database is locked".
+
+Files use incremental auto-vacuum: pages freed by deletes and dropped
+partitions are kept in the freelist until db_maintenance gives them back to
+the filesystem a few at a time. A new file gets it when it is prepared; a
+file created without it is converted once, with a full VACUUM, by the
+db_maintenance job, so no process waits for it at startup.
+"""
+import sqlite3
+import threading
+import weakref
+import logging
+from pathlib import Path
+
+from config_loader import load_config
+from migrations import migrate
+
+# Load Config
+config = load_config()
+
+DB_PATH = config["data"]["db_path"]
+BUSY_TIMEOUT = config["database"]["busy_timeout"]
+SYNCHRONOUS = config["database"]["synchronous"]
+AUTO_VACUUM_INCREMENTAL = 2  # PRAGMA auto_vacuum value
+CACHE_SIZE_MB = config["database"]["cache_size_mb"]
+MMAP_SIZE_MB = config["database"]["mmap_size_mb"]
+CACHED_STATEMENTS = config["database"]["cached_statements"]
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+db_logger = logging.getLogger("camera_service.db")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+
+class _ThreadConnections:
+    """
+    The connections of one thread. Only referenced from that thread's local
+    storage, so it is collected when the thread ends and its finalizers close them.
+    """
+
+    def __init__(self):
+        self.writer = None
+        self.reader = None
+        self.finalizers = {}
+
+
+class Database:
+    """Per-thread persistent connections to one SQLite file."""
+
+    def __init__(self, path, busy_timeout=BUSY_TIMEOUT, synchronous=SYNCHRONOUS, cache_size_mb=CACHE_SIZE_MB,
+                 mmap_size_mb=MMAP_SIZE_MB, cached_statements=CACHED_STATEMENTS):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cache_size_mb = cache_size_mb
+        self.mmap_size_mb = mmap_size_mb
+        self.cached_statements = cached_statements
+        self.journal_mode = None
+        self._local = threading.local()
+        self._connections = []  # Every open connection, to close them all on shutdown
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def prepare(self):
+        """
+        Enables incremental auto-vacuum and WAL and applies the migrations, once
+        per process (done by the first connection anyway).
+        """
+        with self._lock:
+            if self.journal_mode is not None:
+                return
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            try:
+                # Both persistent: stored in the file, so every process and connection uses them.
+                # auto_vacuum only takes effect at once on a new file (db_maintenance converts older ones)
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                self.journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            finally:
+                conn.close()
+            migrate(self.path)
+            if self.journal_mode != "wal":
+                with log_lock:
+                    db_logger.warning(f"⚠️ Could not enable WAL on {self.path}, journal mode is {self.journal_mode}")
+
+    def _connect(self, read_only):
+        self.prepare()
+        if read_only:
+            target, uri = Path(self.path).resolve().as_uri() + "?mode=ro", True
+        else:
+            target, uri = self.path, False
+        # check_same_thread=False only so close_all() can close it from the shutdown thread
+        conn = sqlite3.connect(
+            target, uri=uri, timeout=self.busy_timeout, cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={-int(self.cache_size_mb * 1024)}")  # Negative: KiB instead of pages
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size_mb * 1024 * 1024)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self._connections.append(conn)
+            self.opened += 1
+        return conn
+
+    def _thread_connections(self):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = _ThreadConnections()
+        return connections
+
+    def _thread_connection(self, name):
+        connections = self._thread_connections()
+        conn = getattr(connections, name)
+        if conn is None:
+            conn = self._connect(read_only=name == "reader")
+            setattr(connections, name, conn)
+            # Runs when the thread ends, or at once from close()
+            connections.finalizers[name] = weakref.finalize(connections, self._discard, conn)
+        return conn
+
+    def writer(self):
+        """The read-write connection of the calling thread."""
+        return self._thread_connection("writer")
+
+    def reader(self):
+        """The read-only connection of the calling thread."""
+        return self._thread_connection("reader")
+
+    def close(self):
+        """Closes the connections of the calling thread (e.g. to reconnect after an error)."""
+        connections = self._thread_connections()
+        for name in ("writer", "reader"):
+            if getattr(connections, name) is not None:
+                setattr(connections, name, None)
+                connections.finalizers.pop(name)()
+
+    def close_all(self):
+        """Closes every connection of every thread (on shutdown)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    def stats(self):
+        return {"journal_mode": self.journal_mode, "open_connections": len(self._connections), "opened": self.opened}
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path=DB_PATH):
+    """The shared Database of a file (one per path and process)."""
+    with _databases_lock:
+        database = _databases.get(path)
+        if database is None:
+            database = _databases[path] = Database(path)
+        return database
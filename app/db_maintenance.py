@@ -0,0 +1,184 @@
+"""
+Background maintenance of the local SQLite database.
+
+The database uses incremental auto-vacuum (see db), so the pages freed by
+uploaded partitions, expired rollups and deleted rows stay in the freelist
+until they are reclaimed here. A file created before that setting is
+converted first, with a one-time full VACUUM (it holds the write lock for as
+long as the rebuild takes, so it runs here and not when a process starts).
+Then, every cycle:
+
+- reclaims free pages with PRAGMA incremental_vacuum, step_pages at a time.
+  Each step is its own short write transaction, with a pause after it so the
+  camera's detection writer gets the lock in between. A cycle stops after
+  time_budget seconds even if free pages remain; the next one goes on.
+- every analyze_interval seconds, refreshes the planner statistics with a
+  bounded ANALYZE (analysis_limit rows per index) and PRAGMA optimize.
+- every fragmentation_interval seconds, measures how scattered the b-tree
+  leaf pages are (with the dbstat table, when SQLite is compiled with it).
+
+The results are written to report_file (YAML), which the Monitoring page
+shows next to the live free-page counters.
+"""
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+import yaml
+
+from db import AUTO_VACUUM_INCREMENTAL
+from migrations import epoch_ms, format_epoch_ms
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+maintenance_logger = logging.getLogger("camera_service.db_maintenance")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+
+def page_stats(conn):
+    """Page size, total and free pages of the database (cheap: read from the header)."""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        "page_size": page_size,
+        "page_count": page_count,
+        "free_pages": free_pages,
+        "free_mb": round(free_pages * page_size / (1024 * 1024), 2),
+        "free_ratio": round(free_pages / page_count, 4) if page_count else 0.0,
+    }
+
+
+def fragmentation(conn):
+    """
+    Fraction of b-tree leaf pages that do not follow the previous leaf of
+    the same table or index on disk (0 = every scan is sequential). None if
+    SQLite was built without the dbstat table. Reads every page: not for
+    every dashboard refresh.
+    """
+    try:
+        rows = conn.execute("SELECT name, pageno FROM dbstat WHERE pagetype = 'leaf' ORDER BY name, path").fetchall()
+    except sqlite3.OperationalError:
+        return None
+    jumps = 0
+    previous_name, previous_page = None, None
+    for name, page in rows:
+        if name == previous_name and page != previous_page + 1:
+            jumps += 1
+        previous_name, previous_page = name, page
+    return round(jumps / len(rows), 4) if rows else 0.0
+
+
+def read_report(report_file):
+    """The last report written by the maintenance job ({} if there is none)."""
+    try:
+        with open(report_file, "r") as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+class DatabaseMaintenance:
+    """Time-boxed free-page reclamation and statistics refresh of one Database."""
+
+    def __init__(self, database, report_file, step_pages=128, time_budget=0.5, step_pause=0.05, min_free_pages=64,
+                 analyze_interval=3600, analysis_limit=1000, fragmentation_interval=3600):
+        self.database = database
+        self.report_file = report_file
+        self.step_pages = step_pages
+        self.time_budget = time_budget  # Seconds of vacuum per cycle
+        self.step_pause = step_pause  # Seconds without the write lock between steps
+        self.min_free_pages = min_free_pages  # Fewer free pages than this are left for later
+        self.analyze_interval = analyze_interval
+        self.analysis_limit = analysis_limit
+        self.fragmentation_interval = fragmentation_interval
+        self.reclaimed_pages = 0
+        self.last_analyze = None
+        self.last_fragmentation = None
+        self.fragmentation = None
+
+    def enable_incremental_vacuum(self):
+        """Converts the file to incremental auto-vacuum if it is not yet. Returns True if it uses it."""
+        conn = self.database.writer()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            return True
+        with log_lock:
+            maintenance_logger.info(f"🔄 Converting {self.database.path} to incremental auto-vacuum (one-time VACUUM)...")
+        start = time.perf_counter()
+        # A file that already has tables only takes the new setting when it is rebuilt
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        converted = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+        with log_lock:
+            if converted:
+                maintenance_logger.info(
+                    f"✅ {self.database.path} converted to incremental auto-vacuum in {time.perf_counter() - start:.1f} s"
+                )
+            else:
+                maintenance_logger.warning(f"⚠️ Could not convert {self.database.path} to incremental auto-vacuum")
+        return converted
+
+    def reclaim(self):
+        """Reclaims free pages in steps until none are left or the time budget is spent. Returns the pages reclaimed."""
+        conn = self.database.writer()
+        deadline = time.monotonic() + self.time_budget
+        reclaimed = 0
+        while time.monotonic() < deadline:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages == 0 or (reclaimed == 0 and free_pages < self.min_free_pages):
+                break
+            # execute() would stop after the first page (the pragma returns no columns), executescript runs it to the end
+            conn.executescript(f"PRAGMA incremental_vacuum({self.step_pages})")
+            reclaimed += free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            time.sleep(self.step_pause)
+        self.reclaimed_pages += reclaimed
+        return reclaimed
+
+    def analyze(self):
+        """Refreshes the planner statistics; ANALYZE is bounded by analysis_limit rows per index."""
+        conn = self.database.writer()
+        conn.execute(f"PRAGMA analysis_limit={int(self.analysis_limit)}")
+        with conn:
+            conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        self.last_analyze = epoch_ms()
+
+    def run_once(self):
+        """One maintenance cycle. Returns the report it wrote."""
+        start = time.perf_counter()
+        # Without incremental auto-vacuum, incremental_vacuum frees nothing
+        reclaimed = self.reclaim() if self.enable_incremental_vacuum() else 0
+        now = epoch_ms()
+        if self.last_analyze is None or now - self.last_analyze >= self.analyze_interval * 1000:
+            self.analyze()
+        if self.last_fragmentation is None or now - self.last_fragmentation >= self.fragmentation_interval * 1000:
+            self.fragmentation = fragmentation(self.database.reader())
+            self.last_fragmentation = now
+        report = page_stats(self.database.reader())
+        report.update({
+            "reclaimed_pages": reclaimed,
+            "reclaimed_pages_total": self.reclaimed_pages,
+            "fragmentation": self.fragmentation,
+            "last_analyze": format_epoch_ms(self.last_analyze),
+            "last_fragmentation": format_epoch_ms(self.last_fragmentation),
+            "last_run": format_epoch_ms(now),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        })
+        self._write_report(report)
+        if reclaimed:
+            with log_lock:
+                maintenance_logger.info(
+                    f"✅ {reclaimed} free pages reclaimed, {report['free_pages']} left "
+                    f"({report['page_count']} pages, fragmentation {self.fragmentation})"
+                )
+        return report
+
+    def _write_report(self, report):
+        # Replaced in one rename, so the dashboard never reads half a file
+        tmp_file = f"{self.report_file}.tmp"
+        with open(tmp_file, "w") as f:
+            yaml.dump(report, f)
+        os.replace(tmp_file, self.report_file)
@@ -0,0 +1,230 @@
+"""
+Columnar archive of the detections already uploaded to the master database.
+
+send_hourly_data hands every uploaded hourly partition to
+DetectionArchive.write() before dropping it from SQLite, so the edge keeps
+a compact history for re-sending and local analysis. Each period becomes
+one file:
+
+    magic (8 bytes) | header length (u32) | header (JSON) | chunk data
+
+Rows are sorted by timestamp and cut into chunks of chunk_rows. Every
+column of a chunk is one typed NumPy array compressed with zlib:
+
+    int64    id, timestamp: stored as differences to the previous row
+             (small numbers, which compress well), first value included
+    float32  positions, speed, heading: NULL is NaN
+    codes    vehicle_id, direction, camera_id: int16/int32 indexes into a
+             per-file dictionary kept in the header, NULL is -1
+
+The header holds the columns, the dictionaries and the chunk index (first
+and last timestamp, rows and the byte range of every column). Readers map
+the file and only decompress the chunks and columns a range needs.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+import logging
+from itertools import islice
+
+import numpy as np
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+archive_logger = logging.getLogger("camera_service.detection_archive")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+MAGIC = b"OAKARC01"
+HEADER_LENGTH = struct.Struct("<I")
+FILE_PREFIX = "detections_"
+FILE_SUFFIX = ".arc"
+
+# (column, kind): the columns uploaded by send_hourly_data, in its order
+COLUMNS = (
+    ("id", "delta"),
+    ("timestamp", "delta"),
+    ("vehicle_id", "dictionary"),
+    ("x_position", "float32"),
+    ("y_position", "float32"),
+    ("direction", "dictionary"),
+    ("camera_id", "dictionary"),
+    ("speed", "float32"),
+    ("heading", "float32"),
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+TIMESTAMP = COLUMN_NAMES.index("timestamp")
+
+
+def encode_column(kind, values, dictionary):
+    """Column values (Python objects) -> typed array."""
+    if kind == "delta":
+        array = np.asarray(values, dtype=np.int64)
+        return np.diff(array, prepend=np.int64(0))
+    if kind == "float32":
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float32)
+    codes = [-1 if v is None else dictionary.setdefault(v, len(dictionary)) for v in values]
+    return np.array(codes, dtype=np.int32)
+
+
+def decode_column(kind, array, dictionary):
+    """Typed array -> column array (dictionary columns as an object array with None for NULL)."""
+    if kind == "delta":
+        return np.cumsum(array, dtype=np.int64)
+    if kind == "float32":
+        return array
+    values = np.array(dictionary + [None], dtype=object)
+    return values[array]  # -1 picks the trailing None
+
+
+class DetectionArchive:
+    """A directory of columnar period files."""
+
+    def __init__(self, path, chunk_rows=65536, compression_level=6):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.compression_level = compression_level
+        os.makedirs(path, exist_ok=True)
+
+    def _file_path(self, start_ms, end_ms):
+        return os.path.join(self.path, f"{FILE_PREFIX}{start_ms}_{end_ms}{FILE_SUFFIX}")
+
+    def files(self):
+        """(start_ms, end_ms, path) of every archived period, oldest first."""
+        periods = []
+        for name in os.listdir(self.path):
+            if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX):
+                start, end = name[len(FILE_PREFIX):-len(FILE_SUFFIX)].split("_")
+                periods.append((int(start), int(end), os.path.join(self.path, name)))
+        return sorted(periods)
+
+    def write(self, rows, start_ms, end_ms):
+        """
+        Archives the rows (tuples in COLUMN_NAMES order, sorted by timestamp)
+        of the period [start_ms, end_ms) into one file. Rows are consumed one
+        chunk at a time, so a cursor is never loaded whole; only the
+        compressed chunks are kept until the file is written. Returns the
+        size of the file in bytes.
+        """
+        rows = iter(rows)
+        row_count = 0
+        dictionaries = {name: {} for name, kind in COLUMNS if kind == "dictionary"}
+        chunks = []
+        blobs = []
+        offset = 0
+        while True:
+            chunk_rows = list(islice(rows, self.chunk_rows))
+            if not chunk_rows:
+                break
+            row_count += len(chunk_rows)
+            columns = list(zip(*chunk_rows))
+            ranges = {}
+            for index, (name, kind) in enumerate(COLUMNS):
+                array = encode_column(kind, columns[index], dictionaries.get(name))
+                if kind == "dictionary" and len(dictionaries[name]) < 2 ** 15:
+                    array = array.astype(np.int16)
+                blob = zlib.compress(array.tobytes(), self.compression_level)
+                ranges[name] = [offset, len(blob), array.dtype.str]
+                blobs.append(blob)
+                offset += len(blob)
+            chunks.append({
+                "first_timestamp": int(chunk_rows[0][TIMESTAMP]),
+                "last_timestamp": int(chunk_rows[-1][TIMESTAMP]),
+                "rows": len(chunk_rows),
+                "columns": ranges,
+            })
+        header = json.dumps({
+            "start": start_ms,
+            "end": end_ms,
+            "rows": row_count,
+            "columns": COLUMNS,
+            "dictionaries": {name: list(values) for name, values in dictionaries.items()},
+            "chunks": chunks,
+        }).encode()
+
+        # Written under a temporary name and renamed, so readers never see half a file
+        path = self._file_path(start_ms, end_ms)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def _read_file(self, path, start_ms, end_ms, columns):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a detection archive")
+            (length,) = HEADER_LENGTH.unpack_from(mm, len(MAGIC))
+            data_offset = len(MAGIC) + HEADER_LENGTH.size + length
+            header = json.loads(mm[len(MAGIC) + HEADER_LENGTH.size:data_offset])
+            kinds = dict(header["columns"])
+            parts = {name: [] for name in columns}
+            # Timestamps are needed to cut the chunks at the edges of the range
+            names = columns if "timestamp" in columns else ("timestamp",) + tuple(columns)
+            for chunk in header["chunks"]:
+                if chunk["last_timestamp"] < start_ms or chunk["first_timestamp"] >= end_ms:
+                    continue
+                decoded = {}
+                for name in names:
+                    offset, size, dtype = chunk["columns"][name]
+                    start = data_offset + offset
+                    array = np.frombuffer(zlib.decompress(mm[start:start + size]), dtype=dtype)
+                    decoded[name] = decode_column(kinds[name], array, header["dictionaries"].get(name))
+                timestamps = decoded["timestamp"]
+                selected = slice(
+                    int(np.searchsorted(timestamps, start_ms, side="left")),
+                    int(np.searchsorted(timestamps, end_ms, side="left")),
+                )
+                for name in columns:
+                    parts[name].append(decoded[name][selected])
+            return parts
+        finally:
+            mm.close()
+
+    def read_range(self, start_ms, end_ms, columns=COLUMN_NAMES):
+        """{column: array} of the archived detections with start_ms <= timestamp < end_ms, sorted by timestamp."""
+        parts = {name: [] for name in columns}
+        for file_start, file_end, path in self.files():
+            if file_end <= start_ms or file_start >= end_ms:
+                continue
+            for name, arrays in self._read_file(path, start_ms, end_ms, columns).items():
+                parts[name].extend(arrays)
+        kinds = dict(COLUMNS)
+        return {
+            name: np.concatenate(arrays) if arrays else np.empty(0, dtype=object if kinds[name] == "dictionary" else None)
+            for name, arrays in parts.items()
+        }
+
+    def read_rows(self, start_ms, end_ms):
+        """The archived rows as tuples in COLUMN_NAMES order (NULL as None), e.g. to upload them again."""
+        arrays = self.read_range(start_ms, end_ms)
+        columns = []
+        for name, kind in COLUMNS:
+            values = arrays[name].tolist()
+            if kind == "float32":
+                values = [None if v != v else round(v, 6) for v in values]  # NaN is NULL
+            columns.append(values)
+        return list(zip(*columns))
+
+    def expire(self, before_ms):
+        """Deletes the period files that end before before_ms. Returns how many were deleted."""
+        deleted = 0
+        for _, file_end, path in self.files():
+            if file_end <= before_ms:
+                os.unlink(path)
+                deleted += 1
+        return deleted
+
+    def stats(self):
+        files = self.files()
+        return {"files": len(files), "bytes": sum(os.path.getsize(path) for _, _, path in files)}
+
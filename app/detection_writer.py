@@ -0,0 +1,149 @@
+import queue
+import sqlite3
+import threading
+import time
+import logging
+
+from db import get_database
+from partitions import INSERT_DETECTION_SQL, insert_detections, begin_immediate
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+writer_logger = logging.getLogger("camera_service.detection_writer")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+_STOP = object()  # Sentinel used to wake up and stop the writer thread
+
+
+class DetectionWriter:
+    """
+    Write-behind stage for the local SQLite database.
+
+    The camera loop only enqueues rows; a background thread drains the bounded
+    queue and group-commits them with executemany on one persistent connection.
+    A batch is flushed when it reaches batch_size rows or when flush_interval
+    seconds have passed since its first row, whichever comes first. If the queue
+    is full the row is dropped (and counted) instead of blocking the caller.
+    """
+
+    def __init__(self, db_path, batch_size=200, flush_interval=1.0, queue_size=10000):
+        self.db_path = db_path
+        self.database = get_database(db_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+
+    def start(self):
+        """Starts the writer thread (no-op if it is already running)."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, name="detection_writer", daemon=True)
+        self.thread.start()
+
+    def put(self, params, statement=INSERT_DETECTION_SQL):
+        """Enqueues a row without blocking. Returns False if it had to be dropped."""
+        try:
+            self.queue.put_nowait((statement, params))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                with log_lock:
+                    writer_logger.warning(f"⚠️ Detection queue full, {self.dropped} rows dropped so far")
+            return False
+
+    def stats(self):
+        """Returns the queue depth and the written/dropped counters."""
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+    def close(self, timeout=10.0):
+        """Flushes every pending row and stops the writer thread."""
+        if self.thread is None:
+            return
+        # The sentinel must get in even if the queue is full, so wait for room
+        try:
+            self.queue.put((_STOP, None), timeout=timeout)
+        except queue.Full:
+            with log_lock:
+                writer_logger.error("❌ Detection writer is not draining, pending rows are lost")
+        self.thread.join(timeout)
+        self.thread = None
+        with log_lock:
+            writer_logger.info(f"✅ Detection writer stopped: {self.stats()}")
+
+    def _flush(self, conn, batch):
+        """Writes a batch in one transaction, grouping rows by statement."""
+        if not batch:
+            return
+        groups = {}
+        for statement, params in batch:
+            groups.setdefault(statement, []).append(params)
+        try:
+            with conn:
+                begin_immediate(conn)  # One transaction for the whole batch, DDL of new partitions included
+                for statement, rows in groups.items():
+                    if statement == INSERT_DETECTION_SQL:
+                        insert_detections(conn, rows)  # Routed to the hourly partitions
+                    else:
+                        conn.executemany(statement, rows)
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            with log_lock:
+                writer_logger.error(f"❌ Error writing {len(batch)} detections: {e}")
+
+    def _run(self):
+        conn = self.database.writer()  # The writer thread's own connection
+        batch = []
+        deadline = None
+        stopping = False
+        try:
+            while not stopping:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is not None:
+                    if item[0] is _STOP:
+                        stopping = True
+                    else:
+                        batch.append(item)
+                        if deadline is None:
+                            deadline = time.monotonic() + self.flush_interval
+
+                if stopping or len(batch) >= self.batch_size or (
+                    deadline is not None and time.monotonic() >= deadline
+                ):
+                    if stopping:
+                        # Drain whatever is still queued before leaving
+                        while True:
+                            try:
+                                statement, params = self.queue.get_nowait()
+                            except queue.Empty:
+                                break
+                            if statement is not _STOP:
+                                batch.append((statement, params))
+                    self._flush(conn, batch)
+                    batch = []
+                    deadline = None
+        except Exception as e:
+            with log_lock:
+                writer_logger.error(f"❌ Detection writer stopped unexpectedly: {e}")
+        finally:
+            self.database.close()
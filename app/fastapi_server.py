@@ -1,15 +1,19 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Optional
 import psycopg2
 import os
 import uvicorn
 import logging
 import threading
-import sqlite3
 import yaml
 from config_loader import load_config
+from camera_config import load_camera_settings
+from frame_channel import FrameReader
+from stage_metrics import camera_metrics, stream_metrics
+import batch_codec
 
 # Load Config
 config = load_config()
@@ -24,6 +28,7 @@ MASTER_DB_NAME = config["master_db"]["name"]
 MASTER_DB_USER = config["master_db"]["user"]
 MASTER_DB_PASSWORD = config["master_db"]["password"]
 DB_PATH = config["data"]["db_path"]
+CAMERA_SETTINGS = load_camera_settings(config)
 
 # Ensure the log directory exists
 if not os.path.exists(LOG_DIR):
@@ -68,7 +73,7 @@ def create_master_db():
 
     This function connects to the PostgreSQL database using the provided connection parameters.
     It creates two tables:
-    - master_detections: Stores detection data with fields for id, timestamp, vehicle_id, x_position, y_position, and direction.
+    - master_detections: Stores detection data with fields for id, timestamp, vehicle_id, x_position, y_position, direction, camera_id, speed and heading.
     - last_upload: Stores the last upload time with fields for id and last_upload_time.
 
     If the last_upload table is empty, it initializes the last_upload_time with the current time minus one day.
@@ -94,9 +99,15 @@ def create_master_db():
                 vehicle_id TEXT,
                 x_position REAL,
                 y_position REAL,
-                direction TEXT
+                direction TEXT,
+                camera_id TEXT,
+                speed REAL,
+                heading REAL
             )
         """)
+        cursor.execute("ALTER TABLE master_detections ADD COLUMN IF NOT EXISTS camera_id TEXT")
+        cursor.execute("ALTER TABLE master_detections ADD COLUMN IF NOT EXISTS speed REAL")
+        cursor.execute("ALTER TABLE master_detections ADD COLUMN IF NOT EXISTS heading REAL")
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS last_upload (
                 id SERIAL PRIMARY KEY,
@@ -129,17 +140,53 @@ class DetectionData(BaseModel):
     x_position: float
     y_position: float
     direction: str
+    camera_id: Optional[str] = None
+    speed: Optional[float] = None
+    heading: Optional[float] = None
+
+# Validates the JSON batches straight from the request body
+detection_batch_adapter = TypeAdapter(List[DetectionData])
+
+# One latest-frame channel per camera, the first camera is the default
+preview_readers = {camera["id"]: FrameReader(camera["preview_frame_path"]) for camera in CAMERA_SETTINGS}
+DEFAULT_CAMERA_ID = CAMERA_SETTINGS[0]["id"]
 
 @app.get("/ultima imagen")
-def get_last_image():   
-    """Returns the last image from the master database."""
+def get_last_image(since: Optional[int] = None, camera_id: Optional[str] = None):
+    """
+    Returns the last camera preview as a JPEG.
+
+    The frame number and timestamp travel in the X-Frame-Seq and X-Frame-Timestamp
+    headers; pass the last frame number seen as `since` to get a 204 until a newer
+    frame is available. `camera_id` selects the camera (the first one by default).
+    """
+    preview_reader = preview_readers.get(camera_id or DEFAULT_CAMERA_ID)
+    if preview_reader is None:
+        raise HTTPException(status_code=404, detail=f"Unknown camera {camera_id}")
     with conn_lock:
-        conn= sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT image FROM preview_images LIMIT 1")
-        result = cursor.fetchone()
-        conn.close()
-    return result[0] if result and result[0] else None
+        result = preview_reader.read(since)
+    if result is None:
+        return Response(status_code=204)
+    seq, timestamp, image = result
+    return Response(
+        content=image,
+        media_type="image/jpeg",
+        headers={"X-Frame-Seq": str(seq), "X-Frame-Timestamp": f"{timestamp:.3f}"},
+    )
+
+@app.get("/camera-metrics")
+def get_camera_metrics():
+    """
+    Returns the camera loop latency per stage (count, mean, p50/p95/p99, max in ms),
+    the frame counters (processed, dropped by the device queues) and the writer and
+    alert queue stats. Only populated when the camera runs in this process (start_theads).
+    With several cameras the per-camera stages are under "streams".
+    """
+    snapshot = camera_metrics.snapshot()
+    if stream_metrics:
+        snapshot["streams"] = {camera_id: metrics.snapshot() for camera_id, metrics in stream_metrics.items()}
+    return snapshot
+
 
 # Endpoint to get the last upload time
 @app.get("/last-upload-time")
@@ -168,18 +215,31 @@ def get_last_upload_time():
             conn.close()
 
 
-# Endpoint to receive data batches
-@app.post("/subir-detecciones")
-def receive_data_batch(data: List[DetectionData]):
+def parse_data_batch(body, content_type, content_encoding):
     """
-    Receives a batch of detection data and stores it in the master database.
-    Args:
-        data (List[DetectionData]): A list of detection data items to be stored.
-    Returns:
-        dict: A message indicating the success of the operation.
-    Raises:
-        HTTPException: If there is an error storing the data in the database.
+    Request body -> rows (timestamp, vehicle_id, x_position, y_position, direction, camera_id, speed, heading).
+    Binary batches (see batch_codec) are recognized by their Content-Type, anything else is the JSON list.
     """
+    if content_type.split(";")[0].strip() == batch_codec.CONTENT_TYPE:
+        if not batch_codec.supports(content_encoding):
+            raise HTTPException(status_code=415, detail=f"Unsupported content encoding: {content_encoding}")
+        try:
+            return batch_codec.decode_rows(body, content_encoding)
+        except (ValueError, OSError, KeyError) as e:
+            raise HTTPException(status_code=422, detail=f"Invalid detection batch: {e}")
+    try:
+        data = detection_batch_adapter.validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    return [
+        (item.timestamp, item.vehicle_id, item.x_position, item.y_position, item.direction, item.camera_id,
+         item.speed, item.heading)
+        for item in data
+    ]
+
+
+def store_data_batch(rows):
+    """Stores the rows of a batch in the master database and records the upload time."""
     conn = None
     try:
         conn = psycopg2.connect(
@@ -191,23 +251,21 @@ def receive_data_batch(data: List[DetectionData]):
         cursor = conn.cursor()
 
         # Get the latest timestamp from the data
-        latest_timestamp = max(item.timestamp for item in data)
+        latest_timestamp = max(row[0] for row in rows)
 
-        for item in data:
-            cursor.execute(
-                "INSERT INTO master_detections (timestamp, vehicle_id, x_position, y_position, direction) VALUES (%s, %s, %s, %s, %s)",
-                (item.timestamp, item.vehicle_id, item.x_position, item.y_position, item.direction),
-            )
+        cursor.executemany(
+            "INSERT INTO master_detections (timestamp, vehicle_id, x_position, y_position, direction, camera_id, speed, heading) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+            rows,
+        )
         conn.commit()
         with log_lock:
-            fastapi_logger.info(f"✅ Data batch received and stored: {len(data)} items")
+            fastapi_logger.info(f"✅ Data batch received and stored: {len(rows)} items")
 
         # Update the last upload time with the latest timestamp from the data
         cursor.execute("INSERT INTO last_upload (last_upload_time) VALUES (%s)", (latest_timestamp,))
         conn.commit()
 
-        return {"message": "Data batch received and stored successfully"}
-
     except Exception as e:
         if conn:
             conn.rollback()
@@ -217,6 +275,31 @@ def receive_data_batch(data: List[DetectionData]):
             conn.close()
 
 
+# Endpoint to receive data batches
+@app.post("/subir-detecciones")
+async def receive_data_batch(request: Request):
+    """
+    Receives a batch of detection data and stores it in the master database.
+
+    The body is either the JSON list of DetectionData or, with Content-Type
+    batch_codec.CONTENT_TYPE, the compressed columnar batch (Content-Encoding
+    zstd or gzip).
+    Returns:
+        dict: A message indicating the success of the operation.
+    Raises:
+        HTTPException: 415 for an encoding this server cannot read, 422 for an
+        invalid batch, 500 if the data could not be stored.
+    """
+    body = await request.body()
+    rows = parse_data_batch(
+        body, request.headers.get("content-type", "application/json"), request.headers.get("content-encoding")
+    )
+    if rows:
+        # psycopg2 blocks, so it runs outside the event loop
+        await run_in_threadpool(store_data_batch, rows)
+    return {"message": "Data batch received and stored successfully"}
+
+
 # Endpoint to receive alerts
 class AlertData(BaseModel):
     timestamp: str
@@ -224,6 +307,7 @@ class AlertData(BaseModel):
     x_position: float
     y_position: float
     alert: str
+    camera_id: Optional[str] = None  # Camera that fired the alert (not sent by older edges)
 
 
 @app.post("/alerta")
@@ -0,0 +1,116 @@
+"""
+Latest-frame channel for the camera preview.
+
+One producer (camera_service) publishes the newest encoded JPEG into a
+memory-mapped file; any number of readers (the Streamlit app, the FastAPI
+server) map the same file and grab the newest frame without going through
+SQLite. Only the latest frame is kept.
+
+Layout of the file:
+
+    magic (8 bytes) | seq (u64) | timestamp (f64) | length (u32) | padding | data (capacity bytes)
+
+The header works as a seqlock: the writer makes seq odd while it copies a
+frame and even again when it is done, so a reader that sees an odd seq, or
+a seq that changed while it was copying, simply retries. Readers pass the
+frame number they already have to skip frames they have seen.
+"""
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"OAKFRM01"
+HEADER = struct.Struct("<8sQdI")
+HEADER_SIZE = 32  # HEADER.size rounded up so the data starts aligned
+SEQ_OFFSET = 8
+DEFAULT_CAPACITY = 2 * 1024 * 1024  # Enough for a 1024x576 JPEG preview
+
+
+class FrameWriter:
+    """Single producer side of the channel."""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, HEADER_SIZE + capacity)
+            self._mm = mmap.mmap(fd, HEADER_SIZE + capacity)
+        finally:
+            os.close(fd)
+        magic, seq, _, _ = HEADER.unpack_from(self._mm, 0)
+        # Keep counting from the previous run so readers never see the seq go back
+        self._seq = seq + (seq & 1) if magic == MAGIC else 0
+        HEADER.pack_into(self._mm, 0, MAGIC, self._seq, 0.0, 0)
+
+    def publish(self, data, timestamp=None):
+        """Publishes a new encoded frame. Returns its frame number."""
+        if len(data) > self.capacity:
+            raise ValueError(f"Frame of {len(data)} bytes does not fit in the {self.capacity} bytes channel")
+        if timestamp is None:
+            timestamp = time.time()
+        self._seq += 1  # Odd: write in progress
+        struct.pack_into("<Q", self._mm, SEQ_OFFSET, self._seq)
+        self._mm[HEADER_SIZE:HEADER_SIZE + len(data)] = data
+        self._seq += 1  # Even: frame complete
+        HEADER.pack_into(self._mm, 0, MAGIC, self._seq, timestamp, len(data))
+        return self._seq // 2
+
+    def close(self):
+        self._mm.close()
+
+
+class FrameReader:
+    """Reader side of the channel. The file is mapped lazily, so readers can start before the camera."""
+
+    def __init__(self, path, retries=5):
+        self.path = path
+        self.retries = retries
+        self._mm = None
+
+    def _open(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            size = os.fstat(fd).st_size
+            if size <= HEADER_SIZE:
+                return False
+            self._mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        return True
+
+    def read(self, last_seq=None):
+        """
+        Returns (frame number, timestamp, JPEG bytes) of the newest frame, or
+        None if there is no frame yet or it is not newer than last_seq.
+        """
+        if self._mm is None and not self._open():
+            return None
+        for _ in range(self.retries):
+            magic, seq, timestamp, length = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or length == 0:
+                return None
+            if seq & 1:
+                time.sleep(0.001)  # Writer in the middle of a frame
+                continue
+            if last_seq is not None and seq // 2 <= last_seq:
+                return None
+            if HEADER_SIZE + length > len(self._mm):
+                # The writer grew the file since we mapped it
+                self.close()
+                if not self._open():
+                    return None
+                continue
+            data = self._mm[HEADER_SIZE:HEADER_SIZE + length]
+            if struct.unpack_from("<Q", self._mm, SEQ_OFFSET)[0] == seq:
+                return seq // 2, timestamp, data
+        return None
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
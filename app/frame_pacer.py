@@ -0,0 +1,91 @@
+import time
+import threading
+import logging
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+pacer_logger = logging.getLogger("camera_service.frame_pacer")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+EWMA_ALPHA = 0.05  # Weight of the newest frame in the moving averages
+
+
+class FramePacer:
+    """
+    Paces the camera loop on the arrival of tracklet messages.
+
+    In "event" mode the loop never sleeps: it blocks on q_nn.get() and
+    processes every queued message in order. After each frame the pacer
+    compares the processing time with the frame budget (1 / oak_camera.fps,
+    corrected with the rate actually measured from the device timestamps)
+    and checks whether more messages are already waiting. When the loop is
+    behind, `behind` is True so the caller can skip optional work (the
+    preview overlay and encoding) until it catches up; frames lost anyway
+    show up as gaps in the sequence numbers.
+
+    "sleep" mode keeps the old behaviour of a fixed sleep after each frame.
+    """
+
+    def __init__(self, fps, mode="event", fixed_sleep=0.03, metrics=None):
+        self.target_fps = fps
+        self.mode = mode
+        self.fixed_sleep = fixed_sleep
+        self.metrics = metrics
+        self.budget = 1.0 / fps
+        self.measured_fps = float(fps)
+        self.processing_ewma = 0.0
+        self.behind = False
+        self.frames_behind = 0
+        self.last_device_ts = None
+        self._next_warning = 0.0
+
+    def frame_done(self, in_nn, processing_time, backlog):
+        """
+        Updates the pacing state after a frame.
+
+        processing_time: seconds spent on the frame (without waiting for it).
+        backlog: True if another tracklets message is already queued (q_nn.has()).
+        """
+        device_ts = in_nn.getTimestampDevice().total_seconds()
+        if self.last_device_ts is not None and device_ts > self.last_device_ts:
+            # Real frame rate of the device, which may be lower than configured (exposure, load)
+            fps = 1.0 / (device_ts - self.last_device_ts)
+            self.measured_fps += EWMA_ALPHA * (fps - self.measured_fps)
+            self.budget = 1.0 / max(1.0, min(self.measured_fps, self.target_fps))
+        self.last_device_ts = device_ts
+        self.processing_ewma += EWMA_ALPHA * (processing_time - self.processing_ewma)
+
+        # Host arrival latency: dai timestamps use the same steady clock as time.monotonic()
+        host_ts = in_nn.getTimestamp().total_seconds()
+        if self.metrics is not None and host_ts > 0:
+            self.metrics.record("pipeline_latency", max(0.0, time.monotonic() - host_ts))
+
+        self.behind = backlog or self.processing_ewma > self.budget
+        if self.behind:
+            self.frames_behind += 1
+            if self.metrics is not None:
+                self.metrics.increment("frames_behind")
+            now = time.monotonic()
+            if now >= self._next_warning:
+                self._next_warning = now + 60
+                with log_lock:
+                    pacer_logger.warning(
+                        f"⚠️ Camera loop is not keeping up: {self.processing_ewma * 1000:.1f} ms per frame "
+                        f"for a budget of {self.budget * 1000:.1f} ms ({self.measured_fps:.1f} fps)"
+                    )
+
+        if self.mode == "sleep":
+            time.sleep(self.fixed_sleep)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "target_fps": self.target_fps,
+            "measured_fps": round(self.measured_fps, 2),
+            "budget_ms": round(self.budget * 1000, 2),
+            "processing_ms": round(self.processing_ewma * 1000, 3),
+            "load": round(self.processing_ewma / self.budget, 3),
+            "behind": self.behind,
+            "frames_behind": self.frames_behind,
+        }
@@ -1,5 +1,4 @@
 import threading
-import sqlite3
 import requests
 import time
 from datetime import datetime, timedelta
@@ -8,19 +7,42 @@ import os
 import traceback
 import yaml  # Import the yaml library
 from config_loader import load_config #Import the function
+from image_store import ImageStore
+from db import get_database
+from db_maintenance import DatabaseMaintenance
+from detection_archive import DetectionArchive, COLUMN_NAMES as ARCHIVE_COLUMNS
+import batch_codec
+from migrations import epoch_ms, format_epoch_ms
+from partitions import (
+    read_after, uploaded_partitions, read_partition, drop_partitions, partition_bounds, begin_immediate,
+    PARTITIONS_AHEAD,
+)
+import rollups
 
 # Load Config
 config = load_config()
 # Configuration using config.yaml
 LOG_DIR = config["logging"]["log_dir"]
 DB_PATH = config["data"]["db_path"]
+IMAGE_STORE_PATH = config["data"]["image_store_path"]
 API_ALERT_URL = config["application"]["api_alert_url"]
 API_BATCH_URL = config["application"]["api_batch_url"]
+UPLOAD_FORMAT = config["application"]["upload_format"]
 DELETE_IMAGES_INTERVAL = config["threads"]["tasks"]["delete_old_images"]["delete_images_interval"]
 SAVE_DATA_INTERVAL = config["threads"]["tasks"]["send_hourly_data"]["save_data_interval"]
+UPLOAD_CHUNK_SIZE = config["threads"]["tasks"]["send_hourly_data"]["chunk_size"]
+UPLOAD_TIMEOUT = config["threads"]["tasks"]["send_hourly_data"]["timeout"]
 KEEP_CONTRARY_IMAGES = config["application"]["keep_contrary_images"]
 STATUS_FILE = config["data"]["status_file"]
-API_LAST_UPLOAD_URL = config["application"]["api_last_upload_url"] #new
+ROLLUPS_RETENTION_DAYS = config["rollups"]["retention_days"]
+MAINTENANCE_INTERVAL = config["threads"]["tasks"]["database_maintenance"]["maintenance_interval"]
+MAINTENANCE_REPORT = config["data"]["db_maintenance_report"]
+MAINTENANCE_SETTINGS = config["database"]["maintenance"]
+ARCHIVE_ENABLED = config["archive"]["enabled"]
+ARCHIVE_PATH = config["archive"]["path"]
+ARCHIVE_CHUNK_ROWS = config["archive"]["chunk_rows"]
+ARCHIVE_COMPRESSION_LEVEL = config["archive"]["compression_level"]
+ARCHIVE_RETENTION_DAYS = config["archive"]["retention_days"]
 
 log_file = os.path.join(LOG_DIR, "guardar_horario.log")
 
@@ -38,6 +60,10 @@ guardar_horario_logger.addHandler(file_handler)
 # Create a lock for logging
 log_lock = threading.Lock()
 
+# Create or upgrade the database schema before the first query (see migrations) and switch it to WAL
+database = get_database(DB_PATH)
+database.prepare()
+
 
 
 def send_alert(vehicle_id, x_pos, y_pos, alert_type="Sentido contrario"):
@@ -69,102 +95,150 @@ def update_status(thread_name, status, lock):  # Receive the lock as a parameter
         with open(STATUS_FILE, "w") as f:
             yaml.dump(data, f)
 
-def get_last_upload_time():
-    """Gets the last upload time from the master database."""
-    try:
+def get_upload_cursor():
+    """Id of the last detection acknowledged by the master database (durable, survives restarts)."""
+    return database.reader().execute("SELECT last_id FROM upload_cursor WHERE name = 'master'").fetchone()[0]
+
+def set_upload_cursor(last_id):
+    conn = database.writer()
+    with conn:
+        conn.execute(
+            "UPDATE upload_cursor SET last_id = ?, updated_at = ? WHERE name = 'master'", (last_id, epoch_ms())
+        )
+
+# Upload encodings still to try, preferred first (None = JSON). The server answers 415 to an encoding it
+# cannot read, and a server that only knows JSON 422 (undecodable body): either drops the first one
+upload_encodings = list(batch_codec.ENCODINGS) + [None] if UPLOAD_FORMAT == "columnar" else [None]
+
+def post_request(rows):
+    """One POST of a chunk in the preferred encoding the server accepts."""
+    while upload_encodings[0] is not None:
+        encoding = upload_encodings[0]
+        response = requests.post(
+            API_BATCH_URL,
+            data=batch_codec.encode_rows(rows, encoding),
+            headers={"Content-Type": batch_codec.CONTENT_TYPE, "Content-Encoding": encoding},
+            timeout=UPLOAD_TIMEOUT,
+        )
+        if response.status_code not in (415, 422):
+            return response
+        upload_encodings.pop(0)
         with log_lock:
-            guardar_horario_logger.info("🔄 Getting last upload time...")
-        response = requests.get(API_LAST_UPLOAD_URL, timeout=5) #changed
-        if response.status_code == 200:
-            last_upload_time_str = response.json().get("last_upload_time")
-            if last_upload_time_str:
-                try:
-                    return datetime.strptime(last_upload_time_str, "%Y-%m-%d %H:%M:%S")
-                except ValueError:
-                    return datetime.strptime(last_upload_time_str, "%Y-%m-%d %H:%M:%S.%f")
-            else:
-                with log_lock:
-                    guardar_horario_logger.warning("⚠️ No last upload time found.")
-                return None
-        else:
+            guardar_horario_logger.warning(
+                f"⚠️ The API does not accept {encoding} detection batches, falling back to {upload_encodings[0] or 'JSON'}"
+            )
+    json_data = [
+        {
+            "id": row[0],
+            "timestamp": format_epoch_ms(row[1]),  # The master database keeps text timestamps
+            "vehicle_id": row[2],
+            "x_position": row[3],
+            "y_position": row[4],
+            "direction": row[5],
+            "camera_id": row[6],
+            "speed": row[7],
+            "heading": row[8],
+        }
+        for row in rows
+    ]
+    return requests.post(API_BATCH_URL, json=json_data, timeout=UPLOAD_TIMEOUT)
+
+def post_chunk(rows):
+    """Posts a chunk of detections to the master database, retrying until it is acknowledged."""
+    while True:
+        try:
+            response = post_request(rows)
+            if response.status_code == 200:
+                return
             with log_lock:
-                guardar_horario_logger.warning(f"⚠️ Error getting last upload time, response: {response.status_code}")
-            return None
-    except requests.exceptions.RequestException:
+                guardar_horario_logger.warning(f"⚠️ API error ({response.status_code}). Retrying in 5 min...")
+        except requests.exceptions.RequestException:
+            with log_lock:
+                guardar_horario_logger.error("❌ No connection to API. Retrying in 5 min...")
+        time.sleep(300)
+
+def upload_detections(last_id, end_ms):
+    """
+    Posts the detections with id > last_id and timestamp < end_ms in chunks,
+    advancing the upload cursor after every acknowledged chunk. Rows without
+    a timestamp (kept in partition 0 by migration 4) cannot be stored in the
+    master database, which would reject the whole chunk forever: they are
+    skipped and the cursor moves past them. Returns (uploaded, skipped, last_id).
+    """
+    uploaded = skipped = 0
+    while True:
+        # Only the uploaded columns, never more than one chunk in memory
+        rows = read_after(database.reader(), ARCHIVE_COLUMNS, last_id, end_ms, UPLOAD_CHUNK_SIZE)
+        if not rows:
+            break
+        valid = [row for row in rows if row[1] is not None]
+        if len(valid) < len(rows):
+            skipped += len(rows) - len(valid)
+            with log_lock:
+                guardar_horario_logger.warning(
+                    f"⚠️ {len(rows) - len(valid)} detections without a timestamp skipped (ids up to {rows[-1][0]})"
+                )
+        if valid:
+            post_chunk(valid)
+        last_id = rows[-1][0]
+        set_upload_cursor(last_id)
+        uploaded += len(valid)
         with log_lock:
-            guardar_horario_logger.error("❌ Could not get the last upload time due to a network error.")
-        return None
+            guardar_horario_logger.info(f"✅ {uploaded} detections uploaded (up to id {last_id})")
+    return uploaded, skipped, last_id
 
 def send_hourly_data(lock): # Receive the lock as a parameter
-    """Sends hourly data to the master database and deletes the sent data."""
+    """
+    Streams the detections to the master database in chunks of UPLOAD_CHUNK_SIZE
+    rows, in id order after the upload cursor, which advances with every
+    acknowledged chunk. Memory stays the same whatever the backlog, and an
+    interrupted upload resumes after the last acknowledged chunk. The hourly
+    partitions that are complete and fully uploaded are then archived (see
+    detection_archive) and dropped, a day of them at a time.
+    """
+    archive = None
+    if ARCHIVE_ENABLED:
+        archive = DetectionArchive(ARCHIVE_PATH, chunk_rows=ARCHIVE_CHUNK_ROWS, compression_level=ARCHIVE_COMPRESSION_LEVEL)
     while True:
         try:
             update_status("send_hourly_data", 1, lock) # Pass the lock
-            last_upload_time = get_last_upload_time()
+            now = datetime.now()
+            # Rows of the last SAVE_DATA_INTERVAL seconds are left for the next round
+            current_hour_start = (now - timedelta(seconds=SAVE_DATA_INTERVAL)).replace(second=0, microsecond=0)
+            last_id = get_upload_cursor()
             with log_lock:
-                guardar_horario_logger.info(f"🔄 Checking for new data... Last upload time: {last_upload_time}")
+                guardar_horario_logger.info(
+                    f"🔄 Checking for new data... Uploading after id {last_id} up to {current_hour_start}"
+                )
 
-            now = datetime.now()
-            current_hour_start = now.replace(minute=now.minute-int(SAVE_DATA_INTERVAL/60), second=0, microsecond=0)#(minute=0, second=0, microsecond=0)
-            previous_hour_start = current_hour_start - timedelta(hours=SAVE_DATA_INTERVAL / 3600)
+            uploaded, skipped, last_id = upload_detections(last_id, epoch_ms(current_hour_start))
 
-            if last_upload_time is not None and previous_hour_start > last_upload_time:
+            if uploaded == 0 and skipped == 0:
                 with log_lock:
-                    guardar_horario_logger.info(f"⏳ Uploading data from {last_upload_time} to {current_hour_start}")
+                    guardar_horario_logger.info(f"😴 No new data to upload. Waiting...")
 
-                conn = sqlite3.connect(DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT * FROM detections WHERE timestamp >= ? AND timestamp < ?",
-                    (last_upload_time.strftime("%Y-%m-%d %H:%M:%S"), current_hour_start.strftime("%Y-%m-%d %H:%M:%S")),
-                )
-                data = cursor.fetchall()
-                conn.close()
-                with log_lock:
-                    guardar_horario_logger.info(f"🔄 Found {len(data)} new detections to upload")
-
-                if data:
-                    json_data = [
-                        {
-                            "id": row[0],
-                            "timestamp": row[1],
-                            "vehicle_id": row[2],
-                            "x_position": row[3],
-                            "y_position": row[4],
-                            "direction": row[5]
-                        }
-                        for row in data
-                    ]
-
-                    while True:
-                        try:
-                            response = requests.post(API_BATCH_URL, json=json_data, timeout=5)
-                            if response.status_code == 200:
-                                with log_lock:
-                                    guardar_horario_logger.info(
-                                        f"✅ Data from {last_upload_time} to {current_hour_start} uploaded and deleting"
-                                    )
-
-                                conn = sqlite3.connect(DB_PATH)
-                                cursor = conn.cursor()
-                                cursor.execute(
-                                    "DELETE FROM detections WHERE timestamp < ?",
-                                    (current_hour_start.strftime("%Y-%m-%d %H:%M:%S"),),
-                                )
-                                conn.commit()
-                                conn.close()
-                                break
-                            else:
-                                with log_lock:
-                                    guardar_horario_logger.warning(f"⚠️ API error ({response.status_code}). Retrying in 5 min...")
-                                time.sleep(300)
-                        except requests.exceptions.RequestException:
-                            with log_lock:
-                                guardar_horario_logger.error("❌ No connection to API. Retrying in 5 min...")
-                            time.sleep(300)
-            else:
+            # Complete hours whose rows have all been acknowledged, dropped a day at a time
+            # (every drop rebuilds the detections view)
+            conn = database.writer()
+            sealed = uploaded_partitions(conn, last_id, epoch_ms(current_hour_start))
+            if len(sealed) < PARTITIONS_AHEAD:
+                sealed = []
+            if archive is not None:
+                for index in sealed:
+                    archive_partition(archive, conn, index, now)
+            with conn:
+                # Under the write lock: a partition that took new rows since it was archived is kept
+                begin_immediate(conn)
+                still_sealed = set(uploaded_partitions(conn, last_id, epoch_ms(current_hour_start)))
+                sealed = [index for index in sealed if index in still_sealed]
+                drop_partitions(conn, sealed)
+                # The rollups outlive the raw detections
+                expired = rollups.delete_before(conn, epoch_ms(now - timedelta(days=ROLLUPS_RETENTION_DAYS)))
+            if sealed or expired:
                 with log_lock:
-                    guardar_horario_logger.info(f"😴 No new data to upload. Waiting...")
+                    guardar_horario_logger.info(
+                        f"✅ {len(sealed)} detection partitions dropped, {expired} expired rollup rows deleted"
+                    )
 
             time.sleep(SAVE_DATA_INTERVAL)  # Wait for the configured interval
 
@@ -176,51 +250,54 @@ def send_hourly_data(lock): # Receive the lock as a parameter
             send_alert(vehicle_id="SYSTEM", x_pos=0, y_pos=0, alert_type=f"send_hourly_data FAILED.")
             time.sleep(60)  # Wait a minute before retrying
 
+def archive_partition(archive, conn, index, now):
+    """Keeps an uploaded partition in the columnar archive and expires old archive files (errors do not stop the upload)."""
+    start, end = partition_bounds(conn, index)
+    try:
+        size = archive.write(read_partition(conn, index, ARCHIVE_COLUMNS), start, end)
+        expired = archive.expire(epoch_ms(now - timedelta(days=ARCHIVE_RETENTION_DAYS)))
+        with log_lock:
+            guardar_horario_logger.info(
+                f"✅ Detections of {format_epoch_ms(start)} archived in {size / 1024:.1f} KB, "
+                f"{expired} expired archive files deleted"
+            )
+    except Exception as e:
+        with log_lock:
+            guardar_horario_logger.error(f"❌ Error archiving the detections of {format_epoch_ms(start)}: {e}")
+
+
 def delete_old_images(lock): # Receive the lock as a parameter
-    """Deletes images from the database older than DELETE_IMAGES_INTERVAL seconds."""
+    """Deletes images from the image store older than DELETE_IMAGES_INTERVAL seconds."""
+    image_store = ImageStore(IMAGE_STORE_PATH)
     try:
         while True:
             update_status("delete_old_images", 1, lock) # Pass the lock
             now = datetime.now()
             with log_lock:
                 guardar_horario_logger.info(f"⏳ Cleaning up old images..., current time: {now}")
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
 
             try:
-                threshold_time = datetime.now() - timedelta(seconds=DELETE_IMAGES_INTERVAL)
-                threshold_time_str = threshold_time.strftime("%Y-%m-%d %H:%M:%S")
-                with log_lock:
-                    guardar_horario_logger.info(f"🔄 Deleting images older than {threshold_time_str}...")
-
+                keep = set()
                 if KEEP_CONTRARY_IMAGES:
                     with log_lock:
                         guardar_horario_logger.info("✅ Keep contrary images are enabled")
-                    number_of_rows = cursor.execute(
-                        "SELECT COUNT(*) FROM detections WHERE image IS NOT NULL and direction != 'ascending' AND timestamp < ?",
-                        (threshold_time_str,)).fetchone()[0]
-                    with log_lock:
-                        guardar_horario_logger.info(f"🔄 Deleting {number_of_rows} contrary images if exists")
-                    cursor.execute("UPDATE detections SET image = NULL WHERE direction != 'ascending' AND timestamp < ?",
-                                   (threshold_time_str,))
+                    # Only the images of ascending detections are kept (read-only query, no rows rewritten)
+                    keep = {
+                        row[0] for row in database.reader().execute(
+                            "SELECT image_key FROM detections WHERE image_key IS NOT NULL AND direction = 'ascending'"
+                        )
+                    }
                 else:
                     with log_lock:
                         guardar_horario_logger.info("✅ Keep contrary images are disabled")
-                    number_of_rows = cursor.execute(
-                        "SELECT COUNT(*) FROM detections WHERE image IS NOT NULL and timestamp < ?",
-                        (threshold_time_str,)).fetchone()[0]
-                    with log_lock:
-                        guardar_horario_logger.info(f"🔄 Deleting {number_of_rows} images")
-                    cursor.execute("UPDATE detections SET image = NULL WHERE  timestamp < ?", (threshold_time_str,))
-                conn.commit()
+                # Images are files named by their hash: expiring them is an unlink per file
+                number_of_files = image_store.expire(DELETE_IMAGES_INTERVAL, keep=keep)
                 with log_lock:
-                    guardar_horario_logger.info("✅ Old images deleted successfully")
+                    guardar_horario_logger.info(f"✅ {number_of_files} old images deleted successfully")
 
             except Exception as e:
                 with log_lock:
                     guardar_horario_logger.error(f"❌ Error deleting images: {e}")
-            finally:
-                conn.close()
 
             time.sleep(DELETE_IMAGES_INTERVAL)
     except Exception as e:
@@ -229,3 +306,29 @@ def delete_old_images(lock): # Receive the lock as a parameter
             guardar_horario_logger.error(f"❌❌❌ An fatal error in delete_old_images occurred: {e}")
             traceback.print_exc()
         send_alert(vehicle_id="SYSTEM", x_pos=0, y_pos=0, alert_type=f"delete_old_images FAILED.")
+
+
+def database_maintenance(lock): # Receive the lock as a parameter
+    """Reclaims free pages of the local database in short steps and refreshes its statistics (see db_maintenance)."""
+    maintenance = DatabaseMaintenance(database, MAINTENANCE_REPORT, **MAINTENANCE_SETTINGS)
+    try:
+        while True:
+            update_status("database_maintenance", 1, lock) # Pass the lock
+            try:
+                report = maintenance.run_once()
+                with log_lock:
+                    guardar_horario_logger.info(
+                        f"✅ Database maintenance: {report['reclaimed_pages']} pages reclaimed, "
+                        f"{report['free_pages']} free of {report['page_count']}"
+                    )
+            except Exception as e:
+                with log_lock:
+                    guardar_horario_logger.error(f"❌ Error in database maintenance: {e}")
+
+            time.sleep(MAINTENANCE_INTERVAL)
+    except Exception as e:
+        update_status("database_maintenance", 0, lock) # Pass the lock
+        with log_lock:
+            guardar_horario_logger.error(f"❌❌❌ An fatal error in database_maintenance occurred: {e}")
+            traceback.print_exc()
+        send_alert(vehicle_id="SYSTEM", x_pos=0, y_pos=0, alert_type=f"database_maintenance FAILED.")
@@ -0,0 +1,182 @@
+"""
+Content-addressed store for the detection images.
+
+Images are kept as files named by the hash of their bytes, sharded in 256
+sub-directories by the first two hex digits:
+
+    <root>/3f/3fa85c...e1.jpg
+
+Detection rows only keep the key (detections.image_key), so they stay small
+and the uploader and the dashboard never read image bytes they do not need.
+Expiring an image is an unlink instead of an UPDATE over the detections table.
+
+camera_service writes through an ImageWriter: the camera loop only hashes
+the image and queues it, and a background thread does the file I/O.
+"""
+import hashlib
+import os
+import queue
+import threading
+import time
+import logging
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+image_logger = logging.getLogger("camera_service.image_store")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+_STOP = object()  # Sentinel used to wake up and stop the writer thread
+
+KEY_BYTES = 16  # blake2b digest size, 32 hex characters
+SUFFIX = ".jpg"
+
+
+class ImageStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key_for(data):
+        return hashlib.blake2b(data, digest_size=KEY_BYTES).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + SUFFIX)
+
+    def put(self, data):
+        """Stores the image (once per content) and returns its key."""
+        key = self.key_for(data)
+        path = self.path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Readers never see a partial image
+        else:
+            os.utime(path)  # Referenced again: restart its expiry
+        return key
+
+    def get(self, key):
+        """Returns the image bytes, or None if it does not exist (e.g. already expired)."""
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def expire(self, max_age, keep=()):
+        """
+        Deletes the images older than max_age seconds, except the keys in `keep`.
+        Returns the number of files deleted.
+        """
+        threshold = time.time() - max_age
+        deleted = 0
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                key = entry.name[:-len(SUFFIX)] if entry.name.endswith(SUFFIX) else None
+                if key in keep:
+                    continue
+                try:
+                    if entry.stat().st_mtime < threshold:
+                        os.unlink(entry.path)  # Also removes leftover .tmp files
+                        deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+    def usage(self):
+        """Returns (number of images, total bytes)."""
+        count = size = 0
+        for shard in os.scandir(self.root):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    count += 1
+                    size += entry.stat().st_size
+        return count, size
+
+
+class ImageWriter:
+    """
+    Write-behind stage for an ImageStore.
+
+    put() only hashes the image, so the key can go into the detection row at
+    once, and queues the bytes; a background thread creates the directory,
+    writes the file and renames it. If the bounded queue is full the image is
+    dropped (and counted) and put() returns None, so the detection is stored
+    without an image instead of blocking the camera loop.
+    """
+
+    def __init__(self, store, queue_size=100):
+        self.store = store
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        """Starts the writer thread (no-op if it is already running)."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, name="image_writer", daemon=True)
+        self.thread.start()
+
+    def put(self, data):
+        """Queues an image without blocking. Returns its key, or None if it had to be dropped."""
+        key = self.store.key_for(data)
+        try:
+            self.queue.put_nowait((key, data))
+            return key
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                with log_lock:
+                    image_logger.warning(f"⚠️ Image queue full, {self.dropped} images dropped so far")
+            return None
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    def close(self, timeout=10.0):
+        """Writes every pending image and stops the writer thread."""
+        if self.thread is None:
+            return
+        try:
+            self.queue.put((_STOP, None), timeout=timeout)
+        except queue.Full:
+            with log_lock:
+                image_logger.error("❌ Image writer is not draining, pending images are lost")
+        self.thread.join(timeout)
+        self.thread = None
+        with log_lock:
+            image_logger.info(f"✅ Image writer stopped: {self.stats()}")
+
+    def _run(self):
+        while True:
+            key, data = self.queue.get()
+            if key is _STOP:
+                break
+            try:
+                self.store.put(data)
+                self.written += 1
+            except OSError as e:
+                self.errors += 1
+                with log_lock:
+                    image_logger.error(f"❌ Error storing detection image {key}: {e}")
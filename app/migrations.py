@@ -0,0 +1,399 @@
+"""
+Schema of the local SQLite database, versioned with PRAGMA user_version.
+
+Every process that opens the database calls migrate(), which applies in
+one transaction the migrations the file has not seen yet, so existing
+databases are upgraded in place and new ones are created with the same
+code. To change the schema, append a function to MIGRATIONS; never edit
+one that has already shipped.
+
+Timestamps are stored as INTEGER epoch milliseconds (epoch_ms()), which
+sort and compare as numbers and keep the indexes small. Text timestamps
+("%Y-%m-%d %H:%M:%S", local time) of older databases are converted by
+migration 2; format_epoch_ms() gives that text form back for display and
+for the master database.
+"""
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+migrations_logger = logging.getLogger("camera_service.migrations")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Local-time text timestamp -> epoch milliseconds, in SQL
+TEXT_TO_EPOCH_MS_SQL = "CAST(strftime('%s', {column}, 'utc') AS INTEGER) * 1000"
+
+
+def epoch_ms(dt=None):
+    """Epoch milliseconds of a datetime (local time if naive), or of now."""
+    if dt is None:
+        return int(time.time() * 1000)
+    return int(dt.timestamp() * 1000)
+
+
+def from_epoch_ms(ms):
+    """Local naive datetime of an epoch milliseconds timestamp."""
+    return datetime.fromtimestamp(ms / 1000)
+
+
+def format_epoch_ms(ms):
+    """Epoch milliseconds -> "%Y-%m-%d %H:%M:%S" in local time (None stays None)."""
+    return None if ms is None else from_epoch_ms(ms).strftime(TIMESTAMP_FORMAT)
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _add_missing_columns(conn, table, columns):
+    existing = _columns(conn, table)
+    for name, declaration in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+
+def _rebuild(conn, table, create_sql, timestamp_columns):
+    """
+    Recreates a table with create_sql and copies its rows, converting the
+    text timestamp_columns to epoch ms. Columns of the old table that the new
+    definition does not have (e.g. the image BLOB of the oldest databases) are
+    kept.
+    """
+    old_columns = _columns(conn, table)
+    old_types = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({table})")}
+    conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    conn.execute(create_sql)
+    _add_missing_columns(conn, table, [(name, old_types[name]) for name in old_columns])
+    select = ", ".join(
+        TEXT_TO_EPOCH_MS_SQL.format(column=name) if name in timestamp_columns else name for name in old_columns
+    )
+    conn.execute(f"INSERT INTO {table} ({', '.join(old_columns)}) SELECT {select} FROM {table}_old")
+    conn.execute(f"DROP TABLE {table}_old")
+
+
+def _001_initial_schema(conn):
+    """The tables as camera_service and the alert dispatcher used to create them, text timestamps."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS detections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            vehicle_id TEXT,
+            x_position REAL,
+            y_position REAL,
+            direction TEXT,
+            image_key TEXT,
+            camera_id TEXT,
+            speed REAL,
+            heading REAL
+        )
+        """
+    )
+    # Databases created before the image store keep their image column, but new images go to image_key
+    _add_missing_columns(
+        conn, "detections",
+        [("image_key", "TEXT"), ("camera_id", "TEXT"), ("speed", "REAL"), ("heading", "REAL")],
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS trajectories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vehicle_id TEXT,
+            label INTEGER,
+            first_timestamp TEXT,
+            last_timestamp TEXT,
+            entry_x REAL,
+            entry_y REAL,
+            exit_x REAL,
+            exit_y REAL,
+            direction TEXT,
+            samples INTEGER,
+            polyline BLOB,
+            end_reason TEXT,
+            camera_id TEXT,
+            mean_speed REAL
+        )
+        """
+    )
+    _add_missing_columns(conn, "trajectories", [("camera_id", "TEXT"), ("mean_speed", "REAL")])
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS zone_counts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_start TEXT,
+            period_end TEXT,
+            camera_id TEXT,
+            kind TEXT,
+            name TEXT,
+            direction TEXT,
+            count INTEGER
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS config (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            send_image BOOLEAN,
+            refresh_rate REAL
+        )
+        """
+    )
+    # The dashboard updates the row with id 1
+    if conn.execute("SELECT COUNT(*) FROM config").fetchone()[0] == 0:
+        conn.execute("INSERT INTO config (send_image, refresh_rate) VALUES (?, ?)", (False, 0.5))
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pending_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            vehicle_id TEXT,
+            x_position REAL,
+            y_position REAL,
+            alert TEXT
+        )
+        """
+    )
+
+
+def _002_epoch_ms_timestamps(conn):
+    """Integer epoch-ms timestamps in detections, trajectories and zone_counts."""
+    _rebuild(
+        conn, "detections",
+        """
+        CREATE TABLE detections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER,
+            vehicle_id TEXT,
+            x_position REAL,
+            y_position REAL,
+            direction TEXT,
+            image_key TEXT,
+            camera_id TEXT,
+            speed REAL,
+            heading REAL
+        )
+        """,
+        {"timestamp"},
+    )
+    _rebuild(
+        conn, "trajectories",
+        """
+        CREATE TABLE trajectories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vehicle_id TEXT,
+            label INTEGER,
+            first_timestamp INTEGER,
+            last_timestamp INTEGER,
+            entry_x REAL,
+            entry_y REAL,
+            exit_x REAL,
+            exit_y REAL,
+            direction TEXT,
+            samples INTEGER,
+            polyline BLOB,
+            end_reason TEXT,
+            camera_id TEXT,
+            mean_speed REAL
+        )
+        """,
+        {"first_timestamp", "last_timestamp"},
+    )
+    _rebuild(
+        conn, "zone_counts",
+        """
+        CREATE TABLE zone_counts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_start INTEGER,
+            period_end INTEGER,
+            camera_id TEXT,
+            kind TEXT,
+            name TEXT,
+            direction TEXT,
+            count INTEGER
+        )
+        """,
+        {"period_start", "period_end"},
+    )
+
+
+def _003_indexes(conn):
+    """Indexes for the queries that used to scan the whole table."""
+    # History (ORDER BY timestamp DESC LIMIT 50), vehicles in the last hour and the uploader ranges;
+    # with vehicle_id the COUNT(DISTINCT vehicle_id) is answered from the index alone
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections (timestamp, vehicle_id)")
+    # Images kept by delete_old_images when keep_contrary_images is set
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_detections_ascending_images ON detections (image_key) "
+        "WHERE direction = 'ascending' AND image_key IS NOT NULL"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trajectories_last_timestamp ON trajectories (last_timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_zone_counts_period_start ON zone_counts (period_start)")
+
+
+# Migration 4 keeps its own copy of the partition SQL as it shipped: later changes to partitions must not change it
+_004_PARTITION_MS = 3600 * 1000
+_004_MAX_PARTITIONS = 400
+_004_COLUMNS = "id, timestamp, vehicle_id, x_position, y_position, direction, image_key, camera_id, speed, heading"
+_004_CREATE_PARTITION_SQL = """
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY,
+        timestamp INTEGER,
+        vehicle_id TEXT,
+        x_position REAL,
+        y_position REAL,
+        direction TEXT,
+        image_key TEXT,
+        camera_id TEXT,
+        speed REAL,
+        heading REAL
+    )
+"""
+
+
+def _004_partitioned_detections(conn):
+    """detections becomes hourly partitions behind a view (see partitions), with writer-assigned ids."""
+    conn.execute("CREATE TABLE detection_sequence (last_id INTEGER NOT NULL)")
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM detections").fetchone()[0]
+    conn.execute("INSERT INTO detection_sequence (last_id) VALUES (?)", (last_id,))
+
+    # The legacy image BLOB column of the oldest databases is not carried over
+    conn.execute("ALTER TABLE detections RENAME TO detections_unpartitioned")
+    # One pass over the timestamp index of migration 3
+    indexes = [
+        index for (index,) in conn.execute(
+            f"SELECT DISTINCT timestamp / {_004_PARTITION_MS} FROM detections_unpartitioned "
+            "WHERE timestamp IS NOT NULL ORDER BY 1"
+        )
+    ]
+    has_null = conn.execute("SELECT 1 FROM detections_unpartitioned WHERE timestamp IS NULL LIMIT 1").fetchone()
+    if has_null and 0 not in indexes:
+        indexes = sorted(indexes + [0])  # Rows without a timestamp go to the partition of epoch 0
+    if len(indexes) > _004_MAX_PARTITIONS:
+        # Like the writer past its limit: the oldest partition takes the oldest hours
+        indexes = indexes[:1] + indexes[len(indexes) - _004_MAX_PARTITIONS + 1:]
+
+    for position, index in enumerate(indexes):
+        table = f"detections_p{index}"
+        conn.execute(_004_CREATE_PARTITION_SQL.format(table=table))
+        conn.execute(f"CREATE INDEX idx_{table}_timestamp ON {table} (timestamp, vehicle_id)")
+        conn.execute(
+            f"CREATE INDEX idx_{table}_ascending_images ON {table} (image_key) "
+            "WHERE direction = 'ascending' AND image_key IS NOT NULL"
+        )
+        # Plain range predicates, so every copy is a range scan of the timestamp index
+        conditions, params = ["timestamp IS NOT NULL"], []
+        if position > 0:
+            conditions.append("timestamp >= ?")
+            params.append(index * _004_PARTITION_MS)
+        if position + 1 < len(indexes):
+            conditions.append("timestamp < ?")
+            params.append(indexes[position + 1] * _004_PARTITION_MS)
+        conn.execute(
+            f"INSERT INTO {table} ({_004_COLUMNS}) SELECT {_004_COLUMNS} FROM detections_unpartitioned "
+            f"WHERE {' AND '.join(conditions)}",
+            params,
+        )
+        if has_null and index == max((i for i in indexes if i <= 0), default=indexes[0]):
+            conn.execute(
+                f"INSERT INTO {table} ({_004_COLUMNS}) SELECT {_004_COLUMNS} FROM detections_unpartitioned "
+                "WHERE timestamp IS NULL"
+            )
+    conn.execute("DROP TABLE detections_unpartitioned")  # Also drops the indexes of migration 3
+
+    if indexes:
+        select = " UNION ALL ".join(f"SELECT {_004_COLUMNS} FROM detections_p{index}" for index in indexes)
+    else:
+        select = "SELECT " + ", ".join(f"NULL AS {name}" for name in _004_COLUMNS.split(", ")) + " WHERE 0"
+    conn.execute(f"CREATE VIEW detections AS {select}")
+
+
+def _005_detection_rollups(conn):
+    """Per-minute counters by camera, direction and class (see rollups)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS detection_rollups (
+            minute INTEGER NOT NULL,
+            camera_id TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            label INTEGER NOT NULL,
+            vehicles INTEGER NOT NULL,
+            new_vehicles INTEGER NOT NULL,
+            wrong_way INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            sum_x REAL NOT NULL,
+            sum_y REAL NOT NULL,
+            PRIMARY KEY (minute, camera_id, direction, label)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _006_upload_cursor(conn):
+    """Id of the last detection acknowledged by the master database (see guardar_horario)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS upload_cursor (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            updated_at INTEGER
+        )
+        """
+    )
+    # Uploaded rows used to be deleted right away, so everything still here is pending
+    conn.execute("INSERT OR IGNORE INTO upload_cursor (name, last_id) VALUES ('master', 0)")
+
+
+def _007_pending_alert_camera(conn):
+    """Camera of the pending alerts, posted with them to /alerta."""
+    _add_missing_columns(conn, "pending_alerts", [("camera_id", "TEXT")])
+
+
+MIGRATIONS = [
+    _001_initial_schema,
+    _002_epoch_ms_timestamps,
+    _003_indexes,
+    _004_partitioned_detections,
+    _005_detection_rollups,
+    _006_upload_cursor,
+    _007_pending_alert_camera,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(db_path):
+    """
+    Brings the database at db_path up to SCHEMA_VERSION. Returns the version it had.
+
+    Safe to call from every process at startup: when the schema is current it
+    only reads user_version, and concurrent callers are serialized by the
+    write lock taken before re-reading it.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)  # Transactions are handled explicitly
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return version
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number in range(version, SCHEMA_VERSION):
+                MIGRATIONS[number](conn)
+                conn.execute(f"PRAGMA user_version = {number + 1}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if version < SCHEMA_VERSION:
+            with log_lock:
+                migrations_logger.info(f"✅ Database {db_path} migrated from version {version} to {SCHEMA_VERSION}")
+        return version
+    finally:
+        conn.close()
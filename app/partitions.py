@@ -0,0 +1,254 @@
+"""
+Hourly partitions of the local detections table.
+
+Detections are stored in one table per hour of their timestamp,
+detections_p<hour> (hour = epoch ms // PARTITION_MS), and `detections` is a
+view with the UNION ALL of every partition, so queries that only read keep
+working unchanged. The uploader streams the rows in id order after its
+cursor (read_after), and a partition is dropped whole (DROP TABLE, no row
+deletes) once its hour is over and all its rows have been uploaded
+(uploaded_partitions, drop_partitions).
+
+The view has to be rebuilt whenever partitions are created or dropped, and
+SQLite refuses a compound SELECT of more than 500 terms. So the writer
+creates PARTITIONS_AHEAD partitions at a time (one rebuild of the view a
+day instead of one an hour), and there are never more than MAX_PARTITIONS:
+past that (days without a successful upload), the rows of a new hour go
+into the newest partition with an earlier hour, which then spans several
+hours (partition_bounds) until uploads make room again. A partition always
+holds the hours from its own up to the next partition's; only the oldest
+can also hold earlier ones.
+
+Ids are unique across partitions: the detection writer assigns them from
+the detection_sequence high-water mark, which also survives dropping the
+partition with the newest rows.
+
+The functions take an open connection and do not commit. Python's sqlite3
+opens no transaction before DDL, so CREATE/DROP TABLE and the view rebuild
+would each commit on their own: the functions that write start one with
+begin_immediate() when none is open, which also takes the write lock
+before they read the list of partitions. The partitions they see, their
+DDL and the view rebuild are then one atomic transaction, which the caller
+commits (with conn:).
+"""
+import bisect
+import heapq
+from operator import itemgetter
+
+PARTITION_MS = 3600 * 1000  # One partition per hour (changing it would misread existing partitions)
+TABLE_PREFIX = "detections_p"
+MAX_PARTITIONS = 400  # Terms of the view's UNION ALL, below SQLite's limit of 500
+PARTITIONS_AHEAD = 24  # Partitions created at once by the writer (one rebuild of the view)
+
+DETECTION_COLUMNS = (
+    "id", "timestamp", "vehicle_id", "x_position", "y_position", "direction", "image_key", "camera_id", "speed",
+    "heading",
+)
+
+CREATE_PARTITION_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY,
+        timestamp INTEGER,
+        vehicle_id TEXT,
+        x_position REAL,
+        y_position REAL,
+        direction TEXT,
+        image_key TEXT,
+        camera_id TEXT,
+        speed REAL,
+        heading REAL
+    )
+"""
+
+# Statement of the detection rows queued in the DetectionWriter; their values start at timestamp,
+# the id is prepended by insert_detections
+INSERT_DETECTION_SQL = (
+    "INSERT INTO {table} (id, timestamp, vehicle_id, x_position, y_position, direction, image_key, camera_id, "
+    "speed, heading) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def begin_immediate(conn):
+    """Opens a write transaction (taking the write lock at once) unless one is already open."""
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+
+def partition_index(timestamp_ms):
+    return int(timestamp_ms) // PARTITION_MS
+
+
+def partition_table(index):
+    return f"{TABLE_PREFIX}{index}"
+
+
+def partition_range(index):
+    """[start, end) of a partition in epoch ms."""
+    return index * PARTITION_MS, (index + 1) * PARTITION_MS
+
+
+def list_partitions(conn):
+    """Indexes of the existing partitions, oldest first."""
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?", (f"{TABLE_PREFIX}[0-9]*",)
+    ).fetchall()
+    return sorted(int(name[len(TABLE_PREFIX):]) for (name,) in rows)
+
+
+def create_view(conn, indexes=None):
+    """(Re)creates the detections view over the given partitions (all of them by default)."""
+    if indexes is None:
+        indexes = list_partitions(conn)
+    columns = ", ".join(DETECTION_COLUMNS)
+    if indexes:
+        select = " UNION ALL ".join(f"SELECT {columns} FROM {partition_table(index)}" for index in indexes)
+    else:
+        # No partitions yet: same columns, no rows
+        select = "SELECT " + ", ".join(f"NULL AS {name}" for name in DETECTION_COLUMNS) + " WHERE 0"
+    conn.execute("DROP VIEW IF EXISTS detections")
+    conn.execute(f"CREATE VIEW detections AS {select}")
+
+
+def create_partition(conn, index):
+    """
+    Creates a partition (with its indexes) if it does not exist. Returns True
+    if it was created. The view is not rebuilt: call create_view afterwards.
+    """
+    table = partition_table(index)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+        return False
+    conn.execute(CREATE_PARTITION_SQL.format(table=table))
+    # History, vehicles in the last hour and the uploader ranges, answered from the index alone
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table} (timestamp, vehicle_id)")
+    # Images kept by delete_old_images when keep_contrary_images is set
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_ascending_images ON {table} (image_key) "
+        "WHERE direction = 'ascending' AND image_key IS NOT NULL"
+    )
+    return True
+
+
+def _target_partition(conn, index, existing):
+    """
+    Partition that takes the rows of hour `index`, given the existing
+    partitions (sorted, updated in place). Creates it, and the next hours'
+    after the newest one, while there is room below MAX_PARTITIONS.
+    """
+    position = bisect.bisect_right(existing, index)
+    if position and existing[position - 1] == index:
+        return index
+    room = MAX_PARTITIONS - len(existing)
+    if room > 0:
+        if position == len(existing):
+            created = range(index, index + min(PARTITIONS_AHEAD, room))
+        else:
+            created = [index]  # An hour older than the newest partition (e.g. the clock went back)
+        for new_index in created:
+            create_partition(conn, new_index)
+        existing[position:position] = created
+        create_view(conn, existing)
+        return index
+    # No room: the newest partition with an earlier hour (the oldest one for earlier hours)
+    return existing[position - 1] if position else existing[0]
+
+
+def insert_detections(conn, rows):
+    """
+    Inserts detection rows (the INSERT_DETECTION_SQL values without the id)
+    into the partitions of their timestamps, creating them as needed.
+    Returns the number of partitions written.
+    """
+    begin_immediate(conn)
+    last_id = conn.execute("SELECT last_id FROM detection_sequence").fetchone()[0]
+    groups = {}
+    for params in rows:
+        last_id += 1
+        groups.setdefault(partition_index(params[0]), []).append((last_id,) + tuple(params))
+    existing = list_partitions(conn)
+    for index, group in groups.items():
+        table = partition_table(_target_partition(conn, index, existing))
+        conn.executemany(INSERT_DETECTION_SQL.format(table=table), group)
+    conn.execute("UPDATE detection_sequence SET last_id = ?", (last_id,))
+    return len(groups)
+
+
+def read_after(conn, columns, after_id, end_ms, limit):
+    """
+    Up to `limit` rows (with the given columns, which include id and
+    timestamp) with id > after_id, in id order. Stops before the first row
+    with timestamp >= end_ms, so a cursor that advances to the last row
+    returned never skips a row of the period that is still open. Rows
+    without a timestamp (legacy, in partition 0) are returned as they come.
+    """
+    select = ", ".join(columns)
+    id_column, timestamp_column = columns.index("id"), columns.index("timestamp")
+    # Each partition is read in primary key order from after_id on, and the partitions are merged by id
+    cursors = [
+        conn.execute(f"SELECT {select} FROM {partition_table(index)} WHERE id > ? ORDER BY id", (after_id,))
+        for index in list_partitions(conn)
+    ]
+    rows = []
+    for row in heapq.merge(*cursors, key=itemgetter(id_column)):
+        if len(rows) >= limit or (row[timestamp_column] is not None and row[timestamp_column] >= end_ms):
+            break
+        rows.append(row)
+    return rows
+
+
+def partition_bounds(conn, index):
+    """
+    [start, end) in epoch ms of the hours a partition holds: its own hour,
+    widened to whole hours around its rows when it took the rows of other
+    hours (past MAX_PARTITIONS).
+    """
+    start, end = partition_range(index)
+    low, high = conn.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {partition_table(index)}").fetchone()
+    if low is not None:
+        start = min(start, partition_range(partition_index(low))[0])
+        end = max(end, partition_range(partition_index(high))[1])
+    return start, end
+
+
+def uploaded_partitions(conn, last_id, end_ms):
+    """Indexes of the partitions that end before end_ms and whose rows all have id <= last_id."""
+    indexes = []
+    for index in list_partitions(conn):
+        if partition_bounds(conn, index)[1] > end_ms:
+            break
+        max_id = conn.execute(f"SELECT MAX(id) FROM {partition_table(index)}").fetchone()[0]
+        if max_id is None or max_id <= last_id:
+            indexes.append(index)
+    return indexes
+
+
+def read_partition(conn, index, columns):
+    """Rows (with the given columns) of one partition in timestamp order; rows without a timestamp are left out."""
+    return conn.execute(
+        f"SELECT {', '.join(columns)} FROM {partition_table(index)} WHERE timestamp IS NOT NULL ORDER BY timestamp"
+    )
+
+
+def drop_partitions(conn, indexes):
+    """Drops whole partitions and rebuilds the view without them."""
+    if not indexes:
+        return
+    begin_immediate(conn)
+    for index in indexes:
+        conn.execute(f"DROP TABLE IF EXISTS {partition_table(index)}")
+    create_view(conn, list_partitions(conn))
+
+
+def read_latest(conn, columns, limit):
+    """The `limit` newest detections (by timestamp), reading only the newest partitions needed."""
+    select = ", ".join(columns)
+    rows = []
+    # A partition holds the hours up to the next partition's, so newer partitions hold newer rows
+    for index in reversed(list_partitions(conn)):
+        rows.extend(
+            conn.execute(
+                f"SELECT {select} FROM {partition_table(index)} ORDER BY timestamp DESC LIMIT ?", (limit - len(rows),)
+            )
+        )
+        if len(rows) >= limit:
+            break
+    return rows
@@ -0,0 +1,168 @@
+"""
+Per-minute traffic rollups, maintained as the camera runs.
+
+MinuteRollups.update() is called every frame with the tracked vehicles and
+keeps, for each (minute, direction, class) of the camera (only the rows the
+tracker updated: LOST and REMOVED rows are left out, as in zones and
+trajectory_store):
+
+    vehicles      distinct vehicles of the minute, each under the first
+                  direction (ascending/descending) it shows in it; vehicles
+                  whose direction is still undefined are not counted yet
+    new_vehicles  tracks that started in that minute (each track counts once,
+                  so summing over minutes gives the vehicles of a period)
+    wrong_way     distinct vehicles flagged as going the wrong way
+    samples       tracked observations (one per vehicle and frame), with the
+                  sums of their x and y for the mean position
+
+Only the increments since the previous flush are written, every
+flush_interval seconds, through the detection writer as upserts into the
+detection_rollups table, so the dashboard reads the current minute almost
+live. The table is small (a few rows per minute) and is not touched when
+the raw detections are uploaded and dropped; rows older than the
+retention are removed by delete_before(). The module does not import the
+tracker (nor depthai), so the dashboard and the uploader can read the
+rollups with it.
+"""
+import threading
+import time
+import logging
+
+from migrations import format_epoch_ms
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+rollups_logger = logging.getLogger("camera_service.rollups")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+MINUTE_MS = 60 * 1000
+
+UPSERT_ROLLUP_SQL = (
+    "INSERT INTO detection_rollups (minute, camera_id, direction, label, vehicles, new_vehicles, wrong_way, "
+    "samples, sum_x, sum_y) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (minute, camera_id, direction, label) DO UPDATE SET "
+    "vehicles = vehicles + excluded.vehicles, new_vehicles = new_vehicles + excluded.new_vehicles, "
+    "wrong_way = wrong_way + excluded.wrong_way, samples = samples + excluded.samples, "
+    "sum_x = sum_x + excluded.sum_x, sum_y = sum_y + excluded.sum_y"
+)
+
+# Indexes of the increments kept per (minute, direction, label)
+VEHICLES, NEW_VEHICLES, WRONG_WAY, SAMPLES, SUM_X, SUM_Y = range(6)
+
+
+class MinuteRollups:
+    """Incremental per-minute counters of one camera, written to detection_rollups."""
+
+    def __init__(self, writer, tracker, direction_names, camera_id=None, wrong_way_min_count=3, flush_interval=5):
+        self.writer = writer
+        self.direction_names = direction_names  # vehicles_tracker.DIRECTION_NAMES
+        self.undefined = next(code for code, name in direction_names.items() if name == "undefined")
+        self.camera_id = camera_id or ""  # Part of the primary key, which cannot be NULL
+        self.wrong_way_min_count = wrong_way_min_count
+        self.flush_interval = flush_interval
+        self.minute = None
+        self.counted = set()  # tracklet_ids already counted in vehicles in the current minute
+        self.wrong = set()  # tracklet_ids already counted as wrong way in the current minute
+        self.tracks = set()  # tracklet_ids whose track has been counted in new_vehicles
+        self.pending = {}  # (minute, direction, label) -> increments since the last flush
+        self.rows_written = 0
+        self._next_flush = time.monotonic() + flush_interval
+        tracker.add_track_end_callback(self.end_track)
+
+    def _increments(self, direction, label):
+        key = (self.minute, direction, label)
+        increments = self.pending.get(key)
+        if increments is None:
+            increments = self.pending[key] = [0, 0, 0, 0, 0.0, 0.0]
+        return increments
+
+    def update(self, batch, rows, timestamp):
+        """Adds the selected rows of a frame (timestamp in epoch ms) to the counters of its minute."""
+        minute = timestamp - timestamp % MINUTE_MS
+        if minute != self.minute:
+            self.minute = minute
+            self.counted.clear()
+            self.wrong.clear()
+
+        # LOST and REMOVED rows have no history: the track of a REMOVED row has already ended
+        active = rows[batch.has_history[rows]]
+        ids = batch.ids[active].tolist()
+        labels = batch.labels[active].tolist()
+        directions = batch.direction[active].tolist()
+        wrong_way = (batch.ascending_count[active] >= self.wrong_way_min_count).tolist()
+        points = batch.pixel_centroids[active].tolist()
+
+        for i, tracklet_id in enumerate(ids):
+            # Same direction names as the detections table
+            direction = self.direction_names[directions[i]]
+            increments = self._increments(direction, labels[i])
+            if directions[i] != self.undefined and tracklet_id not in self.counted:
+                self.counted.add(tracklet_id)
+                increments[VEHICLES] += 1
+            if tracklet_id not in self.tracks:
+                self.tracks.add(tracklet_id)
+                increments[NEW_VEHICLES] += 1
+            if wrong_way[i] and tracklet_id not in self.wrong:
+                self.wrong.add(tracklet_id)
+                increments[WRONG_WAY] += 1
+            increments[SAMPLES] += 1
+            increments[SUM_X] += points[i][0]
+            increments[SUM_Y] += points[i][1]
+
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def end_track(self, tracklet_id, reason):
+        """Tracker callback: a later track with the same id counts as a new vehicle."""
+        self.tracks.discard(tracklet_id)
+
+    def flush(self):
+        """Queues the increments since the last flush as upserts into detection_rollups."""
+        for (minute, direction, label), increments in self.pending.items():
+            self.writer.put(
+                (minute, self.camera_id, direction, label, *increments[:SUM_X], round(increments[SUM_X], 1),
+                 round(increments[SUM_Y], 1)),
+                statement=UPSERT_ROLLUP_SQL,
+            )
+        if self.pending:
+            self.rows_written += len(self.pending)
+            with log_lock:
+                rollups_logger.debug(f"✅ {len(self.pending)} rollup rows flushed up to {format_epoch_ms(self.minute)}")
+        self.pending = {}
+        self._next_flush = time.monotonic() + self.flush_interval
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        return {"rows_written": self.rows_written, "pending": len(self.pending), "tracks": len(self.tracks)}
+
+
+def count_vehicles(conn, start_ms, end_ms=None):
+    """Vehicles whose track started in [start_ms, end_ms), from the rollups (minute resolution)."""
+    if end_ms is None:
+        row = conn.execute("SELECT SUM(new_vehicles) FROM detection_rollups WHERE minute >= ?", (start_ms,)).fetchone()
+    else:
+        row = conn.execute(
+            "SELECT SUM(new_vehicles) FROM detection_rollups WHERE minute >= ? AND minute < ?", (start_ms, end_ms)
+        ).fetchone()
+    return row[0] or 0
+
+
+def read_totals(conn, start_ms, end_ms):
+    """
+    Totals by (direction, label) over [start_ms, end_ms): vehicles, wrong_way
+    and the mean position. Vehicles are summed per minute, so one that is
+    visible across a minute boundary counts in both minutes.
+    """
+    return conn.execute(
+        "SELECT direction, label, SUM(vehicles), SUM(wrong_way), SUM(sum_x) / SUM(samples), SUM(sum_y) / SUM(samples) "
+        "FROM detection_rollups WHERE minute >= ? AND minute < ? GROUP BY direction, label ORDER BY direction, label",
+        (start_ms, end_ms),
+    ).fetchall()
+
+
+def delete_before(conn, timestamp_ms):
+    """Deletes the rollups of the minutes before timestamp_ms. Returns the number of rows deleted."""
+    return conn.execute("DELETE FROM detection_rollups WHERE minute < ?", (timestamp_ms,)).rowcount
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+import time
+import logging
+
+from db import get_database
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+runtime_logger = logging.getLogger("camera_service.runtime_config")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+DEFAULT_SEND_IMAGE = False
+DEFAULT_REFRESH_RATE = 0.5
+
+
+class RuntimeConfig:
+    """
+    In-memory copy of the dashboard settings stored in the config table.
+
+    The camera loop reads send_image and refresh_rate as plain attributes.
+    refresh() is cheap enough to call on every frame: at most once every
+    poll_interval seconds it asks SQLite for PRAGMA data_version on the
+    read-only connection of the calling thread, and only re-reads the config row when another
+    connection has committed since the last check. data_version also moves with the
+    commits of the detection writer (about once a second), so the settings are only
+    applied and logged when they actually differ from the current ones.
+    """
+
+    def __init__(self, db_path, poll_interval=0.5):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.send_image = DEFAULT_SEND_IMAGE
+        self.refresh_rate = DEFAULT_REFRESH_RATE
+        self._conn = None
+        self._data_version = None
+        self._next_poll = 0.0
+
+    def refresh(self, force=False):
+        """Reloads the settings if the database changed. Returns True if they changed."""
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return False
+        self._next_poll = now + self.poll_interval
+        try:
+            if self._conn is None:
+                self._conn = get_database(self.db_path).reader()
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if not force and data_version == self._data_version:
+                return False
+            self._data_version = data_version
+            result = self._conn.execute(
+                "SELECT send_image, refresh_rate FROM config WHERE id = 1"
+            ).fetchone()
+        except sqlite3.Error as e:
+            with log_lock:
+                runtime_logger.error(f"❌ Error getting config: {e}")
+            self.close()  # Reconnect on the next poll
+            return False
+
+        if result:
+            send_image = bool(result[0])
+            refresh_rate = result[1] if result[1] else DEFAULT_REFRESH_RATE
+        else:
+            send_image = DEFAULT_SEND_IMAGE
+            refresh_rate = DEFAULT_REFRESH_RATE
+        if not force and (send_image, refresh_rate) == (self.send_image, self.refresh_rate):
+            return False  # Another table changed (e.g. the detection writer committed)
+        self.send_image = send_image
+        self.refresh_rate = refresh_rate
+        with log_lock:
+            runtime_logger.info(
+                f"🔄 Config reloaded: send_image={self.send_image}, refresh_rate={self.refresh_rate}"
+            )
+        return True
+
+    def close(self):
+        """Closes the polling connection (the connections of the calling thread)."""
+        if self._conn is not None:
+            get_database(self.db_path).close()
+            self._conn = None
+        self._data_version = None
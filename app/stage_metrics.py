@@ -0,0 +1,126 @@
+import bisect
+import threading
+import time
+
+# Upper bounds (seconds) of the histogram buckets: 20 µs to ~27 s, 25% apart.
+# Fixed buckets keep record() to a bisect and an increment, with no allocations.
+BUCKET_BOUNDS = [20e-6 * 1.25 ** i for i in range(64)]
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with count, total and max."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)  # Last bucket: above the last bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (0-100), in seconds."""
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        """Returns count, mean, p50/p95/p99 and max in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class StageMetrics:
+    """
+    Per-stage latency histograms and counters for the camera loop.
+
+    Usage in the loop:
+
+        t = time.perf_counter()
+        in_nn = q_nn.get()
+        t = metrics.lap("nn_wait", t)
+
+    Recording is done without locks from the camera thread; readers (the
+    FastAPI endpoint) may see a snapshot that is off by one sample, which is
+    fine for monitoring. Gauges are callables evaluated at snapshot time,
+    e.g. the detection writer queue stats.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.time()
+        self._lock = threading.Lock()  # Only for creating stages and snapshots
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(stage, LatencyHistogram())
+        histogram.record(seconds)
+
+    def lap(self, stage, start):
+        """Records the time since `start` for a stage and returns the current perf_counter()."""
+        now = time.perf_counter()
+        if self.enabled:
+            self.record(stage, now - start)
+        return now
+
+    def increment(self, counter, n=1):
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def register_gauge(self, name, func):
+        self.gauges[name] = func
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """Returns every stage summary, counter and gauge as a JSON-friendly dict."""
+        with self._lock:
+            stages = {name: histogram.summary() for name, histogram in self.stages.items()}
+        gauges = {}
+        for name, func in self.gauges.items():
+            try:
+                gauges[name] = func()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        return {
+            "enabled": self.enabled,
+            "uptime_s": round(time.time() - self.started, 1),
+            "stages": stages,
+            "counters": dict(self.counters),
+            "gauges": gauges,
+        }
+
+
+# Shared by camera_service (writer) and fastapi_server (reader), which run in the same process
+camera_metrics = StageMetrics()
+
+# With several cameras, camera_metrics only keeps the shared gauges and each stream records here
+stream_metrics = {}  # camera_id -> StageMetrics
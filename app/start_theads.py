@@ -4,7 +4,7 @@ import os
 import time
 import traceback
 from camera_service import main as run_camera_service
-from guardar_horario import send_hourly_data, delete_old_images
+from guardar_horario import send_hourly_data, delete_old_images, database_maintenance
 from fastapi_server import run_server
 import logging
 from datetime import datetime
@@ -56,6 +56,7 @@ def create_status_file(lock):
         "camera_service": 0,
         "send_hourly_data": 0,
         "delete_old_images": 0,
+        "database_maintenance": 0,
         "fastapi_server": 0
     }
     with lock:
@@ -100,6 +101,18 @@ def delete_old_images_wrapper(lock):
         update_status("delete_old_images", 0, lock)
 
 
+def database_maintenance_wrapper(lock):
+    """Wrapper for database_maintenance with error handling."""
+    try:
+        update_status("database_maintenance", 1, lock)
+        start_threads_logger.info("🔄 Starting database_maintenance...")
+        database_maintenance(lock)
+    except Exception as e:
+        start_threads_logger.error(f"❌❌❌ An error in database_maintenance occurred: {e}")
+        traceback.print_exc()
+        update_status("database_maintenance", 0, lock)
+
+
 def run_server_wrapper(lock):
     """Wrapper for run_server with error handling."""
     try:
@@ -122,12 +135,14 @@ def main():
     update_status("camera_service", 0, yaml_lock)
     update_status("send_hourly_data", 0, yaml_lock)
     update_status("delete_old_images", 0, yaml_lock)
+    update_status("database_maintenance", 0, yaml_lock)
     update_status("fastapi_server", 0, yaml_lock)
 
     # Start the threads, passing the lock
     camera_thread = threading.Thread(target=camera_service_wrapper, args=(yaml_lock,), daemon=True)
     send_data_thread = threading.Thread(target=send_hourly_data_wrapper, args=(yaml_lock,), daemon=True)
     delete_images_thread = threading.Thread(target=delete_old_images_wrapper, args=(yaml_lock,), daemon=True)
+    maintenance_thread = threading.Thread(target=database_maintenance_wrapper, args=(yaml_lock,), daemon=True)
     fastapi_thread = threading.Thread(target=run_server_wrapper, args=(yaml_lock,), daemon=True)
 
     start_threads_logger.info(f"🔄 Starting threads at {datetime.now()}")
@@ -135,6 +150,7 @@ def main():
     camera_thread.start()
     send_data_thread.start()
     delete_images_thread.start()
+    maintenance_thread.start()
 
     while True:
         time.sleep(1)  # Keep the main thread alive
@@ -0,0 +1,162 @@
+"""
+Snapshots of the VehicleTracker state for a warm restart.
+
+camera_service saves the live tracks of a stream every `interval` seconds
+into a memory-mapped file: one fixed-size record per track with its slot
+arrays (see vehicles_tracker.SNAPSHOT_FIELDS). When the pipeline is opened
+again (a retry after an error, or a new process after a restart) the
+newest snapshot is handed to the tracker, which gives each track back to
+the new tracklet that appears closest to its last position.
+
+Layout of the file:
+
+    header: magic (8 bytes) | record size (u32) | capacity (u32) | current (i32) | padding
+    buffer 0: saved_at (f64) | frame (u64) | count (u32) | padding | capacity records
+    buffer 1: same
+
+Snapshots are written to the buffer that is not current and `current` is
+switched when the copy is complete, so a process that dies in the middle
+of a save leaves the previous snapshot readable. A file written with a
+different record layout (e.g. another max_history) is ignored and reset.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+import logging
+
+import numpy as np
+
+import vehicles_tracker
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+snapshot_logger = logging.getLogger("camera_service.tracker_snapshot")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+MAGIC = b"OAKSNP01"  # Not tracklet_log.MAGIC, so neither file passes for the other
+HEADER = struct.Struct("<8sIIi")
+HEADER_SIZE = 32
+CURRENT_OFFSET = 16
+BUFFER_HEADER = struct.Struct("<dQI")
+BUFFER_HEADER_SIZE = 32
+NO_SNAPSHOT = -1
+
+
+def record_dtype(tracker):
+    """One record per track: its id and the SNAPSHOT_FIELDS arrays of its slot."""
+    fields = [("id", "<i8")]
+    for name in vehicles_tracker.SNAPSHOT_FIELDS:
+        array = getattr(tracker, name)
+        fields.append((name, array.dtype, array.shape[1:]))
+    return np.dtype(fields)
+
+
+class TrackerSnapshot:
+    """Periodic snapshots of one tracker and the restore on pipeline re-initialization."""
+
+    def __init__(self, path, tracker, interval=1.0, max_age=30.0, max_distance=0.05, window_frames=20):
+        self.path = path
+        self.tracker = tracker
+        self.interval = interval
+        self.max_age = max_age  # Older snapshots are not restored
+        self.max_distance = max_distance  # Normalized distance for matching a new tracklet with a saved track
+        self.window_frames = window_frames  # Frames after a restore in which saved tracks can be matched
+        self.dtype = record_dtype(tracker)
+        self.capacity = tracker.max_tracks
+        self.buffer_size = BUFFER_HEADER_SIZE + self.capacity * self.dtype.itemsize
+        self.saves = 0
+        self.last_save_duration = 0.0
+        self._next_save = time.monotonic() + interval
+
+        size = HEADER_SIZE + 2 * self.buffer_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        magic, record_size, capacity, current = HEADER.unpack_from(self._mm, 0)
+        if (magic, record_size, capacity) != (MAGIC, self.dtype.itemsize, self.capacity) or current not in (0, 1):
+            HEADER.pack_into(self._mm, 0, MAGIC, self.dtype.itemsize, self.capacity, NO_SNAPSHOT)
+            current = NO_SNAPSHOT
+        self.current = current
+
+    def _records(self, buffer):
+        offset = HEADER_SIZE + buffer * self.buffer_size + BUFFER_HEADER_SIZE
+        return np.frombuffer(self._mm, dtype=self.dtype, count=self.capacity, offset=offset)
+
+    def save(self):
+        """Writes the live tracks to the spare buffer and makes it the current one. Returns the number of tracks."""
+        start = time.perf_counter()
+        ids, fields = self.tracker.export_tracks()
+        count = len(ids)
+        buffer = 1 if self.current == 0 else 0
+        records = self._records(buffer)
+        records["id"][:count] = ids
+        for name, values in fields.items():
+            records[name][:count] = values
+        del records  # Release the view of the mmap
+        BUFFER_HEADER.pack_into(
+            self._mm, HEADER_SIZE + buffer * self.buffer_size, time.time(), self.tracker.frame, count
+        )
+        struct.pack_into("<i", self._mm, CURRENT_OFFSET, buffer)  # The snapshot is complete
+        self.current = buffer
+        self.saves += 1
+        self.last_save_duration = time.perf_counter() - start
+        self._next_save = time.monotonic() + self.interval
+        return count
+
+    def maybe_save(self):
+        """Saves a snapshot if the interval has passed since the last one (called every frame)."""
+        if time.monotonic() >= self._next_save:
+            self.save()
+
+    def load(self):
+        """Returns (saved_at, {field: array}) of the current snapshot, or None if there is none."""
+        if self.current == NO_SNAPSHOT:
+            return None
+        saved_at, _, count = BUFFER_HEADER.unpack_from(self._mm, HEADER_SIZE + self.current * self.buffer_size)
+        records = self._records(self.current)[:min(count, self.capacity)]
+        fields = {name: records[name].copy() for name in vehicles_tracker.SNAPSHOT_FIELDS}
+        del records
+        return saved_at, fields
+
+    def restore(self):
+        """
+        Called when the pipeline is (re)opened. Saves the tracks still in memory
+        (a retry in the same process), then hands the newest snapshot to the
+        tracker if it is recent enough. Returns the number of tracks restored.
+        """
+        if len(self.tracker):
+            self.save()
+        snapshot = self.load()
+        if snapshot is None:
+            return 0
+        saved_at, fields = snapshot
+        age = time.time() - saved_at
+        if age > self.max_age:
+            with log_lock:
+                snapshot_logger.info(f"🔄 Tracker snapshot {self.path} is {age:.0f} s old, not restored")
+            return 0
+        count = self.tracker.restore_tracks(fields, saved_at, self.max_distance, self.window_frames)
+        with log_lock:
+            snapshot_logger.info(f"✅ {count} tracks restored from {self.path} ({age:.2f} s old)")
+        return count
+
+    def close(self):
+        """Saves a last snapshot and unmaps the file. Safe to call again (atexit and the end of main)."""
+        if self._mm.closed:
+            return
+        self.save()
+        self._mm.close()
+
+    def stats(self):
+        return {
+            "saves": self.saves,
+            "last_save_ms": round(self.last_save_duration * 1000, 3),
+            "restored": self.tracker.restored,
+        }
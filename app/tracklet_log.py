@@ -0,0 +1,359 @@
+"""
+Record and replay of the OAK tracklet stream.
+
+A tracklet log is a flat binary file that can be memory-mapped:
+
+    HEADER | MESSAGE | MESSAGE | ...
+
+    MESSAGE = FRAME record | count x TRACKLET records | image_size bytes of JPEG
+
+All records are little-endian numpy structured dtypes (see below), so a log
+can be read back with np.memmap and sliced without parsing. Coordinates are
+stored normalized (0..1) exactly as the device sends them.
+
+ReplayDevice stands in for dai.Device: it exposes getOutputQueue() for the
+"detections" and "video" streams and feeds run_camera from a log, either in
+real time (following the recorded device timestamps) or as fast as possible.
+"""
+import os
+import sys
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+
+import cv2
+import depthai as dai
+import numpy as np
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+tracklet_log_logger = logging.getLogger("camera_service.tracklet_log")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+MAGIC = b"OAKTRK01"
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("preview_width", "<u4"),
+    ("preview_height", "<u4"),
+])
+
+FRAME_DTYPE = np.dtype([
+    ("seq", "<i8"),         # Device sequence number of the tracklets message
+    ("timestamp", "<f8"),   # Device timestamp in seconds
+    ("count", "<u4"),       # Number of TRACKLET records that follow
+    ("image_size", "<u4"),  # Size of the JPEG preview that follows (0 = no frame)
+])
+
+TRACKLET_DTYPE = np.dtype([
+    ("id", "<i4"),
+    ("label", "<i2"),
+    ("status", "u1"),  # dai.Tracklet.TrackingStatus value
+    ("x1", "<f4"),
+    ("y1", "<f4"),
+    ("x2", "<f4"),
+    ("y2", "<f4"),
+    ("confidence", "<f4"),
+])
+
+
+class ReplayFinished(Exception):
+    """Raised by a replay queue when the log has no more messages."""
+
+
+def session_path(path, now=None):
+    """
+    Log file of a new recording session: record_path with the start time
+    (<name>_<YYYYmmdd-HHMMSS><ext>), and a counter if that file exists.
+    """
+    stem, ext = os.path.splitext(path)
+    stem = f"{stem}_{(now or datetime.now()).strftime('%Y%m%d-%H%M%S')}"
+    candidate = f"{stem}{ext}"
+    number = 1
+    while os.path.exists(candidate):
+        number += 1
+        candidate = f"{stem}_{number}{ext}"
+    return candidate
+
+
+class TrackletRecorder:
+    """
+    Writes the tracklet messages received by run_camera to a tracklet log.
+
+    run_camera opens a recorder for every device session (also on each
+    reconnect retry), and each one gets its own file (see session_path),
+    so a reconnect never overwrites what was recorded before.
+    """
+
+    def __init__(self, path, preview_width, preview_height, record_frames=False):
+        self.path = session_path(path)
+        self.record_frames = record_frames
+        self.messages = 0
+        self._file = open(self.path, "xb")  # Never truncates an existing log
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["preview_width"] = preview_width
+        header["preview_height"] = preview_height
+        self._file.write(header.tobytes())
+        with log_lock:
+            tracklet_log_logger.info(f"🔄 Recording the tracklet stream to {self.path}")
+
+    def write(self, in_nn, frame=None):
+        """Writes one dai.Tracklets message (and optionally its preview frame)."""
+        tracklets = in_nn.tracklets
+        records = np.zeros(len(tracklets), dtype=TRACKLET_DTYPE)
+        for i, t in enumerate(tracklets):
+            roi = t.roi
+            top_left = roi.topLeft()
+            bottom_right = roi.bottomRight()
+            records[i] = (
+                t.id, t.label, int(t.status),
+                top_left.x, top_left.y, bottom_right.x, bottom_right.y,
+                t.srcImgDetection.confidence,
+            )
+
+        image = b""
+        if self.record_frames and frame is not None:
+            image = cv2.imencode(".jpg", frame)[1].tobytes()
+
+        header = np.zeros(1, dtype=FRAME_DTYPE)
+        header["seq"] = in_nn.getSequenceNum()
+        header["timestamp"] = in_nn.getTimestampDevice().total_seconds()
+        header["count"] = len(records)
+        header["image_size"] = len(image)
+        self._file.write(header.tobytes())
+        self._file.write(records.tobytes())
+        if image:
+            self._file.write(image)
+        self.messages += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            with log_lock:
+                tracklet_log_logger.info(f"✅ Tracklet log {self.path} closed with {self.messages} messages")
+
+
+class TrackletLog:
+    """Read-only, memory-mapped view of a tracklet log."""
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        header = self.buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a tracklet log")
+        self.preview_width = int(header["preview_width"])
+        self.preview_height = int(header["preview_height"])
+        self.offsets = self._index()
+
+    def _index(self):
+        """Finds the offset of every FRAME record (only headers are touched)."""
+        offsets = []
+        offset = HEADER_DTYPE.itemsize
+        end = len(self.buffer)
+        while offset + FRAME_DTYPE.itemsize <= end:
+            frame = self.buffer[offset:offset + FRAME_DTYPE.itemsize].view(FRAME_DTYPE)[0]
+            size = FRAME_DTYPE.itemsize + int(frame["count"]) * TRACKLET_DTYPE.itemsize + int(frame["image_size"])
+            if offset + size > end:
+                break  # Truncated last message (recording was interrupted)
+            offsets.append(offset)
+            offset += size
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        """Returns (frame record, tracklet records, JPEG bytes view) for a message."""
+        offset = self.offsets[index]
+        frame = self.buffer[offset:offset + FRAME_DTYPE.itemsize].view(FRAME_DTYPE)[0]
+        offset += FRAME_DTYPE.itemsize
+        size = int(frame["count"]) * TRACKLET_DTYPE.itemsize
+        records = self.buffer[offset:offset + size].view(TRACKLET_DTYPE)
+        offset += size
+        image = self.buffer[offset:offset + int(frame["image_size"])]
+        return frame, records, image
+
+
+class ReplayFrame:
+    """Minimal stand-in for dai.ImgFrame on the "video" stream."""
+
+    def __init__(self, seq, timestamp, image, width, height):
+        self._seq = seq
+        self._timestamp = timestamp
+        self._image = image
+        self._width = width
+        self._height = height
+
+    def getSequenceNum(self):
+        return self._seq
+
+    def getTimestampDevice(self):
+        return timedelta(seconds=self._timestamp)
+
+    def getCvFrame(self):
+        if len(self._image):
+            return cv2.imdecode(np.asarray(self._image), cv2.IMREAD_COLOR)
+        return np.zeros((self._height, self._width, 3), dtype=np.uint8)
+
+
+def _to_tracklets_message(frame, records):
+    """Builds a real dai.Tracklets message from logged records."""
+    tracklets = []
+    for r in records:
+        t = dai.Tracklet()
+        t.id = int(r["id"])
+        t.label = int(r["label"])
+        t.status = dai.Tracklet.TrackingStatus(int(r["status"]))
+        t.roi = dai.Rect(dai.Point2f(float(r["x1"]), float(r["y1"])), dai.Point2f(float(r["x2"]), float(r["y2"])))
+        detection = dai.ImgDetection()
+        detection.confidence = float(r["confidence"])
+        t.srcImgDetection = detection
+        tracklets.append(t)
+    message = dai.Tracklets()
+    message.tracklets = tracklets
+    message.setSequenceNum(int(frame["seq"]))
+    message.setTimestampDevice(timedelta(seconds=float(frame["timestamp"])))
+    return message
+
+
+class ReplayQueue:
+    """Output queue of a ReplayDevice, with the subset of the DataOutputQueue API we use."""
+
+    def __init__(self, device, name):
+        self.device = device
+        self.name = name
+
+    def get(self):
+        return self.device._next(self.name, wait=True)
+
+    def tryGet(self):
+        return self.device._next(self.name, wait=False)
+
+    def has(self):
+        return self.device._has(self.name)
+
+
+class ReplayDevice:
+    """
+    Drop-in replacement for dai.Device that replays a tracklet log.
+
+    speed=1.0 replays in real time using the recorded device timestamps,
+    speed=2.0 twice as fast, and speed=0 as fast as the consumer can go.
+    The "video" stream always returns the frame that belongs to the last
+    tracklets message delivered (a black frame if none was recorded).
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.log = TrackletLog(path)
+        self.speed = speed
+        self.position = 0
+        self._current_frame = None
+        self._start_wall = None
+        self._start_device = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        pass
+
+    def setIrFloodLightIntensity(self, intensity):
+        pass
+
+    def setIrLaserDotProjectorIntensity(self, intensity):
+        pass
+
+    def getOutputQueue(self, name, maxSize=4, blocking=False):
+        if name not in ("detections", "video"):
+            raise RuntimeError(f"Replay log has no stream named {name}")
+        return ReplayQueue(self, name)
+
+    def _has(self, name):
+        if name == "video":
+            return self._current_frame is not None
+        if self.position >= len(self.log):
+            return False
+        if self.speed <= 0 or self._start_wall is None:
+            return True
+        # In timed replay a message is only "queued" once its recorded time has come
+        frame = self.log[self.position][0]
+        due = self._start_wall + (float(frame["timestamp"]) - self._start_device) / self.speed
+        return time.monotonic() >= due
+
+    def _wait_until(self, device_timestamp):
+        """Sleeps until the wall clock catches up with the recorded timeline."""
+        if self.speed <= 0:
+            return
+        if self._start_wall is None:
+            self._start_wall = time.monotonic()
+            self._start_device = device_timestamp
+            return
+        due = self._start_wall + (device_timestamp - self._start_device) / self.speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _next(self, name, wait):
+        if name == "video":
+            return self._current_frame
+
+        if self.position >= len(self.log):
+            if wait:
+                raise ReplayFinished(f"Replay of {self.log.path} finished after {self.position} messages")
+            return None
+        frame, records, image = self.log[self.position]
+        if wait:
+            self._wait_until(float(frame["timestamp"]))
+        self.position += 1
+        self._current_frame = ReplayFrame(
+            int(frame["seq"]), float(frame["timestamp"]), image,
+            self.log.preview_width, self.log.preview_height,
+        )
+        message = _to_tracklets_message(frame, records)
+        message.setTimestamp(timedelta(seconds=time.monotonic()))  # Host arrival time, as the device would set it
+        return message
+
+
+def benchmark(path):
+    """Replays a log through VehicleTracker as fast as possible and prints the throughput."""
+    import vehicles_tracker
+
+    tracker = vehicles_tracker.VehicleTracker()
+    device = ReplayDevice(path, speed=0)
+    q_nn = device.getOutputQueue("detections")
+    messages = 0
+    tracklets = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            in_nn = q_nn.get()
+            tracker.calculate_tracklet_movement(in_nn.tracklets)
+            messages += 1
+            tracklets += len(in_nn.tracklets)
+    except ReplayFinished:
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"{messages} messages, {tracklets} tracklets in {elapsed:.3f} s "
+          f"({messages / elapsed if elapsed else 0:.1f} msg/s)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python tracklet_log.py <tracklet log>")
+        sys.exit(1)
+    benchmark(sys.argv[1])
@@ -0,0 +1,169 @@
+import threading
+import logging
+
+import numpy as np
+
+import vehicles_tracker
+from detection_writer import INSERT_DETECTION_SQL
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+trajectory_logger = logging.getLogger("camera_service.trajectory_store")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+INSERT_TRAJECTORY_SQL = (
+    "INSERT INTO trajectories (vehicle_id, label, first_timestamp, last_timestamp, entry_x, entry_y, "
+    "exit_x, exit_y, direction, samples, polyline, end_reason, camera_id, mean_speed) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+STORAGE_MODES = ("points", "trajectories", "both")
+
+
+class TrajectorySummarizer:
+    """
+    Summarizes each vehicle track into a single compact record.
+
+    observe() is fed every frame with the TrackletBatch already updated by
+    VehicleTracker, and keeps per track the first/last timestamps, the entry
+    point, the direction counts, the labels, the speeds estimated by the
+    tracker and a dead-band compressed polyline
+    (a vertex is only kept when it is more than `deadband` pixels away from
+    the previous one). When the tracker ends a track (REMOVED or lost) the
+    record goes to the `trajectories` table through the detection writer.
+
+    Storage modes:
+        points: one detections row per vehicle and frame, thinned so a row is
+                only stored when the vehicle moved more than `min_point_movement`
+                pixels since its last stored row (0 keeps every row).
+        trajectories: no per-frame rows; one trajectories row per track plus one
+                summary row in detections (exit point, dominant direction), so
+                the uploader and the dashboard keep working.
+        both: thinned point rows and trajectories.
+    """
+
+    def __init__(self, writer, tracker, mode="points", min_point_movement=0, deadband=8, camera_id=None):
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {mode}, expected one of {STORAGE_MODES}")
+        self.writer = writer
+        self.mode = mode
+        self.min_point_movement = min_point_movement
+        self.deadband = deadband
+        self.camera_id = camera_id
+        self.tracks = {}  # tracklet_id -> state of the open trajectory
+        self.last_stored = {}  # tracklet_id -> last point stored in detections
+        self.emitted = 0
+        tracker.add_track_end_callback(self.end_track)
+
+    @property
+    def store_points(self):
+        return self.mode in ("points", "both")
+
+    @property
+    def store_trajectories(self):
+        return self.mode in ("trajectories", "both")
+
+    def should_store_point(self, tracklet_id, x_pos, y_pos):
+        """True if a point sample has to be stored (the vehicle moved enough since the last one)."""
+        if not self.store_points:
+            return False
+        last = self.last_stored.get(tracklet_id)
+        if last is not None and self.min_point_movement > 0:
+            if abs(x_pos - last[0]) + abs(y_pos - last[1]) <= self.min_point_movement:
+                return False
+        self.last_stored[tracklet_id] = (x_pos, y_pos)
+        return True
+
+    def observe(self, batch, rows, timestamp):
+        """Adds the selected rows of a frame (already updated by the tracker, timestamp in epoch ms) to their trajectories."""
+        if not self.store_trajectories:
+            return
+        active = rows[batch.has_history[rows]]
+        for tracklet_id, label, (x, y), direction, speed, heading in zip(
+            batch.ids[active].tolist(),
+            batch.labels[active].tolist(),
+            batch.pixel_centroids[active].tolist(),
+            batch.direction[active].tolist(),
+            batch.speed[active].tolist(),
+            batch.heading[active].tolist(),
+        ):
+            track = self.tracks.get(tracklet_id)
+            if track is None:
+                track = self.tracks[tracklet_id] = {
+                    "first_timestamp": timestamp,
+                    "polyline": [(x, y)],
+                    "labels": {},
+                    "directions": {vehicles_tracker.ASCENDING: 0, vehicles_tracker.DESCENDING: 0},
+                    "samples": 0,
+                    "speed_sum": 0.0,
+                }
+            track["last_timestamp"] = timestamp
+            track["last_point"] = (x, y)
+            track["samples"] += 1
+            track["speed_sum"] += speed
+            track["heading"] = heading
+            track["labels"][label] = track["labels"].get(label, 0) + 1
+            if direction in track["directions"]:
+                track["directions"][direction] += 1
+            last_x, last_y = track["polyline"][-1]
+            if abs(x - last_x) + abs(y - last_y) > self.deadband:
+                track["polyline"].append((x, y))
+
+    def end_track(self, tracklet_id, reason):
+        """Tracker callback: emits the record of a finished track."""
+        self.last_stored.pop(tracklet_id, None)
+        track = self.tracks.pop(tracklet_id, None)
+        if track is None:
+            return
+        polyline = track["polyline"]
+        if polyline[-1] != track["last_point"]:
+            polyline.append(track["last_point"])
+
+        ascending = track["directions"][vehicles_tracker.ASCENDING]
+        descending = track["directions"][vehicles_tracker.DESCENDING]
+        if ascending == descending == 0:
+            direction = "unknown"
+        else:
+            direction = "ascending" if ascending > descending else "descending"
+        label = max(track["labels"], key=track["labels"].get)
+        entry_x, entry_y = polyline[0]
+        exit_x, exit_y = polyline[-1]
+        mean_speed = round(track["speed_sum"] / track["samples"], 2)
+
+        self.writer.put(
+            (
+                str(tracklet_id), label, track["first_timestamp"], track["last_timestamp"],
+                entry_x, entry_y, exit_x, exit_y, direction, track["samples"],
+                np.array(polyline, dtype=np.int16).tobytes(),  # x0, y0, x1, y1, ... in pixels
+                reason, self.camera_id, mean_speed,
+            ),
+            statement=INSERT_TRAJECTORY_SQL,
+        )
+        if self.mode == "trajectories":
+            # One summary row per vehicle in detections (exit point, dominant direction, mean speed, last heading)
+            self.writer.put(
+                (
+                    track["last_timestamp"], tracklet_id, exit_x, exit_y, direction, None, self.camera_id,
+                    mean_speed, round(track["heading"], 1),
+                ),
+                statement=INSERT_DETECTION_SQL,
+            )
+        self.emitted += 1
+
+    def close(self):
+        """Emits the records of the tracks still open (on shutdown)."""
+        if not self.tracks:
+            return
+        for tracklet_id in list(self.tracks):
+            self.end_track(tracklet_id, "shutdown")
+        with log_lock:
+            trajectory_logger.info(f"✅ Trajectory summarizer closed, {self.emitted} trajectories stored")
+
+    def stats(self):
+        return {"mode": self.mode, "open_tracks": len(self.tracks), "emitted": self.emitted}
+
+
+def decode_polyline(blob):
+    """Returns the polyline of a trajectories row as an (n, 2) array of pixel coordinates."""
+    return np.frombuffer(blob, dtype=np.int16).reshape(-1, 2)
@@ -1,5 +1,6 @@
+import time
 import depthai as dai
-from typing import List, Dict, Deque
+from typing import List, Dict, Deque, Callable, Mapping
 from collections import deque
 import numpy as np
 from config_loader import load_config #Import the function
@@ -10,86 +11,522 @@ config = load_config()
 THRESH_DIST_DELTA = config["vehicle_tracker"]["threshold_dist_delta"]  # Umbral mínimo para considerar movimiento
 MAX_HISTORY = config["vehicle_tracker"]["max_history"] # Número de posiciones almacenadas por vehículo
 MAX_HISTORY_POSITIONS = config["vehicle_tracker"]["max_history_positions"] # Número de posiciones almacenadas por vehículo
+DIRECTION_METHOD = config["vehicle_tracker"]["direction_method"]  # slope o endpoints
+TRACK_TTL_FRAMES = config["vehicle_tracker"]["track_ttl_frames"]  # Frames sin ver un track antes de descartarlo
+TRACK_TTL_SECONDS = config["vehicle_tracker"]["track_ttl_seconds"]  # Segundos sin ver un track antes de descartarlo
+MAX_TRACKS = config["vehicle_tracker"]["max_tracks"]  # Tracks vivos como máximo (se descarta el menos reciente)
+INITIAL_CAPACITY = 64  # Slots de tracks preasignados (se doblan si hacen falta más, hasta MAX_TRACKS)
+HOMOGRAPHY = config["velocity"]["homography"]  # Matriz 3x3 de píxeles de preview al suelo (vacía: velocidades en píxeles)
+PROCESS_NOISE = config["velocity"]["process_noise"]  # Ruido de aceleración del filtro con homografía (unidades del suelo/s²)
+MEASUREMENT_NOISE = config["velocity"]["measurement_noise"]  # Ruido de posición de los centroides con homografía (unidades del suelo)
+INITIAL_VELOCITY_STD = config["velocity"]["initial_velocity_std"]  # Incertidumbre de la velocidad de un track nuevo (unidades del suelo/s)
+PIXEL_PROCESS_NOISE = config["velocity"]["pixel_process_noise"]  # Lo mismo sin homografía (píxeles/s²)
+PIXEL_MEASUREMENT_NOISE = config["velocity"]["pixel_measurement_noise"]  # Lo mismo sin homografía (píxeles)
+PIXEL_INITIAL_VELOCITY_STD = config["velocity"]["pixel_initial_velocity_std"]  # Lo mismo sin homografía (píxeles/s)
+SPEED_FACTOR = config["velocity"]["speed_factor"]  # Con homografía, unidades/s -> velocidad guardada (3.6: m/s -> km/h)
+
+
+# Arrays por slot que se guardan en los snapshots del tracker (ver tracker_snapshot)
+SNAPSHOT_FIELDS = (
+    "samples", "positions", "directions", "ascending_count", "descending_count", "sum_y", "sum_ty", "kf_state",
+)
+
+# Códigos de dirección usados en los arrays (y sus nombres en el historial)
+ASCENDING = 1
+DESCENDING = -1
+UNDEFINED = 0
+DIRECTION_NAMES = {ASCENDING: "ascending", DESCENDING: "descending", UNDEFINED: "undefined"}
+
+STATUS_NEW = int(dai.Tracklet.TrackingStatus.NEW)
+STATUS_TRACKED = int(dai.Tracklet.TrackingStatus.TRACKED)
+STATUS_LOST = int(dai.Tracklet.TrackingStatus.LOST)
+STATUS_REMOVED = int(dai.Tracklet.TrackingStatus.REMOVED)
+
+
+class TrackletBatch:
+    """
+    Los tracklets de un frame convertidos a arrays de NumPy en una sola pasada.
+
+    Todo lo demás (centroides, cajas en píxeles, filtro de clases) se calcula
+    con operaciones sobre arrays, de modo que el coste por frame no crece con
+    llamadas a objetos de depthai. VehicleTracker.update_batch rellena además
+    `direction` (último código de dirección), `ascending_count`, `speed` y
+    `heading` por fila.
+    """
+
+    def __init__(self, tracklets, width=1, height=1, labels=None):
+        raw = []
+        for t in tracklets:
+            roi = t.roi
+            top_left = roi.topLeft()
+            bottom_right = roi.bottomRight()
+            raw.append((t.id, t.label, int(t.status), top_left.x, top_left.y,
+                        bottom_right.x, bottom_right.y, t.srcImgDetection.confidence))
+        raw = np.array(raw, dtype=np.float64).reshape(len(raw), 8)
+        n = len(raw)
+
+        self.ids = raw[:, 0].astype(np.int64)
+        self.labels = raw[:, 1].astype(np.int32)
+        self.status = raw[:, 2].astype(np.int8)
+        self.boxes = raw[:, 3:7]  # Normalizadas (x1, y1, x2, y2)
+        self.confidence = raw[:, 7]
+        self.centroids = (self.boxes[:, 0:2] + self.boxes[:, 2:4]) / 2  # Normalizados, los usa el tracker
+
+        # Cajas y centros en píxeles de la imagen de preview. Igual que roi.denormalize:
+        # redondea la esquina y el tamaño por separado, en float32
+        boxes32 = self.boxes.astype(np.float32)
+        size = np.array([width, height], dtype=np.float32)
+        self.frame_size = size.astype(np.float64)
+        top_left = np.rint(boxes32[:, 0:2] * size)
+        box_size = np.rint((boxes32[:, 2:4] - boxes32[:, 0:2]) * size)
+        self.pixel_boxes = np.hstack([top_left, top_left + box_size]).astype(np.int32)
+        self.pixel_centroids = (self.pixel_boxes[:, 0:2] + self.pixel_boxes[:, 2:4]) // 2
+
+        # Solo las clases configuradas (p. ej. number_of_detection_classes)
+        if labels is None:
+            self.selected = np.ones(n, dtype=bool)
+        else:
+            self.selected = np.isin(self.labels, labels)
+
+        self.direction = np.full(n, UNDEFINED, dtype=np.int8)
+        self.has_history = np.zeros(n, dtype=bool)
+        self.ascending_count = np.zeros(n, dtype=np.int16)
+        self.speed = np.zeros(n, dtype=np.float64)  # Velocidad estimada (píxeles/s, o unidades/s · SPEED_FACTOR)
+        self.heading = np.zeros(n, dtype=np.float64)  # Rumbo en grados, 0 = +x y 90 = +y del plano de la homografía
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class DirectionHistoryView(Mapping):
+    """
+    Vista de solo lectura {tracklet_id: historial} sobre el estado del tracker.
+
+    Mantiene el contrato de calculate_tracklet_movement (un deque con los
+    nombres de las últimas direcciones por id) sin guardar deques: cada
+    historial se construye al pedirlo a partir del buffer circular.
+    """
+
+    def __init__(self, tracker: "VehicleTracker", ids: List[int]) -> None:
+        self._tracker = tracker
+        self._ids = ids
+        self._id_set = set(ids)
+
+    def __getitem__(self, tracklet_id: int) -> Deque:
+        if tracklet_id not in self._id_set:
+            raise KeyError(tracklet_id)
+        return self._tracker.direction_history(tracklet_id)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
 
 
 class VehicleTracker:
-    def __init__(self) -> None:
-        self.data: Dict[str, Dict] = {}  # Almacena los vehículos detectados
+    """
+    Estado de los tracks en arrays de NumPy preasignados.
+
+    Cada track ocupa un slot (fila) de los arrays; `slots` traduce el id del
+    tracklet a su slot y los slots libres se reutilizan desde `free_slots`.
+    Las posiciones y las direcciones son buffers circulares por slot: la
+    muestra n se escribe en la columna n % tamaño, así que basta con contar
+    las muestras (`samples`) y añadir una no crea objetos.
+    Si no quedan slots libres los arrays doblan su tamaño.
+
+    Las estadísticas de cada track se actualizan en O(1) al añadir una
+    muestra y al descartar la más antigua del buffer: cuántas direcciones
+    ascending/descending hay en el historial, y las sumas de y y de t·y
+    (t = número de muestra) con las que se obtiene la pendiente por mínimos
+    cuadrados de y frente a t en la ventana de posiciones guardadas. Con
+    direction_method "slope" la dirección sale de esa pendiente, menos
+    sensible al ruido que comparar la primera y la última posición
+    ("endpoints", el método anterior).
+
+    Un track termina cuando el dispositivo lo marca REMOVED o lleva más de
+    10 frames LOST, y además se descarta si deja de aparecer durante
+    ttl_frames frames o ttl_seconds segundos (p. ej. tras reiniciar el
+    pipeline o un salto de ids), si vuelve a llegar como NEW ("replaced") o,
+    con max_tracks tracks vivos, si es el que lleva más tiempo sin verse
+    cuando llega uno nuevo ("lru"). En todos los casos se llama a los
+    track_end_callbacks con el motivo, y `ended` cuenta los tracks por motivo.
+
+    La velocidad de todos los tracks activos se estima a la vez con un filtro
+    de Kalman de velocidad constante sobre arrays apilados: por slot se
+    guardan en `kf_state` la posición y la velocidad filtradas en cada eje y
+    la covarianza de cada eje (los ejes x e y son independientes en este
+    modelo, así que bastan 3 valores por eje en lugar de una matriz 4x4), y
+    se leen y escriben con una sola indexación por frame. El paso de tiempo
+    sale de los timestamps del dispositivo de cada frame. Con una homografía
+    (píxeles de preview -> plano del suelo, p. ej. en metros) el filtro
+    trabaja en coordenadas del suelo; sin ella, en píxeles, con sus propios
+    ruidos (pixel_* en la configuración).
+
+    Tras reiniciar el pipeline los ids del dispositivo empiezan de nuevo.
+    restore_tracks() recibe los tracks de un snapshot (ver tracker_snapshot)
+    y, durante los primeros frames, cada tracklet NEW hereda el historial
+    del track restaurado más cercano a su posición, así que la dirección,
+    el sentido contrario y la velocidad no vuelven a empezar de cero.
+    """
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY, max_tracks: int = MAX_TRACKS,
+                 ttl_frames: int = TRACK_TTL_FRAMES, ttl_seconds: float = TRACK_TTL_SECONDS,
+                 homography=HOMOGRAPHY) -> None:
         self.counter = {'ascending': 0, 'descending': 0}  # Contador de movimientos
-        
+        self.track_end_callbacks: List[Callable] = []  # Se llaman con (id, motivo) al terminar un track
+        self.max_tracks = max_tracks
+        self.ttl_frames = ttl_frames  # 0 desactiva la caducidad por frames
+        self.ttl_seconds = ttl_seconds  # 0 desactiva la caducidad por tiempo
+        self.homography = None if homography is None else np.array(homography, dtype=np.float64).reshape(3, 3)
+        self.speed_factor = 1.0 if homography is None else SPEED_FACTOR  # Sin homografía la velocidad va en píxeles/s
+        # Ruidos del filtro en las unidades en que trabaja (suelo o píxeles)
+        if homography is None:
+            self.process_noise = PIXEL_PROCESS_NOISE
+            self.measurement_noise = PIXEL_MEASUREMENT_NOISE
+            self.initial_velocity_std = PIXEL_INITIAL_VELOCITY_STD
+        else:
+            self.process_noise = PROCESS_NOISE
+            self.measurement_noise = MEASUREMENT_NOISE
+            self.initial_velocity_std = INITIAL_VELOCITY_STD
+        self.frame = 0  # Frames procesados
+        self.ended: Dict[str, int] = {}  # Tracks terminados por motivo
+        self.restored = 0  # Tracks que han heredado el historial de un snapshot
+        self.pending_restore = None  # Tracks de un snapshot esperando a su tracklet NEW
+        self.slots: Dict[int, int] = {}  # tracklet_id -> slot
+        capacity = min(capacity, max_tracks)
+        self._allocate(capacity)
+        self.free_slots: List[int] = list(range(capacity - 1, -1, -1))  # Pila, el slot 0 sale primero
+
+    def _allocate(self, capacity: int) -> None:
+        """Crea (o amplía conservando el contenido) los arrays para `capacity` tracks."""
+        old = getattr(self, "capacity", 0)
+        arrays = {
+            "slot_ids": np.full(capacity, -1, dtype=np.int64),
+            "samples": np.zeros(capacity, dtype=np.int64),  # Muestras añadidas desde que empezó el track
+            "positions": np.zeros((capacity, MAX_HISTORY, 2), dtype=np.float64),  # Centroides normalizados
+            "directions": np.zeros((capacity, MAX_HISTORY_POSITIONS), dtype=np.int8),  # Códigos de dirección
+            "ascending_count": np.zeros(capacity, dtype=np.int16),  # Direcciones ascending en el historial
+            "descending_count": np.zeros(capacity, dtype=np.int16),
+            "sum_y": np.zeros(capacity, dtype=np.float64),  # Suma de y en la ventana de posiciones
+            "sum_ty": np.zeros(capacity, dtype=np.float64),  # Suma de t·y en la ventana de posiciones
+            "lost_count": np.zeros(capacity, dtype=np.int32),
+            "last_seen_frame": np.zeros(capacity, dtype=np.int64),  # Último frame en que apareció
+            "last_seen_time": np.zeros(capacity, dtype=np.float64),  # time.monotonic() de ese frame
+            # Filtro de velocidad por eje (x, y): posición, velocidad (por segundo), var. posición, covarianza, var. velocidad
+            "kf_state": np.zeros((capacity, 2, 5), dtype=np.float64),
+            "kf_time": np.zeros(capacity, dtype=np.float64),  # Timestamp del dispositivo de la última corrección
+        }
+        for name, array in arrays.items():
+            if old:
+                array[:old] = getattr(self, name)
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def _new_slot(self, tracklet_id: int, now: float) -> int:
+        """Asigna el slot de un track nuevo, descartando el anterior con el mismo id o el menos reciente si no caben más."""
+        if tracklet_id in self.slots:
+            self._end_track(tracklet_id, "replaced")
+        if len(self.slots) >= self.max_tracks:
+            live_frames = np.where(self.slot_ids >= 0, self.last_seen_frame, np.iinfo(np.int64).max)
+            self._end_track(int(self.slot_ids[np.argmin(live_frames)]), "lru")
+        if not self.free_slots:
+            old = self.capacity
+            self._allocate(min(old * 2, self.max_tracks))
+            self.free_slots = list(range(self.capacity - 1, old - 1, -1))
+        slot = self.free_slots.pop()
+        self.slots[tracklet_id] = slot
+        self.slot_ids[slot] = tracklet_id
+        self.samples[slot] = 0
+        self.directions[slot] = UNDEFINED
+        self.ascending_count[slot] = self.descending_count[slot] = 0
+        self.sum_y[slot] = self.sum_ty[slot] = 0.0
+        self.lost_count[slot] = 0
+        self.last_seen_frame[slot] = self.frame
+        self.last_seen_time[slot] = now
+        return slot
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, tracklet_id: int) -> bool:
+        return tracklet_id in self.slots
+
+    def direction_history(self, tracklet_id: int) -> Deque:
+        """Historial de direcciones de un track, de la más antigua a la más reciente."""
+        slot = self.slots[tracklet_id]
+        samples = int(self.samples[slot])
+        index = np.arange(max(0, samples - MAX_HISTORY_POSITIONS), samples) % MAX_HISTORY_POSITIONS
+        return deque(
+            (DIRECTION_NAMES[code] for code in self.directions[slot, index].tolist()), maxlen=MAX_HISTORY_POSITIONS
+        )
+
+    def add_track_end_callback(self, callback: Callable) -> None:
+        """Registra una función que se llama con (tracklet_id, reason) cuando un track se elimina."""
+        self.track_end_callbacks.append(callback)
+
+    def _end_track(self, tracklet_id: int, reason: str) -> None:
+        """Elimina un track y avisa a los callbacks (p. ej. para cerrar su trayectoria)."""
+        slot = self.slots.pop(tracklet_id, None)
+        if slot is not None:
+            self.slot_ids[slot] = -1
+            self.free_slots.append(slot)
+            self.ended[reason] = self.ended.get(reason, 0) + 1
+            for callback in self.track_end_callbacks:
+                callback(tracklet_id, reason)
+
+    def evict_stale(self, now: float = None) -> int:
+        """Descarta los tracks que no aparecen desde hace más de ttl_frames frames o ttl_seconds segundos."""
+        if now is None:
+            now = time.monotonic()
+        stale = np.zeros(self.capacity, dtype=bool)
+        if self.ttl_frames:
+            stale |= self.frame - self.last_seen_frame > self.ttl_frames
+        if self.ttl_seconds:
+            stale |= now - self.last_seen_time > self.ttl_seconds
+        stale &= self.slot_ids >= 0
+        if not stale.any():
+            return 0
+        stale_ids = self.slot_ids[stale].tolist()
+        for tracklet_id in stale_ids:
+            self._end_track(tracklet_id, "ttl")
+        return len(stale_ids)
+
+    def export_tracks(self):
+        """Ids de los tracks vivos y sus arrays de SNAPSHOT_FIELDS (copias), para guardar un snapshot."""
+        live = np.flatnonzero(self.slot_ids >= 0)
+        return self.slot_ids[live], {name: getattr(self, name)[live] for name in SNAPSHOT_FIELDS}
+
+    def restore_tracks(self, fields: Dict, saved_at: float, max_distance: float, window_frames: int) -> int:
+        """
+        Prepara la recuperación de los tracks de un snapshot tras reiniciar el pipeline.
+
+        Los tracks vivos terminan con el motivo "restart" (sus ids ya no valen).
+        Durante los siguientes window_frames frames, cada tracklet NEW a menos
+        de max_distance (normalizada) de la última posición de un track del
+        snapshot hereda su estado. saved_at es el time.time() del snapshot.
+        """
+        for tracklet_id in list(self.slots):
+            self._end_track(tracklet_id, "restart")
+        samples = fields["samples"]
+        keep = samples > 0
+        fields = {name: values[keep] for name, values in fields.items()}
+        samples = fields["samples"]
+        if not len(samples):
+            self.pending_restore = None
+            return 0
+        self.pending_restore = {
+            "fields": fields,
+            "last_positions": fields["positions"][np.arange(len(samples)), (samples - 1) % MAX_HISTORY],
+            "used": np.zeros(len(samples), dtype=bool),
+            "saved_at": saved_at,
+            "max_distance": max_distance,
+            "until_frame": self.frame + window_frames,
+        }
+        return len(samples)
+
+    def _adopt_restored(self, batch: TrackletBatch, new_rows: np.ndarray, timestamp: float) -> None:
+        """Empareja los tracklets NEW con los tracks pendientes del snapshot, de la pareja más cercana a la más lejana."""
+        pending = self.pending_restore
+        if self.frame > pending["until_frame"] or pending["used"].all():
+            self.pending_restore = None
+            return
+        available = np.flatnonzero(~pending["used"])
+        if not len(new_rows):
+            return
+        distances = np.linalg.norm(
+            batch.centroids[new_rows, np.newaxis] - pending["last_positions"][np.newaxis, available], axis=2
+        )
+        # El filtro de velocidad predice desde el snapshot hasta este frame
+        gap = max(0.0, time.time() - pending["saved_at"])
+        adopted_rows = set()
+        for flat in np.argsort(distances, axis=None).tolist():
+            row, column = divmod(flat, len(available))
+            if distances[row, column] > pending["max_distance"]:
+                break
+            record = available[column]
+            if row in adopted_rows or pending["used"][record]:
+                continue
+            slot = self.slots.get(int(batch.ids[new_rows[row]]))
+            if slot is None:
+                continue
+            for name, values in pending["fields"].items():
+                getattr(self, name)[slot] = values[record]
+            self.kf_time[slot] = timestamp - gap
+            pending["used"][record] = True
+            adopted_rows.add(row)
+            self.restored += 1
+
+    def stats(self) -> Dict:
+        """Tracks vivos, capacidad de los arrays y tracks terminados por motivo ("ttl" son los que antes se perdían)."""
+        return {
+            "live": len(self.slots),
+            "capacity": self.capacity,
+            "max_tracks": self.max_tracks,
+            "frames": self.frame,
+            "ended": dict(self.ended),
+            "leaked": self.ended.get("ttl", 0),
+            "restored": self.restored,
+        }
 
     def _print(self, vehicle_id, direction):
         print(f"Vehicle {vehicle_id} is moving {direction.upper()}")
 
-    def _get_centroid(self, roi) -> tuple:
-        """Calcula el centro del bounding box del objeto detectado."""
-        x1, y1 = roi.topLeft().x, roi.topLeft().y
-        x2, y2 = roi.bottomRight().x, roi.bottomRight().y
-        return ((x1 + x2) / 2, (y1 + y2) / 2)  # Centro del objeto
+    def _calculate_directions(self, delta_y: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """Determina para todos los tracks a la vez si se mueven hacia arriba (ascending) o abajo (descending)."""
+        # delta_y: desplazamiento vertical a lo largo de las posiciones almacenadas
+        directions = np.where(delta_y < 0, ASCENDING, DESCENDING).astype(np.int8)
+        moving = (np.abs(delta_y) > THRESH_DIST_DELTA) & (lengths >= 2)  # Si no, no hay suficiente información
+        return np.where(moving, directions, UNDEFINED).astype(np.int8)
 
-    def _calculate_direction(self, positions: Deque) -> str:
-        """Determina si el vehículo se mueve hacia arriba (ascending) o abajo (descending)."""
-        if len(positions) < 2:
-            return "unknown"  # No hay suficiente información
+    def _slope_displacement(self, slots: np.ndarray, samples: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """Desplazamiento en y a lo largo de la ventana según la recta de mínimos cuadrados de y frente a t."""
+        # Los t de la ventana son enteros consecutivos, así que su media y su varianza tienen forma cerrada
+        n = lengths.astype(np.float64)
+        t_mean = samples - (n + 1) / 2  # Muestras samples - n ... samples - 1
+        s_tt = n * (n * n - 1) / 12
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = (self.sum_ty[slots] - t_mean * self.sum_y[slots]) / s_tt
+        return np.where(n >= 2, slope * (n - 1), 0.0)
 
-        # Calcular la pendiente usando los primeros y últimos puntos almacenados
-        y_start = positions[0][1]
-        y_end = positions[-1][1]
-        deltaY = y_end - y_start
+    def to_world(self, points: np.ndarray) -> np.ndarray:
+        """Aplica la homografía a puntos (n, 2) en píxeles de preview (sin homografía los devuelve tal cual)."""
+        if self.homography is None:
+            return points
+        projected = points @ self.homography[:, :2].T + self.homography[:, 2]
+        return projected[:, :2] / projected[:, 2:3]
 
-        if abs(deltaY) > THRESH_DIST_DELTA:
-            return "ascending" if deltaY < 0 else "descending"
-        return "unknown"
+    def _update_velocity(self, slots: np.ndarray, samples: np.ndarray, points: np.ndarray, timestamp: float) -> None:
+        """Predicción y corrección del filtro de velocidad constante para todos los tracks activos a la vez."""
+        measured = self.to_world(points)
+        state = self.kf_state[slots]  # (n, 2, 5), un filtro por eje
+        position, velocity, p_xx, p_xv, p_vv = (state[:, :, i] for i in range(5))  # Vistas (n, 2) sobre state
 
-    def calculate_tracklet_movement(self, tracklets: dai.Tracklets) -> Dict[str, str]:
-        movement_directions = {}
+        # Predicción: x += v·dt, con ruido de aceleración blanca
+        dt = np.maximum(timestamp - self.kf_time[slots], 0.0)[:, np.newaxis]
+        dt2 = dt * dt
+        q = self.process_noise * self.process_noise
+        position += velocity * dt
+        p_xx += dt * (2 * p_xv + dt * p_vv) + q * dt2 * dt2 / 4
+        p_xv += dt * p_vv + q * dt2 * dt / 2
+        p_vv += q * dt2
 
-        for t in tracklets:
-            tracklet_id = str(t.id)
-
-            # Si es un nuevo tracklet, inicializar su historial de posiciones
-            if t.status == dai.Tracklet.TrackingStatus.NEW:
-                self.data[tracklet_id] = {
-                    "positions": deque(maxlen=MAX_HISTORY),  # Últimas X posiciones
-                    "lostCnt": 0,
-                    "historial": deque(maxlen=MAX_HISTORY_POSITIONS)
-                }
-            
-            # Obtener la nueva posición
-            new_position = self._get_centroid(t.roi)
-
-            if t.status in [dai.Tracklet.TrackingStatus.NEW, dai.Tracklet.TrackingStatus.TRACKED]:
-                try:
-                    self.data[tracklet_id]["positions"].append(new_position)
-                    self.data[tracklet_id]["lostCnt"] = 0  # Reiniciar el contador de pérdida
-
-                    # Calcular la dirección si hay suficientes datos
-                    direction = self._calculate_direction(self.data[tracklet_id]["positions"])
-                    if direction in ["ascending", "descending"]:
-                        #self._print(tracklet_id, direction)
-                        self.data[tracklet_id]["historial"].append(direction)
-                        movement_directions[int(tracklet_id)] = self.data[tracklet_id]["historial"]
-                    else: 
-                        self.data[tracklet_id]["historial"].append('undefined')
-                        movement_directions[int(tracklet_id)] = self.data[tracklet_id]["historial"]
-                except KeyError:
-                    print('KeyError')
-                    pass
-
-            elif t.status == dai.Tracklet.TrackingStatus.LOST:
-                try:
-                    self.data[tracklet_id]["lostCnt"] += 1
-                    # Si el objeto se ha perdido por más de 10 frames, eliminarlo
-                    if self.data[tracklet_id]["lostCnt"] > 10:
-                        if tracklet_id in self.data:
-                            del self.data[tracklet_id]
-                except KeyError:
-                    pass
-
-                
-
-            elif t.status == dai.Tracklet.TrackingStatus.REMOVED:
-                if tracklet_id in self.data:
-                    del self.data[tracklet_id]
-
-        return movement_directions  # Devuelve un diccionario con el ID y la dirección detectada
+        # Corrección con la posición medida
+        innovation_variance = p_xx + self.measurement_noise * self.measurement_noise
+        gain_x = p_xx / innovation_variance
+        gain_v = p_xv / innovation_variance
+        innovation = measured - position
+        position += gain_x * innovation
+        velocity += gain_v * innovation
+        p_vv -= gain_v * p_xv
+        p_xv *= 1 - gain_x
+        p_xx *= 1 - gain_x
+
+        # Los tracks nuevos empiezan parados en la posición medida, con mucha incertidumbre en la velocidad
+        new = samples == 1
+        if new.any():
+            state[new, :, 0] = measured[new]
+            state[new, :, 1] = 0.0
+            state[new, :, 2] = self.measurement_noise * self.measurement_noise
+            state[new, :, 3] = 0.0
+            state[new, :, 4] = self.initial_velocity_std * self.initial_velocity_std
+        self.kf_state[slots] = state
+        self.kf_time[slots] = timestamp
+
+    def velocity(self, tracklet_id: int) -> tuple:
+        """(velocidad, rumbo en grados) estimados de un track, como en TrackletBatch.speed/heading."""
+        vx, vy = self.kf_state[self.slots[tracklet_id], :, 1].tolist()
+        return float(np.hypot(vx, vy) * self.speed_factor), float(np.degrees(np.arctan2(vy, vx)) % 360)
+
+    def calculate_tracklet_movement(self, tracklets: dai.Tracklets) -> Mapping:
+        return self.update_batch(TrackletBatch(tracklets))
+
+    def update_batch(self, batch: TrackletBatch, timestamp: float = None) -> Mapping:
+        """
+        Actualiza el estado con los tracklets de un frame ya convertidos a arrays.
+        `timestamp` es el timestamp del dispositivo del frame en segundos
+        (in_nn.getTimestampDevice()); sin él se usa time.monotonic().
+        """
+        status = batch.status
+        self.frame += 1
+        now = time.monotonic()
+        if timestamp is None:
+            timestamp = now
+
+        # Si es un nuevo tracklet, inicializar su historial de posiciones
+        new_rows = np.flatnonzero(status == STATUS_NEW)
+        for tracklet_id in batch.ids[new_rows].tolist():
+            self._new_slot(tracklet_id, now)
+        # Tras reiniciar el pipeline, los tracklets nuevos pueden heredar un track del snapshot
+        if self.pending_restore is not None:
+            self._adopt_restored(batch, new_rows, timestamp)
+
+        # Añadir la nueva posición de los tracklets activos (los que no hemos visto como NEW se ignoran)
+        rows = np.flatnonzero((status == STATUS_NEW) | (status == STATUS_TRACKED))
+        row_ids = batch.ids[rows].tolist()
+        slots = np.fromiter((self.slots.get(tracklet_id, -1) for tracklet_id in row_ids), dtype=np.int64, count=len(rows))
+        known = slots >= 0
+        if not known.all():
+            rows, slots = rows[known], slots[known]
+            row_ids = batch.ids[rows].tolist()
+
+        centroids = batch.centroids[rows]
+        y = centroids[:, 1]
+        samples = self.samples[slots]
+        position_index = samples % MAX_HISTORY
+        # La muestra que se sobrescribe sale de la ventana: restarla de las sumas
+        evicted_y = np.where(samples >= MAX_HISTORY, self.positions[slots, position_index, 1], 0.0)
+        self.sum_y[slots] += y - evicted_y
+        self.sum_ty[slots] += samples * y - (samples - MAX_HISTORY) * evicted_y
+        self.positions[slots, position_index] = centroids
+        direction_index = samples % MAX_HISTORY_POSITIONS
+        samples += 1
+        self.samples[slots] = samples
+        self.lost_count[slots] = 0  # Reiniciar el contador de pérdida
+        self.last_seen_frame[slots] = self.frame
+        self.last_seen_time[slots] = now
+
+        # Calcular la dirección de todos los tracks activos a la vez
+        lengths = np.minimum(samples, MAX_HISTORY)
+        if DIRECTION_METHOD == "endpoints":
+            y_start = self.positions[slots, (samples - lengths) % MAX_HISTORY, 1]  # Posición más antigua guardada
+            delta_y = y - y_start
+        else:
+            delta_y = self._slope_displacement(slots, samples, lengths)
+        directions = self._calculate_directions(delta_y, lengths)
+
+        # Contadores de direcciones del historial: sumar la nueva y restar la que se descarta
+        # (las entradas sin usar del buffer valen UNDEFINED y no cuentan)
+        evicted = self.directions[slots, direction_index]
+        self.ascending_count[slots] += (directions == ASCENDING).astype(np.int16) - (evicted == ASCENDING)
+        self.descending_count[slots] += (directions == DESCENDING).astype(np.int16) - (evicted == DESCENDING)
+        self.directions[slots, direction_index] = directions
+        batch.direction[rows] = directions
+        batch.has_history[rows] = True
+        batch.ascending_count[rows] = self.ascending_count[slots]
+
+        # Velocidad y rumbo de todos los tracks activos con el filtro de velocidad constante
+        self._update_velocity(slots, samples, centroids * batch.frame_size, timestamp)
+        velocity = self.kf_state[slots, :, 1]
+        batch.speed[rows] = np.hypot(velocity[:, 0], velocity[:, 1]) * self.speed_factor
+        batch.heading[rows] = np.degrees(np.arctan2(velocity[:, 1], velocity[:, 0])) % 360
+
+        # Si el objeto se ha perdido por más de 10 frames, eliminarlo
+        if len(rows) < len(status):  # Hay tracklets LOST o REMOVED en este frame
+            for tracklet_id in batch.ids[status == STATUS_LOST].tolist():
+                slot = self.slots.get(tracklet_id)
+                if slot is not None:
+                    self.last_seen_frame[slot] = self.frame  # Sigue llegando del dispositivo
+                    self.last_seen_time[slot] = now
+                    self.lost_count[slot] += 1
+                    if self.lost_count[slot] > 10:
+                        self._end_track(tracklet_id, "lost")
+
+            for tracklet_id in batch.ids[status == STATUS_REMOVED].tolist():
+                self._end_track(tracklet_id, "removed")
+
+        # Tracks que dejaron de llegar sin REMOVED (reinicio del pipeline, saltos de id)
+        self.evict_stale(now)
+
+        # Devuelve {id: historial de direcciones} de los tracks activos, sin copiar nada hasta que se consulta
+        return DirectionHistoryView(self, row_ids)
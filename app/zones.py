@@ -0,0 +1,209 @@
+"""
+Zones (polygons) and counting lines for the camera preview.
+
+Zones and lines are configured in config.yaml with normalized coordinates
+(0..1 of the preview image). At startup ZoneMap compiles the zones into a
+label raster at preview resolution (0 = outside every zone, i = zone i), so
+finding the zone of any number of centroids is one array lookup. Counting
+lines are kept as pixel segments and checked against the step each track
+made since the previous frame.
+
+ZoneCounter keeps per-zone and per-line counters by direction in memory and
+writes them to the zone_counts table every flush_interval seconds, one row
+per (zone or line, direction) and period.
+"""
+import threading
+import time
+import logging
+import cv2
+import numpy as np
+
+import vehicles_tracker
+from migrations import epoch_ms, format_epoch_ms
+
+# Child of the camera_service logger, so messages end up in camera_service.log
+zones_logger = logging.getLogger("camera_service.zones")
+
+# Create a lock for logging
+log_lock = threading.Lock()
+
+INSERT_ZONE_COUNT_SQL = (
+    "INSERT INTO zone_counts (period_start, period_end, camera_id, kind, name, direction, count) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+ZONE_TYPES = ("lane", "no_entry")
+NO_ZONE = 0
+
+
+class ZoneMap:
+    """Zones compiled to a label raster, plus the counting lines in pixels."""
+
+    def __init__(self, zones, lines, width, height):
+        if len(zones) > 255:
+            raise ValueError(f"At most 255 zones are supported, got {len(zones)}")
+        self.width = width
+        self.height = height
+        self.zone_names = [None]  # Index 0: outside every zone
+        self.zone_types = [None]
+        self.raster = np.zeros((height, width), dtype=np.uint8)
+        scale = np.array([width, height], dtype=np.float64)
+        self.polygons = []
+        for index, zone in enumerate(zones, start=1):
+            zone_type = zone.get("type", "lane")
+            if zone_type not in ZONE_TYPES:
+                raise ValueError(f"Unknown type {zone_type} for zone {zone['name']}, expected one of {ZONE_TYPES}")
+            polygon = np.rint(np.array(zone["polygon"], dtype=np.float64) * scale).astype(np.int32)
+            cv2.fillPoly(self.raster, [polygon], index)  # Overlapping zones: the last one wins
+            self.polygons.append(polygon)
+            self.zone_names.append(str(zone["name"]))
+            self.zone_types.append(zone_type)
+
+        self.line_names = [str(line["name"]) for line in lines]
+        # (m, 4) segments x1, y1, x2, y2 in pixels
+        self.lines = np.array(
+            [np.array(line["points"], dtype=np.float64).reshape(4) * np.tile(scale, 2) for line in lines],
+            dtype=np.float64,
+        ).reshape(len(lines), 4)
+
+    def __bool__(self):
+        return len(self.zone_names) > 1 or len(self.line_names) > 0
+
+    def lookup(self, points):
+        """Zone index of each (x, y) pixel point, NO_ZONE outside every zone."""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        x = np.clip(points[:, 0], 0, self.width - 1)
+        y = np.clip(points[:, 1], 0, self.height - 1)
+        return self.raster[y, x]
+
+    def crossings(self, start, end):
+        """
+        Checks the steps start -> end ((n, 2) pixel arrays) against every line.
+
+        Returns an (n, m) int8 array: 0 if step i does not cross line j, +1 if it
+        crosses from the right to the left of the line (seen from its first point
+        to its second one) and -1 the other way. For a line drawn left to right,
+        +1 is a vehicle moving up the image (ascending).
+        """
+        start = np.asarray(start, dtype=np.float64).reshape(-1, 1, 2)
+        end = np.asarray(end, dtype=np.float64).reshape(-1, 1, 2)
+        a = self.lines[np.newaxis, :, 0:2]
+        b = self.lines[np.newaxis, :, 2:4]
+
+        def cross(o, p, q):
+            return (p[..., 0] - o[..., 0]) * (q[..., 1] - o[..., 1]) - (p[..., 1] - o[..., 1]) * (q[..., 0] - o[..., 0])
+
+        side_start = cross(a, b, start) > 0
+        side_end = cross(a, b, end) > 0
+        within = cross(start, end, a) * cross(start, end, b) <= 0  # The step passes between the line ends
+        crossed = (side_start != side_end) & within
+        return np.where(crossed, np.where(side_start, 1, -1), 0).astype(np.int8)
+
+    def draw(self, frame, color=(255, 200, 0)):
+        """Draws the zones and lines on a preview frame."""
+        for polygon in self.polygons:
+            cv2.polylines(frame, [polygon], True, color, 1)
+        for x1, y1, x2, y2 in np.rint(self.lines).astype(np.int32).tolist():
+            cv2.line(frame, (x1, y1), (x2, y2), color, 2)
+
+
+class ZoneCounter:
+    """
+    Per-track zone membership and line crossings, with counters by direction.
+
+    update() is called every frame after VehicleTracker.update_batch. A vehicle
+    is counted in a zone when it leaves it (or its track ends inside it), with
+    the direction the tracker gives at that moment; a line is counted when a
+    track's step since the previous frame crosses it, with the side it crossed
+    to (see ZoneMap.crossings). Entering a no_entry zone is returned to the
+    caller, which raises the alert.
+    """
+
+    def __init__(self, zone_map, writer, tracker, camera_id=None, flush_interval=60):
+        self.zone_map = zone_map
+        self.writer = writer
+        self.camera_id = camera_id
+        self.flush_interval = flush_interval
+        self.last_point = {}  # tracklet_id -> (x, y) in pixels
+        self.zone = {}  # tracklet_id -> zone index
+        self.direction = {}  # tracklet_id -> last direction code
+        self.counts = {}  # (kind, name, direction name) -> count in the current period
+        self.totals = {}  # Same, since start (for the metrics)
+        self.period_start = epoch_ms()
+        self._next_flush = time.monotonic() + flush_interval
+        tracker.add_track_end_callback(self.end_track)
+
+    def _count(self, kind, name, direction):
+        key = (kind, name, vehicles_tracker.DIRECTION_NAMES[direction])
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.totals[key] = self.totals.get(key, 0) + 1
+
+    def _leave_zone(self, tracklet_id):
+        zone = self.zone.get(tracklet_id, NO_ZONE)
+        if zone != NO_ZONE:
+            self._count("zone", self.zone_map.zone_names[zone], self.direction.get(tracklet_id, vehicles_tracker.UNDEFINED))
+
+    def update(self, batch, rows):
+        """
+        Updates zones and line counters with the selected rows of a frame.
+        Returns (tracklet_id, zone name, x, y) for every vehicle that just entered a no_entry zone.
+        """
+        active = rows[batch.has_history[rows]]
+        ids = batch.ids[active].tolist()
+        points = batch.pixel_centroids[active]
+        zones = self.zone_map.lookup(points).tolist()
+        directions = batch.direction[active].tolist()
+        previous = np.array([self.last_point.get(i, p) for i, p in zip(ids, points.tolist())], dtype=np.float64)
+
+        if len(self.zone_map.line_names) and len(ids):
+            crossed = self.zone_map.crossings(previous, points)
+            for row, line in zip(*np.nonzero(crossed)):
+                direction = vehicles_tracker.ASCENDING if crossed[row, line] > 0 else vehicles_tracker.DESCENDING
+                self._count("line", self.zone_map.line_names[line], direction)
+
+        entered_no_entry = []
+        for tracklet_id, (x, y), zone, direction in zip(ids, points.tolist(), zones, directions):
+            self.direction[tracklet_id] = direction
+            self.last_point[tracklet_id] = (x, y)
+            if zone != self.zone.get(tracklet_id, NO_ZONE):
+                self._leave_zone(tracklet_id)
+                self.zone[tracklet_id] = zone
+                if self.zone_map.zone_types[zone] == "no_entry":
+                    entered_no_entry.append((tracklet_id, self.zone_map.zone_names[zone], x, y))
+
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+        return entered_no_entry
+
+    def end_track(self, tracklet_id, reason):
+        """Tracker callback: counts the zone the track ended in and forgets it."""
+        self._leave_zone(tracklet_id)
+        self.zone.pop(tracklet_id, None)
+        self.last_point.pop(tracklet_id, None)
+        self.direction.pop(tracklet_id, None)
+
+    def flush(self):
+        """Writes the counters of the current period to zone_counts and starts a new period."""
+        now = epoch_ms()
+        for (kind, name, direction), count in self.counts.items():
+            self.writer.put(
+                (self.period_start, now, self.camera_id, kind, name, direction, count),
+                statement=INSERT_ZONE_COUNT_SQL,
+            )
+        if self.counts:
+            with log_lock:
+                zones_logger.debug(
+                    f"✅ Zone counts flushed for {format_epoch_ms(self.period_start)} - {format_epoch_ms(now)}: {self.counts}"
+                )
+        self.counts = {}
+        self.period_start = now
+        self._next_flush = time.monotonic() + self.flush_interval
+
+    def close(self):
+        """Counts the vehicles still inside a zone and flushes the last period."""
+        for tracklet_id in list(self.zone):
+            self.end_track(tracklet_id, "shutdown")
+        self.flush()
+
+    def stats(self):
+        return {f"{kind}:{name}:{direction}": count for (kind, name, direction), count in self.totals.items()}
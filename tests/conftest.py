@@ -0,0 +1,19 @@
+"""
+The modules of app/ read ../config/config.yaml, and their data and log
+paths, relative to the working directory. The tests run them from a
+temporary copy of that layout, so the repository's data/ and logs/ are
+never touched.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "app"))
+
+SANDBOX_DIR = tempfile.mkdtemp(prefix="camera_service_tests_")
+for name in ("app", "data", "logs"):
+    os.makedirs(os.path.join(SANDBOX_DIR, name))
+shutil.copytree(os.path.join(REPO_DIR, "config"), os.path.join(SANDBOX_DIR, "config"))
+os.chdir(os.path.join(SANDBOX_DIR, "app"))
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+import batch_codec
+
+# 2026-03-29 01:00:00 UTC, when Central European Time moves from +01:00 to +02:00
+DST_CHANGE_MS = 1774746000000
+
+
+@pytest.fixture
+def central_europe(monkeypatch):
+    """The uploader's local time zone (a POSIX rule, so no tz database is needed)."""
+    monkeypatch.setenv("TZ", "CET-1CEST,M3.5.0,M10.5.0/3")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def row(row_id, timestamp, vehicle_id="7", x=10.0, y=20.0, direction="ascending", camera_id="cam0", speed=50.0,
+        heading=90.0):
+    """Upload row in detection_archive.COLUMN_NAMES order."""
+    return (row_id, timestamp, vehicle_id, x, y, direction, camera_id, speed, heading)
+
+
+@pytest.mark.parametrize("encoding", batch_codec.ENCODINGS)
+def test_nulls_round_trip(central_europe, encoding):
+    rows = [
+        row(1, DST_CHANGE_MS - 3600000),
+        row(2, DST_CHANGE_MS - 3599000, vehicle_id=None, x=None, y=None, direction=None, camera_id=None,
+            speed=None, heading=None),
+    ]
+    assert batch_codec.decode_rows(batch_codec.encode_rows(rows, encoding), encoding) == [
+        ("2026-03-29 01:00:00", "7", 10.0, 20.0, "ascending", "cam0", 50.0, 90.0),
+        ("2026-03-29 01:00:01", None, None, None, None, None, None, None),
+    ]
+
+
+@pytest.mark.parametrize("encoding", batch_codec.ENCODINGS)
+def test_empty_batch(encoding):
+    body = batch_codec.encode_rows([], encoding)
+    header, columns = batch_codec.decode_columns(body, encoding)
+    assert header["rows"] == 0
+    assert all(len(values) == 0 for values in columns.values())
+    assert batch_codec.decode_rows(body, encoding) == []
+
+
+def test_more_vehicles_than_int16_codes():
+    vehicles = 2 ** 15 + 10
+    rows = [row(i + 1, DST_CHANGE_MS + i, vehicle_id=str(i)) for i in range(vehicles)]
+    body = batch_codec.encode_rows(rows, "gzip")
+    header, columns = batch_codec.decode_columns(body, "gzip")
+    dtypes = {name: dtype for name, kind, dtype, nbytes in header["columns"]}
+    assert dtypes["vehicle_id"] == "<i4"
+    assert dtypes["direction"] == "<i2"
+    assert columns["vehicle_id"].tolist() == [str(i) for i in range(vehicles)]
+    assert [r[1] for r in batch_codec.decode_rows(body, "gzip")] == [str(i) for i in range(vehicles)]
+
+
+def test_floats_are_rounded_to_three_decimals():
+    rows = [row(1, DST_CHANGE_MS, x=12.3456, y=-0.0004, speed=123.4567, heading=359.9999)]
+    decoded = batch_codec.decode_rows(batch_codec.encode_rows(rows, "gzip"), "gzip")[0]
+    assert decoded[2:4] == (12.346, -0.0)
+    assert decoded[6:] == (123.457, 360.0)
+
+
+def test_local_time_across_a_daylight_saving_change(central_europe):
+    """Every row is formatted with the offset in force at its own timestamp."""
+    rows = [row(1, DST_CHANGE_MS - 1000), row(2, DST_CHANGE_MS), row(3, DST_CHANGE_MS + 1000)]
+    body = batch_codec.encode_rows(rows, "gzip")
+    header, _ = batch_codec.decode_columns(body, "gzip")
+    assert header["utc_offsets"] == [[DST_CHANGE_MS - 60000, 3600000], [DST_CHANGE_MS, 7200000]]
+    assert [r[0] for r in batch_codec.decode_rows(body, "gzip")] == [
+        "2026-03-29 01:59:59", "2026-03-29 03:00:00", "2026-03-29 03:00:01",
+    ]
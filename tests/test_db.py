@@ -0,0 +1,56 @@
+import gc
+import sqlite3
+import threading
+
+from db import Database, AUTO_VACUUM_INCREMENTAL
+from db_maintenance import DatabaseMaintenance
+
+
+def test_connections_of_finished_threads_are_closed(tmp_path):
+    """Streamlit runs every rerun in a new thread: their connections must not pile up."""
+    database = Database(str(tmp_path / "detections.db"))
+    database.writer()
+
+    def rerun():
+        database.reader().execute("SELECT 1").fetchone()
+
+    for _ in range(20):
+        thread = threading.Thread(target=rerun)
+        thread.start()
+        thread.join()
+    gc.collect()
+    assert database.stats()["open_connections"] == 1  # Only the writer of this thread
+    assert database.opened == 21
+
+    database.close()
+    assert database.stats()["open_connections"] == 0
+    database.writer().execute("SELECT 1")  # Reconnects after close()
+    database.close_all()
+
+
+def test_legacy_files_are_converted_by_the_maintenance_job(tmp_path):
+    """Opening a file never runs the one-time VACUUM; the first maintenance cycle does."""
+    path = str(tmp_path / "detections.db")
+    with sqlite3.connect(path) as legacy:  # Created before incremental auto-vacuum
+        legacy.execute("CREATE TABLE old_rows (x)")
+        legacy.executemany("INSERT INTO old_rows VALUES (?)", [("x" * 1000,)] * 200)
+    database = Database(path)
+    assert database.reader().execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    maintenance = DatabaseMaintenance(database, str(tmp_path / "report.yaml"), min_free_pages=1)
+    maintenance.run_once()
+    conn = database.writer()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    with conn:
+        conn.execute("DELETE FROM old_rows")
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+    assert maintenance.run_once()["free_pages"] == 0
+    database.close_all()
+
+
+def test_new_files_use_incremental_vacuum_at_once(tmp_path):
+    database = Database(str(tmp_path / "detections.db"))
+    assert database.writer().execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    database.close_all()
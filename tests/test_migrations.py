@@ -0,0 +1,34 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import partitions
+from migrations import migrate, epoch_ms
+
+
+def test_legacy_detections_are_partitioned(tmp_path):
+    """A pre-migration database: text timestamps, one unreadable, more hours than the view can hold."""
+    path = str(tmp_path / "detections.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE detections (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, vehicle_id TEXT, "
+        "x_position REAL, y_position REAL, direction TEXT, image BLOB)"
+    )
+    start = datetime(2026, 1, 1)
+    hours = partitions.MAX_PARTITIONS + 100
+    rows = [((start + timedelta(hours=hour)).strftime("%Y-%m-%d %H:%M:%S"),) for hour in range(hours)]
+    conn.executemany("INSERT INTO detections (timestamp) VALUES (?)", rows + [("not a date",)])
+    conn.commit()
+    conn.close()
+
+    migrate(path)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*), COUNT(timestamp), MAX(id) FROM detections").fetchone() == (
+        hours + 1, hours, hours + 1
+    )
+    indexes = partitions.list_partitions(conn)
+    assert len(indexes) == partitions.MAX_PARTITIONS
+    # The row without a timestamp and the oldest hours share the first partition
+    assert indexes[0] == 0
+    assert partitions.partition_bounds(conn, 0)[1] == epoch_ms(start + timedelta(hours=101))
+    assert conn.execute("SELECT last_id FROM detection_sequence").fetchone() == (hours + 1,)
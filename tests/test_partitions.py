@@ -0,0 +1,94 @@
+import sqlite3
+
+import partitions
+from migrations import migrate
+
+HOUR_MS = partitions.PARTITION_MS
+
+
+def detection(timestamp, vehicle_id="1"):
+    """INSERT_DETECTION_SQL values (without the id) of one detection."""
+    return (timestamp, vehicle_id, 10.0, 20.0, "descending", None, "cam0", 50.0, 90.0)
+
+
+def open_database(tmp_path):
+    path = str(tmp_path / "detections.db")
+    migrate(path)
+    return sqlite3.connect(path)
+
+
+def test_more_hours_than_the_view_can_hold(tmp_path):
+    """Weeks without an upload: every hour keeps being stored and the view keeps working."""
+    conn = open_database(tmp_path)
+    hours = 600  # Over SQLite's 500 terms per compound SELECT
+    first_hour = 480000
+    for hour in range(first_hour, first_hour + hours):
+        with conn:
+            partitions.insert_detections(conn, [detection(hour * HOUR_MS + 1000), detection(hour * HOUR_MS + 2000)])
+
+    indexes = partitions.list_partitions(conn)
+    assert len(indexes) == partitions.MAX_PARTITIONS
+    assert conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0] == 2 * hours
+    ids = [row[0] for row in partitions.read_after(conn, ("id", "timestamp"), 0, float("inf"), 10 * hours)]
+    assert ids == list(range(1, 2 * hours + 1))
+    # The newest partition took the hours that found no room, and says so
+    newest = indexes[-1]
+    assert partitions.partition_bounds(conn, newest) == (newest * HOUR_MS, (first_hour + hours) * HOUR_MS)
+    assert partitions.read_latest(conn, ("timestamp",), 1) == [((first_hour + hours - 1) * HOUR_MS + 2000,)]
+
+    # Once the backlog is uploaded, the sealed partitions go and new hours get their own partition again
+    end_ms = (first_hour + hours) * HOUR_MS
+    sealed = partitions.uploaded_partitions(conn, 2 * hours, end_ms)
+    assert sealed == indexes
+    with conn:
+        partitions.drop_partitions(conn, sealed)
+        partitions.insert_detections(conn, [detection(end_ms + 1000)])
+    assert partitions.list_partitions(conn)[0] == first_hour + hours
+    assert conn.execute("SELECT id FROM detections").fetchall() == [(2 * hours + 1,)]
+
+
+def test_partitions_are_created_a_day_at_a_time(tmp_path):
+    conn = open_database(tmp_path)
+    first_hour = 480000
+    with conn:
+        partitions.insert_detections(conn, [detection(first_hour * HOUR_MS)])
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    for hour in range(first_hour + 1, first_hour + partitions.PARTITIONS_AHEAD):
+        with conn:
+            partitions.insert_detections(conn, [detection(hour * HOUR_MS)])
+    # The view was not rebuilt for the following hours
+    assert conn.execute("PRAGMA schema_version").fetchone()[0] == schema_version
+    assert partitions.list_partitions(conn) == list(range(first_hour, first_hour + partitions.PARTITIONS_AHEAD))
+
+
+def test_new_partitions_roll_back_with_their_rows(tmp_path):
+    """The DDL of a new partition and the view rebuild are part of the writer's transaction."""
+    conn = open_database(tmp_path)
+    try:
+        with conn:
+            partitions.insert_detections(conn, [detection(480000 * HOUR_MS)])
+            raise RuntimeError("The batch fails after creating the partitions")
+    except RuntimeError:
+        pass
+    assert partitions.list_partitions(conn) == []
+    assert conn.execute("SELECT COUNT(*) FROM detections").fetchone() == (0,)
+
+
+def test_the_view_never_names_a_dropped_partition(tmp_path):
+    """A drop committed after the writer looked at the partitions cannot leave the view broken."""
+    conn = open_database(tmp_path)
+    other = sqlite3.connect(str(tmp_path / "detections.db"), timeout=0)
+    with conn:
+        partitions.insert_detections(conn, [detection(480000 * HOUR_MS)])
+    with conn:
+        partitions.drop_partitions(conn, [480000])
+        # The writer cannot read the list of partitions until the drop is committed
+        try:
+            with other:
+                partitions.insert_detections(other, [detection(480001 * HOUR_MS)])
+            raise AssertionError("The writer got the write lock during the drop")
+        except sqlite3.OperationalError as e:
+            assert "locked" in str(e)
+    with other:
+        partitions.insert_detections(other, [detection(490000 * HOUR_MS)])
+    assert conn.execute("SELECT COUNT(*) FROM detections").fetchone() == (1,)
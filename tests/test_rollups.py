@@ -0,0 +1,47 @@
+import depthai as dai
+
+import vehicles_tracker
+from rollups import MinuteRollups, VEHICLES, NEW_VEHICLES, SAMPLES
+
+
+class QueueWriter:
+    """Stands in for the DetectionWriter: keeps the queued rows."""
+
+    def __init__(self):
+        self.rows = []
+
+    def put(self, params, statement=None):
+        self.rows.append(params)
+        return True
+
+
+def tracklet(tracklet_id, status, y):
+    t = dai.Tracklet()
+    t.id = tracklet_id
+    t.label = 2
+    t.status = status
+    t.roi = dai.Rect(dai.Point2f(0.45, y), dai.Point2f(0.55, y + 0.1))
+    t.srcImgDetection = dai.ImgDetection()
+    return t
+
+
+def test_a_vehicle_is_counted_once_over_its_whole_track():
+    """NEW, TRACKED x 9, REMOVED: one new vehicle, one vehicle, and the track is forgotten at the end."""
+    Status = dai.Tracklet.TrackingStatus
+    tracker = vehicles_tracker.VehicleTracker(homography=None)
+    writer = QueueWriter()
+    rollups = MinuteRollups(writer, tracker, vehicles_tracker.DIRECTION_NAMES, camera_id="cam0", flush_interval=3600)
+    minute = 1_800_000_000_000 - 1_800_000_000_000 % 60000
+    statuses = [Status.NEW] + [Status.TRACKED] * 9 + [Status.REMOVED]
+    for frame, status in enumerate(statuses):
+        batch = vehicles_tracker.TrackletBatch([tracklet(7, status, 0.1 + 0.05 * frame)], 1024, 576)
+        tracker.update_batch(batch, frame / 20)
+        rows = batch.selected.nonzero()[0]
+        rollups.update(batch, rows, minute + frame * 50)
+    rollups.flush()
+
+    assert sum(row[4 + NEW_VEHICLES] for row in writer.rows) == 1
+    assert sum(row[4 + VEHICLES] for row in writer.rows) == 1
+    assert sum(row[4 + SAMPLES] for row in writer.rows) == 10  # The REMOVED row is not an observation
+    assert {row[2] for row in writer.rows} <= {"undefined", "ascending", "descending"}
+    assert rollups.tracks == set()
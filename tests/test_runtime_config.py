@@ -0,0 +1,29 @@
+import sqlite3
+
+from migrations import migrate
+from runtime_config import RuntimeConfig
+
+
+def test_only_config_changes_are_applied(tmp_path):
+    """Commits to other tables move data_version but must not reload (or log) the config."""
+    path = str(tmp_path / "detections.db")
+    migrate(path)
+    other = sqlite3.connect(path)
+    with other:
+        other.execute("INSERT OR REPLACE INTO config (id, send_image, refresh_rate) VALUES (1, 1, 2.0)")
+
+    config = RuntimeConfig(path, poll_interval=0)
+    assert config.refresh(force=True)
+    assert (config.send_image, config.refresh_rate) == (True, 2.0)
+
+    with other:
+        other.execute("CREATE TABLE unrelated (x)")
+        other.execute("INSERT INTO unrelated VALUES (1)")
+    assert not config.refresh()
+    assert not config.refresh()  # Nothing committed since the last poll
+
+    with other:
+        other.execute("UPDATE config SET refresh_rate = 1.0 WHERE id = 1")
+    assert config.refresh()
+    assert (config.send_image, config.refresh_rate) == (True, 1.0)
+    config.close()
@@ -0,0 +1,15 @@
+import tracklet_log
+
+
+def test_every_session_gets_its_own_log(tmp_path):
+    """run_camera opens a recorder on every reconnect retry: none may truncate an earlier recording."""
+    path = str(tmp_path / "tracklets.bin")
+    recorders = [tracklet_log.TrackletRecorder(path, 1024, 576) for _ in range(3)]
+    for recorder in recorders:
+        recorder.close()
+
+    paths = [recorder.path for recorder in recorders]
+    assert len(set(paths)) == 3
+    for log_path in paths:
+        assert log_path.startswith(str(tmp_path / "tracklets_")) and log_path.endswith(".bin")
+        assert tracklet_log.TrackletLog(log_path).preview_width == 1024
@@ -0,0 +1,56 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import fastapi_server
+import guardar_horario
+import partitions
+
+HOUR_MS = partitions.PARTITION_MS
+
+
+@pytest.fixture
+def master(monkeypatch):
+    """The /subir-detecciones endpoint of fastapi_server, with the rows it stores kept in a list."""
+    stored = []
+    monkeypatch.setattr(fastapi_server, "store_data_batch", stored.extend)
+    client = TestClient(fastapi_server.app)
+
+    def post(url, json=None, data=None, headers=None, timeout=None):
+        return client.post("/subir-detecciones", json=json, content=data, headers=headers)
+
+    monkeypatch.setattr(guardar_horario.requests, "post", post)
+
+    def no_retry(seconds):
+        raise AssertionError("The chunk was rejected and would be retried forever")
+
+    monkeypatch.setattr(guardar_horario.time, "sleep", no_retry)
+    return stored
+
+
+@pytest.mark.parametrize("upload_format", ["columnar", "json"])
+def test_rows_without_timestamp_do_not_stop_the_upload(master, monkeypatch, upload_format):
+    encodings = list(guardar_horario.batch_codec.ENCODINGS) + [None] if upload_format == "columnar" else [None]
+    monkeypatch.setattr(guardar_horario, "upload_encodings", encodings)
+    monkeypatch.setattr(guardar_horario, "UPLOAD_CHUNK_SIZE", 2)
+    conn = guardar_horario.database.writer()
+    start_id = guardar_horario.get_upload_cursor()
+    first_hour = 480000
+    with conn:
+        # Legacy rows whose text timestamp could not be converted (migration 4 keeps them in partition 0)
+        partitions.create_partition(conn, 0)
+        partitions.create_view(conn)
+        insert = partitions.INSERT_DETECTION_SQL.format(table=partitions.partition_table(0))
+        for row_id in (start_id + 1, start_id + 2):
+            conn.execute(insert, (row_id, None, "legacy", 1.0, 2.0, "ascending", None, None, None, None))
+        conn.execute("UPDATE detection_sequence SET last_id = ?", (start_id + 2,))
+        partitions.insert_detections(
+            conn, [(first_hour * HOUR_MS + i, str(i), 1.0, 2.0, "descending", None, "cam0", 50.0, 90.0) for i in range(3)]
+        )
+
+    uploaded, skipped, last_id = guardar_horario.upload_detections(start_id, (first_hour + 1) * HOUR_MS)
+
+    assert (uploaded, skipped, last_id) == (3, 2, start_id + 5)
+    assert guardar_horario.get_upload_cursor() == start_id + 5
+    assert [row[1] for row in master] == ["0", "1", "2"]
+    with conn:
+        partitions.drop_partitions(conn, partitions.list_partitions(conn))
@@ -0,0 +1,112 @@
+from collections import defaultdict
+
+import depthai as dai
+import numpy as np
+import pytest
+
+import vehicles_tracker
+from vehicles_tracker import MAX_HISTORY, MAX_HISTORY_POSITIONS, ASCENDING, DESCENDING
+
+Status = dai.Tracklet.TrackingStatus
+FPS = 20
+HALF_BOX = 0.02
+
+
+def tracklet(tracklet_id, status, x, y):
+    """Tracklet whose box is centered on the normalized point (x, y)."""
+    t = dai.Tracklet()
+    t.id = tracklet_id
+    t.label = 2
+    t.status = status
+    t.roi = dai.Rect(dai.Point2f(x - HALF_BOX, y - HALF_BOX), dai.Point2f(x + HALF_BOX, y + HALF_BOX))
+    t.srcImgDetection = dai.ImgDetection()
+    return t
+
+
+def test_rolling_statistics_match_a_full_recount():
+    """The O(1) slope and direction counts against np.polyfit and a recount of every window, on random tracks."""
+    rng = np.random.default_rng(7)
+    tracker = vehicles_tracker.VehicleTracker(homography=None)
+    starts = {tracklet_id: int(rng.integers(0, 30)) for tracklet_id in range(12)}
+    steps = {tracklet_id: rng.normal(0, 0.01) for tracklet_id in starts}  # Drift per frame, up or down
+    y = {tracklet_id: rng.uniform(0.3, 0.7) for tracklet_id in starts}
+    ys = defaultdict(list)  # tracklet_id -> every y fed to the tracker
+    directions = defaultdict(list)  # tracklet_id -> every direction the tracker returned
+
+    for frame in range(90):
+        tracklets = []
+        for tracklet_id, start in starts.items():
+            if frame < start:
+                continue
+            y[tracklet_id] = float(np.clip(y[tracklet_id] + steps[tracklet_id] + rng.normal(0, 0.004), 0.05, 0.95))
+            status = Status.NEW if frame == start else Status.TRACKED
+            tracklets.append(tracklet(tracklet_id, status, 0.5, y[tracklet_id]))
+        batch = vehicles_tracker.TrackletBatch(tracklets, 1024, 576)
+        tracker.update_batch(batch, frame / FPS)
+
+        ids = batch.ids.tolist()
+        for row, tracklet_id in enumerate(ids):
+            ys[tracklet_id].append(batch.centroids[row, 1])
+            directions[tracklet_id].append(int(batch.direction[row]))
+        slots = np.array([tracker.slots[tracklet_id] for tracklet_id in ids], dtype=np.int64)
+        samples = tracker.samples[slots]
+        lengths = np.minimum(samples, MAX_HISTORY)
+        displacement = tracker._slope_displacement(slots, samples, lengths)
+
+        for row, tracklet_id in enumerate(ids):
+            window = np.array(ys[tracklet_id][-MAX_HISTORY:])
+            if len(window) >= 2:
+                expected = np.polyfit(np.arange(len(window)), window, 1)[0] * (len(window) - 1)
+            else:
+                expected = 0.0
+            assert displacement[row] == pytest.approx(expected, abs=1e-9)
+
+            history = directions[tracklet_id][-MAX_HISTORY_POSITIONS:]
+            slot = tracker.slots[tracklet_id]
+            assert tracker.ascending_count[slot] == history.count(ASCENDING)
+            assert tracker.descending_count[slot] == history.count(DESCENDING)
+            assert batch.ascending_count[row] == history.count(ASCENDING)
+            assert list(tracker.direction_history(tracklet_id)) == [vehicles_tracker.DIRECTION_NAMES[d] for d in history]
+
+    assert {ASCENDING, DESCENDING} <= {d for history in directions.values() for d in history}
+
+
+def run_constant_velocity(tracker, pixels, width, height):
+    """Feeds the (frames, 2) pixel positions of one vehicle; returns its last (speed, heading)."""
+    for frame, (x, y) in enumerate(pixels.tolist()):
+        status = Status.NEW if frame == 0 else Status.TRACKED
+        batch = vehicles_tracker.TrackletBatch([tracklet(1, status, x / width, y / height)], width, height)
+        tracker.update_batch(batch, frame / FPS)
+    return tracker.velocity(1)
+
+
+def test_kalman_speed_converges_in_pixels():
+    width, height = 1024, 576
+    velocity = np.array([120.0, -45.0])  # px/s
+    pixels = np.array([200.0, 400.0]) + velocity * (np.arange(3 * FPS)[:, np.newaxis] / FPS)
+    tracker = vehicles_tracker.VehicleTracker(homography=None)
+
+    speed, heading = run_constant_velocity(tracker, pixels, width, height)
+
+    assert speed == pytest.approx(np.hypot(*velocity), rel=0.01)
+    assert heading == pytest.approx(np.degrees(np.arctan2(velocity[1], velocity[0])) % 360, abs=1.0)
+
+
+def test_kalman_speed_converges_on_the_ground():
+    """Constant velocity on the ground plane, seen through a perspective homography (not constant in pixels)."""
+    width, height = 1024, 576
+    homography = np.array([[0.05, 0.01, -2.0], [0.0, 0.08, -5.0], [0.0, 0.0005, 1.0]])
+    velocity = np.array([4.0, 6.0])  # m/s
+    start = vehicles_tracker.VehicleTracker(homography=homography).to_world(np.array([[150.0, 100.0]]))[0]
+    ground = start + velocity * (np.arange(3 * FPS)[:, np.newaxis] / FPS)
+    projected = np.hstack([ground, np.ones((len(ground), 1))]) @ np.linalg.inv(homography).T
+    pixels = projected[:, :2] / projected[:, 2:3]
+    assert (pixels >= 0).all() and (pixels[:, 0] < width).all() and (pixels[:, 1] < height).all()
+    step = np.diff(pixels, axis=0)
+    assert not np.allclose(step, step[0], rtol=0.01)  # Perspective: not a constant velocity in pixels
+    tracker = vehicles_tracker.VehicleTracker(homography=homography)
+
+    speed, heading = run_constant_velocity(tracker, pixels, width, height)
+
+    assert speed == pytest.approx(np.hypot(*velocity) * tracker.speed_factor, rel=0.01)
+    assert heading == pytest.approx(np.degrees(np.arctan2(velocity[1], velocity[0])), abs=1.0)
@@ -0,0 +1,112 @@
+"""
+Compares the JSON upload of detection batches with the columnar binary
+batches (app/batch_codec.py): bytes on the wire, encoding time on the edge
+and parse time in fastapi_server (parse_data_batch, the code the endpoint
+runs before storing the rows).
+
+    python benchmark_upload_format.py                  # synthetic per-frame detections
+    python benchmark_upload_format.py --db ../data/detections.db
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_DIR)
+os.chdir(APP_DIR)  # The config is read relative to app/
+
+import batch_codec
+import fastapi_server
+from detection_archive import COLUMN_NAMES
+from migrations import epoch_ms, format_epoch_ms
+
+
+def synthetic_rows(count, fps=20, vehicles=10):
+    """Per-frame rows like camera_service stores them: a few vehicles crossing a 1024x576 preview."""
+    rows = []
+    timestamp = epoch_ms()
+    tracks = {}
+    next_id = 1
+    while len(rows) < count:
+        timestamp += 1000 // fps
+        while len(tracks) < vehicles:
+            tracks[next_id] = [random.uniform(0, 1024), random.uniform(0, 576), random.uniform(-8, 8), random.uniform(-4, 4)]
+            next_id += 1
+        for vehicle_id, track in list(tracks.items()):
+            track[0] += track[2]
+            track[1] += track[3]
+            if not (0 <= track[0] < 1024 and 0 <= track[1] < 576):
+                del tracks[vehicle_id]
+                continue
+            direction = "ascending" if track[2] > 0 else "descending"
+            rows.append((
+                len(rows) + 1, timestamp, str(vehicle_id), round(track[0]), round(track[1]), direction, "cam0",
+                round(random.uniform(20, 120), 2), round(random.uniform(0, 360), 1),
+            ))
+    return rows[:count]
+
+
+def database_rows(db_path, count):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f"SELECT {', '.join(COLUMN_NAMES)} FROM detections ORDER BY id LIMIT ?", (count,)).fetchall()
+    conn.close()
+    return rows
+
+
+def json_body(rows):
+    """The body guardar_horario posts in JSON mode (requests serializes json= with json.dumps)."""
+    return json.dumps([
+        {
+            "id": row[0], "timestamp": format_epoch_ms(row[1]), "vehicle_id": row[2], "x_position": row[3],
+            "y_position": row[4], "direction": row[5], "camera_id": row[6], "speed": row[7], "heading": row[8],
+        }
+        for row in rows
+    ]).encode()
+
+
+def best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="Take the rows from this detections database instead of generating them")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Batch sizes (rows), comma separated")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    all_rows = database_rows(args.db, max(sizes)) if args.db else synthetic_rows(max(sizes))
+    print(f"{'rows':>6} {'format':<16} {'bytes':>10} {'B/row':>7} {'ratio':>6} {'encode ms':>10} {'parse ms':>9}")
+    for size in sizes:
+        rows = all_rows[:size]
+        body = json_body(rows)
+        json_bytes = len(body)
+        formats = [("json", lambda: json_body(rows), body, "application/json", None)]
+        for encoding in batch_codec.ENCODINGS:
+            formats.append((
+                f"columnar+{encoding}", lambda encoding=encoding: batch_codec.encode_rows(rows, encoding),
+                batch_codec.encode_rows(rows, encoding), batch_codec.CONTENT_TYPE, encoding,
+            ))
+        for name, encode, payload, content_type, encoding in formats:
+            encode_time = best_time(encode, args.repeat)
+            parse_time = best_time(
+                lambda: fastapi_server.parse_data_batch(payload, content_type, encoding), args.repeat
+            )
+            print(
+                f"{len(rows):>6} {name:<16} {len(payload):>10} {len(payload) / len(rows):>7.1f} "
+                f"{json_bytes / len(payload):>6.1f} {encode_time * 1000:>10.2f} {parse_time * 1000:>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,17 @@
-import sqlite3
 import os
+import sys
+
+# El esquema está en app/migrations.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from migrations import migrate, SCHEMA_VERSION
 
 # Ruta de la base de datos
 DB_PATH = "detections.db"
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS detections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            vehicle_id TEXT,
-            x_position REAL,
-            y_position REAL,
-            direction TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+    # Crea la base de datos o la actualiza a la última versión del esquema
+    version = migrate(DB_PATH)
+    print(f"Base de datos {DB_PATH}: versión {version} -> {SCHEMA_VERSION}")
 
 # Inicializar la base de datos
 init_db()
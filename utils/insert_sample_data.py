@@ -3,6 +3,12 @@ from datetime import datetime, timedelta
 import random
 import logging
 import os
+import sys
+
+# The schema lives in app/migrations.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from migrations import epoch_ms, migrate
+from partitions import insert_detections
 
 # Configure logging
 LOG_DIR = "logs"
@@ -22,40 +28,27 @@ def insert_sample_data(db_path="detections.db", num_records=100):
     """
     conn = None
     try:
+        # Ensure the tables exist with the current schema
+        migrate(db_path)
         conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Ensure the table exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS detections (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                vehicle_id TEXT,
-                x_position REAL,
-                y_position REAL,
-                direction TEXT,
-                image BLOB
-            )
-        """)
+        rows = []
 
         for i in range(num_records):
             # Generate random data
-            timestamp = (datetime.now() - timedelta(minutes=random.randint(60, 65))).strftime("%Y-%m-%d %H:%M:%S")  # Up to 24 hours ago
+            timestamp = epoch_ms(datetime.now() - timedelta(minutes=random.randint(60, 65)))  # Up to 24 hours ago
             logging.info(timestamp)
             vehicle_id = f"vehicle-{random.randint(1, 1000)}"
             x_position = random.uniform(0, 640)  # Assuming a 640x480 frame
             y_position = random.uniform(0, 480)
             directions = ["ascending", "descending", "static", "unknown"]
             direction = random.choice(directions)
-            image_data = None #no image
+            image_key = None #no image
 
-            # Insert the data
-            cursor.execute(
-                "INSERT INTO detections (timestamp, vehicle_id, x_position, y_position, direction, image) VALUES (?, ?, ?, ?, ?, ?)",
-                (timestamp, vehicle_id, x_position, y_position, direction, image_data),
-            )
+            rows.append((timestamp, vehicle_id, x_position, y_position, direction, image_key, None, None, None))
 
-        conn.commit()
+        # Into the hourly partitions, with ids from the detection sequence
+        with conn:
+            insert_detections(conn, rows)
         logging.info(f"✅ Inserted {num_records} sample records into {db_path}")
 
     except sqlite3.Error as e: